@@ -0,0 +1,506 @@
+"""
+Local HTTP API for the POS and the back-office spreadsheet
+
+Run next to the Streamlit app:
+
+    python api_server.py --db rumbar.db --port 8502
+
+With --watch DIR, new POS day reports in DIR are imported and deducted
+automatically (see report_watcher.py). With --archive DIR, every imported
+report is also added to the out-of-core sales archive (see sales_archive.py).
+Generic products ("Divers. ...") are deducted with the allocation groups the
+app stores in the database (see product_allocation.py). Like in the app, what
+an ingredient cannot cover is deducted from and counted with its substitutes
+(the substitution groups of the app, see substitutions.py).
+
+Endpoints:
+    GET  /health                        Status of the service
+    POST /reports[?report_id=...]       Import a day report (any format of report_formats.py as request body)
+    POST /reports/<report_id>/depletion Deduct an imported report from the inventory (once)
+    GET  /inventory                     Current inventory
+    GET  /availability                  Number of drinks that can be made (also with substitutes)
+    GET  /shopping-list[?format=csv][&top=N]
+                                        Ingredients with low stock, most urgent first
+    GET  /par-levels[?lead_time=2&review_period=7&service_level=0.95]
+                                        Recommended target stock from the sales history
+    GET  /usage?ingredient=...[&from=YYYY-MM-DD][&to=YYYY-MM-DD][&period=month]
+                                        Ingredient usage per period from the sales archive
+    GET  /metrics                       Counters and durations in the Prometheus text format
+    GET  /menu-board[.json]             Guest menu of the drinks that can be made (HTML or JSON)
+
+With --menu-board DIR, menu.html and menu.json are also written to DIR
+whenever a drink crosses the availability thresholds (see menu_board.py).
+
+With --log-file FILE (or --log-level), the logs of all modules are written as
+JSON lines (see metrics.py).
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+from functools import partial
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from data_processor import (
+    process_inventory_data, process_recipe_data,
+    update_inventory_based_on_sales, calculate_available_drinks,
+    export_low_stock_warnings_to_csv
+)
+from low_stock_tracker import (
+    create_low_stock_tracker, update_tracker_stock, set_tracker_velocity, get_urgent_warnings,
+    calculate_sales_velocity
+)
+from report_formats import parse_sales_report
+from substitutions import build_substitute_index, calculate_available_drinks_with_substitutes
+from menu_board import create_menu_board, update_menu_board
+from par_levels import create_par_model, update_par_model, calculate_par_levels
+from product_allocation import build_allocation
+from sales_history import create_sales_history, add_sales_report
+from sales_archive import add_report_to_archive, calculate_archive_ingredient_usage
+from report_watcher import process_new_reports, log_report_result
+from storage import (
+    ConnectionPool, get_storage_version, load_frames, save_inventory, save_recipes,
+    save_sales_report, load_sales_reports, is_depletion_applied, deplete_stored_inventory
+)
+from metrics import configure_logging, get_logger, log_error, log_event, render_prometheus
+
+logger = get_logger('api_server')
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+HTTP_STATUS_TEXT = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable"
+}
+
+class ApiState:
+    """
+    Data shared by all requests of the API process
+
+    Inventory, recipes and the sales history are loaded from storage at
+    startup and kept in memory. The database stays the single source of
+    truth: inventory, recipes and allocation groups are loaded again before
+    a request whenever the app or the report watcher has changed them (see
+    refresh). Availability is computed once per change and then served from
+    memory. Low stock warnings are kept in a low stock tracker that only
+    recalculates the ingredients that changed. Imported reports are also
+    added to the sales archive if one is configured.
+    """
+
+    def __init__(self, pool, archive_dir=None, menu_board_dir=None):
+        self.pool = pool
+        self.archive_dir = archive_dir
+        self.menu_board = create_menu_board(menu_board_dir)
+        self.lock = asyncio.Lock()
+        self.storage_version = None
+        self.inventory_data = None
+        self.recipe_data = None
+        self.allocation_groups = None
+        self._allocation = None
+        self.substitution_groups = None
+        self._substitute_index = None
+        self.sales_reports = {}
+        self.sales_history = create_sales_history()
+        self._derived = None
+        self.low_stock_tracker = None
+        self.par_model = None
+
+        for report_id, sales_data in load_sales_reports(pool):
+            self.sales_reports[report_id] = sales_data
+            add_sales_report(self.sales_history, sales_data, report_id)
+        self.refresh()
+
+    def refresh(self):
+        """Load inventory, recipes and allocation groups again if they were changed in the database"""
+        if get_storage_version(self.pool) == self.storage_version:
+            return
+        self.storage_version, frames = load_frames(self.pool)
+        if not _frames_equal(frames['recipes'], self.recipe_data):
+            # Neue Rezepte: Tracker und Par-Modell neu aufbauen
+            self.recipe_data = frames['recipes']
+            self.low_stock_tracker = None
+            self.par_model = None
+            self._allocation = None
+        if not _frames_equal(frames['allocation_groups'], self.allocation_groups):
+            self.allocation_groups = frames['allocation_groups']
+            self._allocation = None
+        if self._substitute_index is None or not _frames_equal(frames['substitution_groups'],
+                                                               self.substitution_groups):
+            self.substitution_groups = frames['substitution_groups']
+            self._substitute_index = build_substitute_index(self.substitution_groups)
+        self.set_inventory(frames['inventory'])
+
+    def is_ready(self):
+        """Check whether inventory and recipes are available"""
+        return self.inventory_data is not None and self.recipe_data is not None
+
+    def get_sales_velocity(self):
+        """Get the drinks sold per day from the sales history"""
+        velocity = calculate_sales_velocity(self.sales_history, self.recipe_data)
+        return dict(zip(velocity['drink_name'], velocity['drinks_per_day']))
+
+    def get_par_model(self):
+        """Get the par level model, converting only new day reports into ingredient usage"""
+        if self.par_model is None:
+            self.par_model = create_par_model(self.recipe_data)
+        self.par_model = update_par_model(self.par_model, self.sales_history)
+        return self.par_model
+
+    def get_allocation(self):
+        """Get the allocation of generic POS products, rebuilt after new day reports or changed groups"""
+        if self._allocation is None:
+            self._allocation = build_allocation(self.allocation_groups, self.recipe_data, self.sales_history)
+        return self._allocation
+
+    def get_substitute_index(self):
+        """Get the substitute index of the stored substitution groups (rebuilt in refresh when they change)"""
+        return self._substitute_index
+
+    def get_derived_data(self):
+        """Get availability (also with substitutes) and low stock warnings, computing them only after a change"""
+        if self._derived is None:
+            if self.low_stock_tracker is None:
+                self.low_stock_tracker = create_low_stock_tracker(self.recipe_data, self.inventory_data,
+                                                                  sales_velocity=self.get_sales_velocity())
+            else:
+                update_tracker_stock(self.low_stock_tracker, self.inventory_data)
+
+            self._derived = {
+                'available_drinks': calculate_available_drinks(self.recipe_data, self.inventory_data),
+                'substitute_availability': calculate_available_drinks_with_substitutes(
+                    self.recipe_data, self.inventory_data, self._substitute_index, self.get_sales_velocity()),
+                'low_stock_warnings': get_urgent_warnings(self.low_stock_tracker)
+            }
+        return self._derived
+
+    def set_inventory(self, inventory_data):
+        """Replace the in-memory inventory and invalidate the derived data"""
+        self.inventory_data = inventory_data
+        self._derived = None
+
+    def get_menu_board(self):
+        """Get the menu board, rendered again only if a drink crossed a threshold since the last call"""
+        if self.is_ready():
+            update_menu_board(self.menu_board, self.get_derived_data()['available_drinks'])
+        return self.menu_board
+
+    def add_report(self, report_id, sales_data):
+        """Add a day report to the sales history (and archive) and update the sales velocity of the warnings"""
+        add_sales_report(self.sales_history, sales_data, report_id)
+        if self.archive_dir:
+            add_report_to_archive(self.archive_dir, sales_data, report_id)
+        self.sales_reports[report_id] = sales_data
+        self._allocation = None
+        if self.low_stock_tracker is not None:
+            set_tracker_velocity(self.low_stock_tracker, self.get_sales_velocity())
+            self._derived = None
+
+def _frames_equal(old_df, new_df):
+    """Check whether two frames (or None) have the same content"""
+    if old_df is None or new_df is None:
+        return old_df is new_df
+    return old_df.equals(new_df)
+
+def _json_default(value):
+    """Convert numpy/pandas scalars for json.dumps"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def json_response(status, data):
+    """Build a JSON response tuple"""
+    return status, "application/json; charset=utf-8", json.dumps(data, default=_json_default, ensure_ascii=False).encode()
+
+def _records(df):
+    """Convert a DataFrame into a list of dictionaries"""
+    return [] if df is None else df.to_dict(orient='records')
+
+async def import_report(state, body, query):
+    """POST /reports: parse a day report and add it to storage and the sales history"""
+    if not body:
+        return json_response(400, {'error': "Request body must contain the day report CSV"})
+
+    loop = asyncio.get_running_loop()
+    try:
+        sales_data = await loop.run_in_executor(None, parse_sales_report, io.BytesIO(body))
+    except Exception as e:
+        return json_response(400, {'error': str(e)})
+
+    report_id = query.get('report_id', [sales_data['date']])[0]
+
+    async with state.lock:
+        await loop.run_in_executor(None, save_sales_report, state.pool, report_id, sales_data)
+        state.add_report(report_id, sales_data)
+
+    return json_response(201, {
+        'report_id': report_id,
+        'date': sales_data['date'],
+        'total_sales': sales_data['total_sales'],
+        'products': len(sales_data['products']),
+        'depletion_applied': await loop.run_in_executor(None, is_depletion_applied, state.pool, report_id)
+    })
+
+async def apply_depletion(state, report_id):
+    """POST /reports/<report_id>/depletion: deduct a report from the inventory exactly once"""
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    if report_id not in state.sales_reports:
+        return json_response(404, {'error': f"Unknown report {report_id}"})
+
+    loop = asyncio.get_running_loop()
+    async with state.lock:
+        if await loop.run_in_executor(None, is_depletion_applied, state.pool, report_id):
+            return json_response(409, {'error': f"Report {report_id} has already been applied"})
+
+        allocation = await loop.run_in_executor(None, state.get_allocation)
+        deplete = partial(update_inventory_based_on_sales, recipe_data=state.recipe_data,
+                          sales_data=state.sales_reports[report_id], allocation=allocation,
+                          substitute_index=state.get_substitute_index())
+        try:
+            # Abgebucht wird der gespeicherte Bestand, damit Änderungen der App erhalten bleiben
+            updated_inventory = await loop.run_in_executor(None, deplete_stored_inventory, state.pool, report_id,
+                                                           deplete)
+        except Exception as e:
+            log_error(logger, "Error applying depletion", e, report_id=report_id)
+            return json_response(500, {'error': "Failed to update inventory"})
+
+        if updated_inventory is None:
+            return json_response(409, {'error': f"Report {report_id} has already been applied"})
+        await loop.run_in_executor(None, state.refresh)
+        await loop.run_in_executor(None, state.get_menu_board)
+
+    return json_response(200, {'report_id': report_id, 'depletion_applied': True})
+
+async def get_availability(state):
+    """GET /availability"""
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    loop = asyncio.get_running_loop()
+    async with state.lock:
+        derived = await loop.run_in_executor(None, state.get_derived_data)
+    return json_response(200, _records(derived['substitute_availability']))
+
+async def get_shopping_list(state, query):
+    """GET /shopping-list"""
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    loop = asyncio.get_running_loop()
+    try:
+        top = int(query['top'][0]) if 'top' in query else None
+    except ValueError:
+        return json_response(400, {'error': "top must be a number"})
+
+    async with state.lock:
+        await loop.run_in_executor(None, state.get_derived_data)
+        warnings = get_urgent_warnings(state.low_stock_tracker, top)
+
+    if query.get('format', ['json'])[0] == 'csv':
+        csv_data = export_low_stock_warnings_to_csv(warnings) or b""
+        return 200, "text/csv; charset=utf-8", csv_data
+    return json_response(200, warnings)
+
+async def get_par_levels(state, query):
+    """GET /par-levels"""
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    try:
+        lead_time = float(query.get('lead_time', [2])[0])
+        review_period = float(query.get('review_period', [7])[0])
+        service_level = float(query.get('service_level', [0.95])[0])
+    except ValueError:
+        return json_response(400, {'error': "lead_time, review_period and service_level must be numbers"})
+    if not 0 < service_level < 1:
+        return json_response(400, {'error': "service_level must be between 0 and 1"})
+
+    loop = asyncio.get_running_loop()
+    async with state.lock:
+        par_model = await loop.run_in_executor(None, state.get_par_model)
+        par_levels = await loop.run_in_executor(None, calculate_par_levels, par_model,
+                                                lead_time, review_period, service_level)
+    return json_response(200, _records(par_levels))
+
+async def get_usage(state, query):
+    """GET /usage"""
+    if not state.archive_dir:
+        return json_response(503, {'error': "No sales archive configured (start with --archive DIR)"})
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    if 'ingredient' not in query:
+        return json_response(400, {'error': "ingredient is required"})
+    period_type = query.get('period', ['month'])[0]
+    if period_type not in ('day', 'week', 'month', 'year'):
+        return json_response(400, {'error': "period must be day, week, month or year"})
+
+    loop = asyncio.get_running_loop()
+    usage = await loop.run_in_executor(None, calculate_archive_ingredient_usage, state.archive_dir, state.recipe_data,
+                                       query['ingredient'], period_type, query.get('from', [None])[0],
+                                       query.get('to', [None])[0])
+    if usage is None:
+        return json_response(400, {'error': "from and to must be dates (YYYY-MM-DD)"})
+    return json_response(200, _records(usage))
+
+async def get_menu_board(state, board_format):
+    """GET /menu-board and /menu-board.json"""
+    if not state.is_ready():
+        return json_response(503, {'error': "Inventory and recipes are not loaded"})
+    loop = asyncio.get_running_loop()
+    async with state.lock:
+        board = await loop.run_in_executor(None, state.get_menu_board)
+    if board_format == 'json':
+        return 200, "application/json; charset=utf-8", board['json'].encode()
+    return 200, "text/html; charset=utf-8", board['html'].encode()
+
+async def dispatch(state, method, target, body):
+    """Route a request to its handler"""
+    url = urlsplit(target)
+    path = [unquote(part) for part in url.path.strip('/').split('/') if part]
+    query = parse_qs(url.query)
+
+    # Änderungen der App und des Report-Watchers übernehmen
+    async with state.lock:
+        await asyncio.get_running_loop().run_in_executor(None, state.refresh)
+
+    routes = {
+        ('GET', 'health'): lambda: json_response(200, {'status': 'ok', 'ready': state.is_ready()}),
+        ('GET', 'inventory'): lambda: json_response(200, _records(state.inventory_data)),
+        ('GET', 'availability'): lambda: get_availability(state),
+        ('GET', 'shopping-list'): lambda: get_shopping_list(state, query),
+        ('GET', 'par-levels'): lambda: get_par_levels(state, query),
+        ('GET', 'usage'): lambda: get_usage(state, query),
+        ('GET', 'menu-board'): lambda: get_menu_board(state, 'html'),
+        ('GET', 'menu-board.json'): lambda: get_menu_board(state, 'json'),
+        ('GET', 'metrics'): lambda: (200, "text/plain; version=0.0.4; charset=utf-8", render_prometheus().encode()),
+        ('POST', 'reports'): lambda: import_report(state, body, query),
+    }
+
+    if len(path) == 1 and (method, path[0]) in routes:
+        response = routes[(method, path[0])]()
+        return await response if asyncio.iscoroutine(response) else response
+    if len(path) == 3 and path[0] == 'reports' and path[2] == 'depletion':
+        if method != 'POST':
+            return json_response(405, {'error': "Use POST"})
+        return await apply_depletion(state, path[1])
+    return json_response(404, {'error': f"Unknown endpoint {method} {url.path}"})
+
+async def handle_connection(state, reader, writer):
+    """Serve HTTP/1.1 requests of one client connection (with keep-alive)"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+
+            try:
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            content_length = int(headers.get('content-length', 0) or 0)
+            if content_length > MAX_BODY_BYTES:
+                status, content_type, payload = json_response(413, {'error': "Request body too large"})
+                headers['connection'] = 'close'
+            else:
+                body = await reader.readexactly(content_length) if content_length else b""
+                try:
+                    status, content_type, payload = await dispatch(state, method.upper(), target, body)
+                except Exception as e:
+                    log_error(logger, "Error handling request", e, method=method, target=target)
+                    status, content_type, payload = json_response(500, {'error': str(e)})
+
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write((
+                f"HTTP/1.1 {status} {HTTP_STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            ).encode('latin-1') + payload)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def watch_reports(state, directory, interval):
+    """Import new day reports from a directory and update the shared state"""
+    loop = asyncio.get_running_loop()
+    log_event(logger, logging.INFO, "Watching report directory", directory=directory, interval=interval)
+
+    while True:
+        try:
+            async with state.lock:
+                await loop.run_in_executor(None, state.refresh)
+                allocation = await loop.run_in_executor(None, state.get_allocation) if state.is_ready() else None
+                results = await loop.run_in_executor(
+                    None, partial(process_new_reports, state.pool, directory, allocation=allocation,
+                                  substitute_index=state.get_substitute_index()))
+                for result in results:
+                    log_report_result(result)
+                    if result['sales_data'] is not None:
+                        state.add_report(result['report_id'], result['sales_data'])
+                if any(result['status'] == 'applied' for result in results):
+                    await loop.run_in_executor(None, state.refresh)
+                    await loop.run_in_executor(None, state.get_menu_board)
+        except Exception as e:
+            log_error(logger, "Error watching report directory", e, directory=directory)
+        await asyncio.sleep(interval)
+
+async def run_server(host, port, pool, watch_directory=None, watch_interval=10, archive_dir=None,
+                     menu_board_dir=None):
+    """Load the shared state and serve requests until cancelled"""
+    state = ApiState(pool, archive_dir, menu_board_dir)
+    state.get_menu_board()
+    if watch_directory:
+        asyncio.create_task(watch_reports(state, watch_directory, watch_interval))
+
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(state, reader, writer), host, port)
+    log_event(logger, logging.INFO, "RumBar API listening", url=f"http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP API for the RumBar Warenwirtschaft")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--db", default="rumbar.db", help="SQLite database file")
+    parser.add_argument("--pool-size", type=int, default=4, help="Number of pooled database connections")
+    parser.add_argument("--inventory", help="Inventory CSV to load into the database before starting")
+    parser.add_argument("--recipes", help="Recipe CSV to load into the database before starting")
+    parser.add_argument("--watch", help="Directory to import new POS day reports from")
+    parser.add_argument("--watch-interval", type=float, default=10, help="Seconds between two scans")
+    parser.add_argument("--archive", help="Directory of the out-of-core sales archive")
+    parser.add_argument("--menu-board", help="Directory to write the guest menu board (menu.html, menu.json) to")
+    parser.add_argument("--log-file", help="Write JSON log lines to this file instead of stderr")
+    parser.add_argument("--log-level", default="INFO", help="Minimum log level (DEBUG, INFO, WARNING, ERROR)")
+    args = parser.parse_args()
+
+    configure_logging(getattr(logging, args.log_level.upper(), logging.INFO), args.log_file)
+
+    pool = ConnectionPool(args.db, size=args.pool_size)
+    if args.inventory:
+        save_inventory(pool, process_inventory_data(args.inventory))
+    if args.recipes:
+        save_recipes(pool, process_recipe_data(args.recipes))
+
+    try:
+        asyncio.run(run_server(args.host, args.port, pool, args.watch, args.watch_interval, args.archive,
+                               args.menu_board))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+
+if __name__ == "__main__":
+    main()
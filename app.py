@@ -1,21 +1,40 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
 import os
-import io
 import sys
+import uuid
 
 # Sicherstellen, dass das aktuelle Verzeichnis im Python-Pfad ist
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Die Rechenmodule (und damit pandas) werden erst in den Seiten importiert, die sie
+# brauchen. So ist die erste Seite nach einem Kaltstart sofort da.
 from helpers import display_header, display_footer, load_demo_data
-from data_processor import (
-    process_sales_data, process_recipe_data, process_inventory_data,
-    update_inventory_based_on_sales, calculate_drink_costs,
-    calculate_available_drinks, get_low_stock_warnings,
-    update_recipe_data, update_inventory_data, calculate_sales_summary,
-    export_low_stock_warnings_to_csv
-)
+from metrics import configure_logging, write_metrics_file
+
+# Gemeinsame Datenbank von App, api_server.py und report_watcher.py: Lagerbestand, Rezepte und
+# Verteilung der Sammelprodukte werden bei jeder Änderung dort gespeichert
+RUMBAR_DB_PATH = os.environ.get("RUMBAR_DB_PATH", "rumbar.db")
+
+# Verzeichnis für menu.html/menu.json des Bildschirms hinter der Bar (nicht gesetzt: nur in der App)
+RUMBAR_MENU_BOARD_DIR = os.environ.get("RUMBAR_MENU_BOARD_DIR")
+
+# Speicherbudget aller Sitzungen; darüber werden Sitzungen im Leerlauf auf die Platte ausgelagert
+RUMBAR_SESSION_BUDGET_MB = float(os.environ.get("RUMBAR_SESSION_BUDGET_MB", "512"))
+RUMBAR_SPILL_DIR = os.environ.get("RUMBAR_SPILL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   ".session_spill"))
+
+# JSON-Logs (nicht gesetzt: stderr) und Metrikdatei im Prometheus-Textformat (nicht gesetzt: keine)
+RUMBAR_LOG_FILE = os.environ.get("RUMBAR_LOG_FILE")
+RUMBAR_LOG_LEVEL = os.environ.get("RUMBAR_LOG_LEVEL", "INFO")
+RUMBAR_METRICS_FILE = os.environ.get("RUMBAR_METRICS_FILE")
+
+@st.cache_resource
+def setup_logging():
+    """Configure the JSON logging once per server process"""
+    import logging
+    configure_logging(getattr(logging, RUMBAR_LOG_LEVEL.upper(), logging.INFO), RUMBAR_LOG_FILE)
+
+setup_logging()
 
 # Set page config
 st.set_page_config(
@@ -46,32 +65,363 @@ if 'low_stock_warnings' not in st.session_state:
 if 'sales_summary' not in st.session_state:
     st.session_state.sales_summary = None
 
+if 'low_stock_thresholds' not in st.session_state:
+    st.session_state.low_stock_thresholds = None
+
+if 'price_history' not in st.session_state:
+    st.session_state.price_history = None
+
+if 'substitution_groups' not in st.session_state:
+    st.session_state.substitution_groups = None
+
+if 'substitute_availability' not in st.session_state:
+    st.session_state.substitute_availability = None
+
+if 'allocation_groups' not in st.session_state:
+    st.session_state.allocation_groups = None
+
+if 'sales_history' not in st.session_state:
+    st.session_state.sales_history = None
+
+if 'stock_ledger' not in st.session_state:
+    st.session_state.stock_ledger = None
+
+# Created on first use (see get_version_store)
+if 'workspace_versions' not in st.session_state:
+    st.session_state.workspace_versions = None
+
+# Undo-Version, die zuletzt angezeigt wurde (siehe restore_version)
+if 'shown_version_id' not in st.session_state:
+    st.session_state.shown_version_id = None
+
+# Gezähltes Bargeld pro Tag für den Kassenabschluss ({YYYY-MM-DD: Betrag})
+if 'cash_counts' not in st.session_state:
+    st.session_state.cash_counts = {}
+
+# Id der Streamlit-Sitzung, damit geschlossene Sitzungen erkannt werden (siehe is_session_open)
+if 'session_id' not in st.session_state:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    script_run_ctx = get_script_run_ctx()
+    st.session_state.session_id = script_run_ctx.session_id if script_run_ctx is not None else uuid.uuid4().hex
+
+@st.cache_resource
+def get_session_budget():
+    """Get the memory budget shared by all sessions of this server process"""
+    from session_budget import create_session_budget
+    return create_session_budget(RUMBAR_SPILL_DIR, RUMBAR_SESSION_BUDGET_MB)
+
+# Zwischenergebnisse der Sitzung liegen im Sitzungsspeicher,
+# damit sie bei Leerlauf ausgelagert werden können (siehe session_budget.py)
+if 'session_store' not in st.session_state:
+    from session_budget import register_session
+    st.session_state.session_store = register_session(get_session_budget(), st.session_state.session_id)
+
+def is_session_open(session_id):
+    """Check whether a browser tab is still connected to a session of this server"""
+    from streamlit import runtime
+    return not runtime.exists() or runtime.get_instance().is_active_session(session_id)
+
+def get_session_value(name):
+    """Get a value of the session store (par_model, allocation, chart_series)"""
+    from session_budget import get_session_value as get_value
+    return get_value(get_session_budget(), st.session_state.session_store, name)
+
+def set_session_value(name, value):
+    """Set a value of the session store"""
+    from session_budget import set_session_value as set_value
+    set_value(get_session_budget(), st.session_state.session_store, name, value)
+
+def get_sales_history():
+    """Get the sales history shared by all sessions (all day reports stored in the database)"""
+    if st.session_state.sales_history is None:
+        from sales_history import create_sales_history
+        st.session_state.sales_history = create_sales_history()
+    return st.session_state.sales_history
+
+def get_version_store():
+    """Get the version store of the session, creating it on first use"""
+    if st.session_state.workspace_versions is None:
+        from snapshots import create_version_store
+        st.session_state.workspace_versions = create_version_store()
+    return st.session_state.workspace_versions
+
+def get_par_model():
+    """Get the par level model of the session, updated to the current sales history and recipes"""
+    from par_levels import create_par_model, update_par_model
+    par_model = get_session_value('par_model')
+    if par_model is None:
+        par_model = create_par_model(st.session_state.recipe_data)
+    par_model = update_par_model(par_model, get_sales_history(), st.session_state.recipe_data)
+    set_session_value('par_model', par_model)
+    return par_model
+
+def get_allocation():
+    """Get the allocation vectors of generic POS products, rebuilt when groups, recipes or sales change"""
+    from product_allocation import build_allocation
+    groups, recipes = st.session_state.allocation_groups, st.session_state.recipe_data
+    revision = get_sales_history()['revision']
+    cached = get_session_value('allocation')
+    if cached is None or cached['groups'] is not groups or cached['recipes'] is not recipes \
+            or cached['revision'] != revision:
+        cached = {'groups': groups, 'recipes': recipes, 'revision': revision,
+                  'allocation': build_allocation(groups, recipes, get_sales_history())}
+        set_session_value('allocation', cached)
+    return cached['allocation']
+
+def get_chart_series():
+    """Get the downsampled history charts, rebuilt only when inventory, recipes, sales or deliveries change"""
+    from chart_series import build_chart_series
+    allocation = get_allocation()
+    ledger = st.session_state.stock_ledger
+    sources = (st.session_state.inventory_data, st.session_state.recipe_data, ledger, allocation)
+    revision = get_sales_history()['revision']
+    cached = get_session_value('chart_series')
+    if cached is None or cached['revision'] != revision or any(
+            old is not new for old, new in zip(cached['sources'], sources)):
+        cached = {'sources': sources, 'revision': revision,
+                  'series': build_chart_series(st.session_state.inventory_data, st.session_state.recipe_data,
+                                               get_sales_history(), ledger, allocation)}
+        set_session_value('chart_series', cached)
+    return cached['series']
+
+def get_stock_ledger():
+    """Get the stock ledger shared by all sessions (an empty ledger until the first delivery or count)"""
+    if st.session_state.stock_ledger is None:
+        from stock_ledger import create_stock_ledger
+        return create_stock_ledger()
+    return st.session_state.stock_ledger
+
+# Inventory, recipes and derived data are shared by all sessions (one workspace per server process)
+
+if 'workspace_version' not in st.session_state:
+    st.session_state.workspace_version = None
+
+if 'imported_files' not in st.session_state:
+    st.session_state.imported_files = set()
+
+@st.cache_resource
+def get_workspace():
+    """Get the workspace shared by all sessions of this server process, stored in the shared database"""
+    from shared_workspace import create_shared_workspace
+    from storage import ConnectionPool
+    return create_shared_workspace(pool=ConnectionPool(RUMBAR_DB_PATH))
+
+workspace = get_workspace()
+
+@st.cache_resource
+def get_menu_board():
+    """
+    Get the menu board of this server process and its lock, updated after every change of stock or recipes
+
+    The board is shared by all sessions: its thresholds and prices are only
+    changed by an explicit action on the dashboard, always under the lock.
+    """
+    import threading
+    from menu_board import create_menu_board, update_menu_board
+    from shared_workspace import add_change_listener, get_derived_data
+    
+    board = create_menu_board(RUMBAR_MENU_BOARD_DIR)
+    board_lock = threading.Lock()
+    
+    def on_change(change):
+        # Die Verfügbarkeit wird pro Version nur einmal berechnet und auch von den Sitzungen genutzt
+        if {'inventory', 'recipes'} & set(change['frames']):
+            with board_lock:
+                update_menu_board(board, get_derived_data(workspace)['available_drinks'])
+    
+    add_change_listener(workspace, on_change)
+    on_change({'frames': ['inventory']})
+    return board, board_lock
+
+# Mit Ausgabeverzeichnis wird die Karte ab dem Start bei jeder Änderung aktuell gehalten
+if RUMBAR_MENU_BOARD_DIR:
+    get_menu_board()
+
+def record_version(label):
+    """Store the current inventory and recipes as a new version for undo/redo"""
+    from snapshots import commit_version
+    commit_version(get_version_store(), {
+        'inventory': st.session_state.inventory_data,
+        'recipes': st.session_state.recipe_data
+    }, label)
+
+def sync_workspace(label=None):
+    """Take over the current state of the shared workspace if it has changed since the last run"""
+    from shared_workspace import get_derived_data, get_changes_since, sync_from_storage
+    
+    # Abbuchungen von API und Report-Watcher übernehmen
+    sync_from_storage(workspace)
+    derived = get_derived_data(workspace)
+    last_version = st.session_state.workspace_version
+    if derived['version'] == last_version:
+        return
+    
+    # Änderungen anderer Sitzungen anzeigen
+    other_changes = []
+    if last_version is not None:
+        other_changes = get_changes_since(workspace, last_version, st.session_state.session_id)
+        for change in other_changes:
+            st.toast(f"Von einer anderen Sitzung geändert: {change['label']}", icon="🔄")
+    
+    st.session_state.inventory_data = derived['frames']['inventory']
+    st.session_state.recipe_data = derived['frames']['recipes']
+    st.session_state.low_stock_thresholds = derived['frames']['low_stock_thresholds']
+    st.session_state.price_history = derived['frames']['price_history']
+    st.session_state.substitution_groups = derived['frames']['substitution_groups']
+    st.session_state.allocation_groups = derived['frames']['allocation_groups']
+    st.session_state.stock_ledger = derived['frames']['stock_ledger']
+    if derived['sales_history'] is not None:
+        st.session_state.sales_history = derived['sales_history']
+    st.session_state.drink_costs = derived['drink_costs']
+    st.session_state.available_drinks = derived['available_drinks']
+    st.session_state.substitute_availability = derived['substitute_availability']
+    st.session_state.low_stock_warnings = derived['low_stock_warnings']
+    st.session_state.workspace_version = derived['version']
+    
+    # Jeder übernommene Stand wird Teil des eigenen Undo-Verlaufs
+    if st.session_state.inventory_data is not None or st.session_state.recipe_data is not None:
+        if other_changes:
+            label = f"Andere Sitzung: {other_changes[-1]['label']}"
+        record_version(label or "Gemeinsamer Stand geladen")
+
+def save_workspace(frames, label):
+    """
+    Store changed frames in the shared workspace
+
+    The change is based on the version this session has last seen. If
+    another session has saved in the meantime, nothing is stored and the
+    session is updated to the new state instead. Prices that differ from
+    the inventory this session has last seen are recorded in the price
+    history from today on.
+
+    Args:
+        frames: Dictionary {'inventory': DataFrame, 'recipes': DataFrame}
+        label: Description of the change
+
+    Returns:
+        bool: True if the change was stored
+    """
+    from shared_workspace import commit_workspace
+    
+    if frames.get('inventory') is not None and 'price_history' not in frames:
+        from datetime import date
+        from price_history import create_price_history, add_price_changes, get_changed_prices
+        # Nur in dieser Änderung geänderte Preise, sonst würden manuell erfasste Preise überschrieben
+        changed_prices = get_changed_prices(st.session_state.inventory_data, frames['inventory'])
+        if not changed_prices.empty:
+            price_history = st.session_state.price_history
+            if price_history is None:
+                price_history = create_price_history()
+            frames = dict(frames, price_history=add_price_changes(price_history, changed_prices, date.today(), label))
+    
+    new_version = commit_workspace(workspace, st.session_state.workspace_version, frames, label,
+                                   st.session_state.session_id)
+    if new_version is None:
+        st.error("Die Daten wurden inzwischen in einer anderen Sitzung oder über die Kasse (API/Report-Watcher) "
+                 "geändert. Ihre Änderung wurde nicht gespeichert - bitte prüfen Sie den aktuellen Stand und führen Sie sie erneut aus.")
+    
+    sync_workspace(label)
+    return new_version is not None
+
+def restore_version(step):
+    """
+    Undo or redo the last change of inventory and recipes
+
+    The step is only taken if the shared state is still the one the user saw
+    when clicking (the version the current snapshot was recorded from), so
+    changes another session, the API or the report watcher made in the
+    meantime are not reverted unseen. The commit itself is checked against
+    the workspace version as well.
+
+    Args:
+        step: snapshots.undo or snapshots.redo
+
+    Returns:
+        bool: True if the version was restored
+    """
+    from snapshots import get_current_version
+    
+    versions = get_version_store()
+    if get_current_version(versions)['version_id'] != st.session_state.shown_version_id:
+        st.sidebar.warning("Inventar oder Rezepte wurden inzwischen geändert (andere Sitzung/Kasse). "
+                           "Bitte prüfen Sie den aktuellen Stand, bevor Sie etwas rückgängig machen.")
+        return False
+    frames = step(versions)
+    return save_workspace({'inventory': frames.get('inventory'), 'recipes': frames.get('recipes')},
+                          "Rückgängig/Wiederholen")
+
+def is_new_upload(uploaded_file):
+    """Check whether an uploaded file has not been imported in this session yet"""
+    return uploaded_file.file_id not in st.session_state.imported_files
+
+sync_workspace()
+
 # Display header
 display_header()
 
 # Sidebar
 st.sidebar.title("Navigation")
-page = st.sidebar.radio("Seite auswählen", ["Dashboard", "Lagerbestand", "Rezepte", "Verkaufsdaten"])
+page = st.sidebar.radio("Seite auswählen", ["Dashboard", "Lagerbestand", "Rezepte", "Verkaufsdaten", "Inventur"])
 
 # Load demo data option
 if st.sidebar.button("Demo-Daten laden"):
-    st.session_state.inventory_data, st.session_state.recipe_data = load_demo_data()
+    inventory_data, recipe_data = load_demo_data()
     
-    if st.session_state.recipe_data is not None and st.session_state.inventory_data is not None:
-        # Calculate derived data
-        st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-        st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-        st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
-        st.sidebar.success("Demo-Daten erfolgreich geladen!")
-        st.rerun()
+    if recipe_data is not None and inventory_data is not None:
+        if save_workspace({'inventory': inventory_data, 'recipes': recipe_data}, "Demo-Daten geladen"):
+            st.sidebar.success("Demo-Daten erfolgreich geladen!")
+            st.rerun()
     else:
         st.sidebar.error("Fehler beim Laden der Demo-Daten.")
 
-# Reset application data
-if st.sidebar.button("Alle Daten zurücksetzen"):
-    for key in st.session_state.keys():
-        del st.session_state[key]
-    st.rerun()
+# Undo/redo changes to inventory and recipes
+versions = st.session_state.workspace_versions
+if versions is not None:
+    from snapshots import undo, redo, can_undo, can_redo
+col1, col2 = st.sidebar.columns(2)
+with col1:
+    if st.button("↩️ Rückgängig", disabled=versions is None or not can_undo(versions)):
+        if restore_version(undo):
+            st.rerun()
+with col2:
+    if st.button("↪️ Wiederholen", disabled=versions is None or not can_redo(versions)):
+        if restore_version(redo):
+            st.rerun()
+if versions is not None:
+    from snapshots import get_current_version
+    st.session_state.shown_version_id = get_current_version(versions)['version_id']
+
+# Reset application data (also for all other sessions), only after confirmation
+confirm_reset = st.sidebar.checkbox("Alle Daten für alle Sitzungen löschen")
+if st.sidebar.button("Alle Daten zurücksetzen", disabled=not confirm_reset):
+    from shared_workspace import WORKSPACE_FRAMES
+    if save_workspace({name: None for name in WORKSPACE_FRAMES}, "Alle Daten zurückgesetzt"):
+        from session_budget import forget_session
+        forget_session(get_session_budget(), st.session_state.session_id)
+        for key in st.session_state.keys():
+            del st.session_state[key]
+        st.rerun()
+
+# Andere Sitzungen regelmäßig auf Änderungen prüfen
+@st.fragment(run_every=5)
+def watch_workspace():
+    """Rerun the page when another session, the API or the report watcher has changed the shared workspace"""
+    from shared_workspace import sync_from_storage
+    if sync_from_storage(workspace) != st.session_state.workspace_version:
+        st.rerun()
+
+with st.sidebar:
+    watch_workspace()
+
+# Sitzungen im Leerlauf auslagern, wenn alle zusammen mehr als das Speicherbudget brauchen
+from session_budget import enforce_session_budget, get_memory_usage, measure_session
+enforce_session_budget(get_session_budget(), st.session_state.session_id, is_session_open)
+memory_usage = get_memory_usage(get_session_budget())
+st.sidebar.caption(
+    f"Sitzungsspeicher: {measure_session(st.session_state.session_store) / 1024 ** 2:.1f} MB, "
+    f"alle {memory_usage['sessions']} Sitzungen {memory_usage['used_bytes'] / 1024 ** 2:.1f} "
+    f"von {memory_usage['budget_bytes'] / 1024 ** 2:.0f} MB ({memory_usage['spilled_sessions']} ausgelagert)"
+)
 
 # Dashboard Page
 if page == "Dashboard":
@@ -86,6 +436,11 @@ if page == "Dashboard":
         with col2:
             st.info("2. Importieren Sie Ihre Lagerbestand- und Rezeptdaten in den entsprechenden Bereichen")
     else:
+        import pandas as pd
+        from data_processor import export_low_stock_warnings_to_csv
+        from sales_history import list_periods, get_top_sellers, get_group_revenue, get_period_summary
+        from margin_analysis import calculate_drink_margins, classify_menu_items, get_unmapped_products
+        
         # Display summary statistics
         col1, col2, col3 = st.columns(3)
         
@@ -120,8 +475,8 @@ if page == "Dashboard":
         # Display low stock warnings
         st.subheader("Warnungen bei niedrigem Lagerbestand")
         if st.session_state.low_stock_warnings and len(st.session_state.low_stock_warnings) > 0:
+            # Dringlichste zuerst: wenigste Tage bis leer bei aktueller Verkaufsgeschwindigkeit
             warning_df = pd.DataFrame(st.session_state.low_stock_warnings)
-            warning_df = warning_df.sort_values('max_drinks_possible', ascending=True)
             st.dataframe(warning_df, use_container_width=True)
             
             # Export to CSV button
@@ -146,11 +501,144 @@ if page == "Dashboard":
             avail_df = st.session_state.available_drinks.sort_values('max_drinks_possible', ascending=True)
             st.dataframe(avail_df, use_container_width=True)
         
+        # Drinks, die nur dank Ersatzzutaten (siehe Lagerbestand > Ersatzzutaten) verkaufbar bleiben
+        substitute_df = st.session_state.substitute_availability
+        if substitute_df is not None and (substitute_df['substitutions'] != "").any():
+            st.write("Mit Ersatzzutaten weiter verkaufbar")
+            st.dataframe(substitute_df[substitute_df['substitutions'] != ""], use_container_width=True)
+
+        # Guest-facing menu board, only rendered again when a drink crosses a threshold
+        with st.expander("Getränkekarte für den Bildschirm"):
+            from menu_board import update_menu_board, get_menu_prices, set_menu_board_options
+            from shared_workspace import get_derived_data
+
+            board, board_lock = get_menu_board()
+            # Die Karte gilt für alle Sitzungen, daher nur auf Knopfdruck ändern
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                min_drinks = st.number_input("Ausblenden unter (Drinks)", min_value=1, value=board['min_drinks'])
+            with col2:
+                few_drinks = st.number_input("\"Nur noch wenige\" unter (Drinks)", min_value=int(min_drinks),
+                                             value=max(board['few_drinks'], int(min_drinks)))
+            with col3:
+                show_prices = st.checkbox("Preise aus dem letzten Monat", value=bool(board['prices']))
+            if st.button("Karte übernehmen"):
+                prices = get_menu_prices(get_sales_history(), st.session_state.recipe_data) if show_prices else {}
+                try:
+                    with board_lock:
+                        set_menu_board_options(board, int(min_drinks), int(few_drinks), prices)
+                        update_menu_board(board, get_derived_data(workspace)['available_drinks'])
+                except ValueError as e:
+                    st.error(f"Ungültige Grenzen: {str(e)}")
+
+            if RUMBAR_MENU_BOARD_DIR:
+                st.caption(f"Wird bei jeder Änderung nach {RUMBAR_MENU_BOARD_DIR}/menu.html geschrieben")
+            if board['html'] is not None:
+                st.write(f"{len(board['menu'])} Drinks, Stand {board['generated_at'].strftime('%d.%m.%Y %H:%M')}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button("📥 Karte als HTML", data=board['html'], file_name="menu.html",
+                                       mime="text/html")
+                with col2:
+                    st.download_button("📥 Karte als JSON", data=board['json'], file_name="menu.json",
+                                       mime="application/json")
+                st.dataframe(board['menu'], use_container_width=True)
+
         # Display drink costs
         st.subheader("Drink Kosten")
         if st.session_state.drink_costs is not None:
             cost_df = st.session_state.drink_costs.sort_values('total_cost', ascending=False)
             st.dataframe(cost_df, use_container_width=True)
+        
+        # Display sales analytics from the sales history rollups
+        st.subheader("Verkaufsanalyse")
+        period_labels = {'day': "Tag", 'week': "Woche", 'month': "Monat", 'year': "Jahr"}
+        col1, col2 = st.columns(2)
+        with col1:
+            period_type = st.selectbox("Zeitraum", list(period_labels.keys()), index=2,
+                                       format_func=lambda key: period_labels[key])
+        sales_history = get_sales_history()
+        periods = list_periods(sales_history, period_type)
+        
+        if periods:
+            with col2:
+                period_key = st.selectbox(period_labels[period_type], periods[::-1])
+            
+            period_summary = get_period_summary(sales_history, period_type, period_key)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Umsatz im Zeitraum", f"€{period_summary['total_value']:.2f}")
+            with col2:
+                st.metric("Meistverkaufter Drink im Zeitraum", period_summary['most_sold_drink'])
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("Top-Seller")
+                st.dataframe(get_top_sellers(sales_history, period_type, period_key),
+                             use_container_width=True)
+            with col2:
+                st.write("Umsatz nach Warengruppe")
+                st.dataframe(get_group_revenue(sales_history, period_type, period_key),
+                             use_container_width=True)
+            
+            # Margins per drink (cached per recipe version, price version and period),
+            # each day costed with the prices in effect on that day
+            st.write("Margen pro Drink")
+            margins_df = calculate_drink_margins(sales_history, st.session_state.recipe_data,
+                                                 st.session_state.inventory_data, period_type, period_key,
+                                                 price_history=st.session_state.price_history)
+            if margins_df is not None and not margins_df.empty:
+                st.dataframe(margins_df.drop(columns=['period']), use_container_width=True)
+            
+            # Menu engineering: popularity x contribution margin (cached per period like the margins)
+            st.write("Menu Engineering")
+            menu_df = classify_menu_items(sales_history, st.session_state.recipe_data,
+                                          st.session_state.inventory_data, period_type, period_key,
+                                          price_history=st.session_state.price_history)
+            if menu_df is not None and not menu_df.empty:
+                class_labels = {'Star': "Stars", 'Plowhorse': "Plowhorses", 'Puzzle': "Puzzles", 'Dog': "Dogs"}
+                class_counts = menu_df['menu_class'].value_counts()
+                for column, (menu_class, label) in zip(st.columns(len(class_labels)), class_labels.items()):
+                    with column:
+                        st.metric(label, int(class_counts.get(menu_class, 0)))
+                st.dataframe(menu_df.drop(columns=['period']), use_container_width=True)
+            
+            unmapped_df = get_unmapped_products(sales_history, st.session_state.recipe_data,
+                                                period_type, period_key)
+            if not unmapped_df.empty:
+                st.caption(f"{len(unmapped_df)} Produkte ohne passendes Rezept sind nicht in den Margen enthalten: "
+                           + ", ".join(unmapped_df['product_name']))
+        else:
+            st.info("Noch keine Verkaufsdaten in der Verkaufshistorie")
+        
+        # History charts from precomputed series with at most a few hundred points per line
+        chart_series = get_chart_series() if periods else None
+        if chart_series is not None:
+            st.subheader("Verlauf")
+            stock_tab, sales_tab, group_tab = st.tabs(["Lagerbestand", "Verkäufe pro Produkt",
+                                                       "Umsatz nach Warengruppe"])
+            with stock_tab:
+                stock_series = chart_series['stock']
+                stock_names = sorted(stock_series['name'].unique())
+                if stock_names:
+                    # Vorauswahl: Zutaten mit Bestandswarnung
+                    warned = [warning['ingredient_name'] for warning in st.session_state.low_stock_warnings or []]
+                    selected = st.multiselect("Zutaten", stock_names,
+                                              default=[name for name in warned if name in stock_names][:5]
+                                              or stock_names[:3], key="stock_chart_ingredients")
+                    st.caption("Bestand am Tagesende, rückgerechnet aus aktuellem Bestand, Verkäufen und Lieferungen")
+                    st.line_chart(stock_series[stock_series['name'].isin(selected)], x='date', y='value',
+                                  color='name', x_label="Datum", y_label="Bestand (ml)")
+            with sales_tab:
+                sales_series = chart_series['product_sales']
+                top_products = sales_series.groupby('name')['value'].sum().nlargest(5).index.tolist()
+                selected = st.multiselect("Produkte", sorted(sales_series['name'].unique()), default=top_products,
+                                          key="sales_chart_products")
+                st.line_chart(sales_series[sales_series['name'].isin(selected)], x='date', y='value',
+                              color='name', x_label="Datum", y_label="Verkauft")
+            with group_tab:
+                st.line_chart(chart_series['group_revenue'], x='date', y='value', color='name',
+                              x_label="Datum", y_label="Umsatz (€)")
 
 # Inventory Management Page
 elif page == "Lagerbestand":
@@ -160,23 +648,66 @@ elif page == "Lagerbestand":
     st.subheader("Import Inventory Data")
     inventory_file = st.file_uploader("Upload Inventory CSV File", type=["csv"])
     
-    if inventory_file is not None:
+    # Eine hochgeladene Datei nur einmal importieren, nicht bei jedem Neuladen der Seite
+    if inventory_file is not None and is_new_upload(inventory_file):
         try:
-            st.session_state.inventory_data = process_inventory_data(inventory_file)
-            st.success("Inventory data imported successfully!")
-            
-            # Recalculate derived data if recipe data is available
-            if st.session_state.recipe_data is not None:
-                st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
+            from data_processor import process_inventory_data
+            if save_workspace({'inventory': process_inventory_data(inventory_file)}, "Lagerbestand importiert"):
+                st.session_state.imported_files.add(inventory_file.file_id)
+                st.success("Inventory data imported successfully!")
         except Exception as e:
             st.error(f"Error importing inventory data: {str(e)}")
-    
+
+    # Goods receipt: delivery notes/invoices in bottles or cases, posted to the stock in one step
+    if st.session_state.inventory_data is not None:
+        st.subheader("Wareneingang importieren")
+        st.caption("CSV mit 'Zutat' und 'Geliefert (ml)', 'Geliefert (Flaschen)' oder 'Geliefert (Kisten)', "
+                   "optional 'Flaschengröße (ml)', 'Flaschen pro Kiste' und 'Einkaufspreis pro Liter (EUR)', "
+                   "'Preis pro Flasche (EUR)' oder 'Gesamtpreis (EUR)'")
+        delivery_date = st.date_input("Lieferdatum")
+        delivery_file = st.file_uploader("Upload Delivery CSV File", type=["csv"])
+
+        if delivery_file is not None:
+            try:
+                from data_processor import process_delivery_data
+                from stock_ledger import add_delivery, apply_delivery_to_inventory, get_unknown_delivery_items
+                from price_history import create_price_history, add_price_changes
+
+                delivery_data = process_delivery_data(delivery_file, delivery_date)
+                st.dataframe(delivery_data, use_container_width=True)
+                unknown_df = get_unknown_delivery_items(st.session_state.inventory_data, delivery_data)
+                if not unknown_df.empty:
+                    st.warning(f"{len(unknown_df)} Zutaten sind nicht im Lagerbestand und werden nicht gebucht: "
+                               + ", ".join(unknown_df['ingredient_name']))
+
+                if not is_new_upload(delivery_file):
+                    st.info("Dieser Wareneingang wurde bereits gebucht.")
+                elif st.button("Wareneingang buchen"):
+                    known = delivery_data[~delivery_data['ingredient_name'].isin(unknown_df['ingredient_name'])]
+                    label = f"Wareneingang {delivery_file.name}"
+                    price_history = st.session_state.price_history
+                    if price_history is None:
+                        price_history = create_price_history()
+                    # Einkaufspreise gelten ab dem Lieferdatum
+                    price_history = add_price_changes(price_history, known.dropna(subset=['price_per_liter']),
+                                                      delivery_date, label)
+                    updated_inventory = apply_delivery_to_inventory(st.session_state.inventory_data, known)
+                    # Bestand und Lagerbuch gemeinsam speichern, damit die Lieferung im Soll-Ist-Vergleich erscheint
+                    if save_workspace({'inventory': updated_inventory, 'price_history': price_history,
+                                       'stock_ledger': add_delivery(get_stock_ledger(), known, delivery_file.name)},
+                                      label):
+                        st.session_state.imported_files.add(delivery_file.file_id)
+                        st.success(f"Wareneingang mit {len(known)} Zutaten gebucht!")
+            except Exception as e:
+                st.error(f"Error importing delivery data: {str(e)}")
+
     # Display and edit inventory data
     st.subheader("Current Inventory")
     
     if st.session_state.inventory_data is not None:
+        from data_processor import update_inventory_data
+        from snapshots import list_versions, diff_versions
+        
         # Allow editing inventory
         edited_inventory = st.data_editor(
             st.session_state.inventory_data,
@@ -192,15 +723,179 @@ elif page == "Lagerbestand":
         
         # Update button
         if st.button("Update Inventory"):
-            st.session_state.inventory_data = update_inventory_data(edited_inventory)
+            if save_workspace({'inventory': update_inventory_data(edited_inventory)}, "Lagerbestand bearbeitet"):
+                st.success("Inventory updated successfully!")
+
+        # Export in the layout of the office spreadsheet (bottle columns, German numbers)
+        with st.expander("Export als Lagerbestandstabelle"):
+            import io
+            from importlib.util import find_spec
+            from spreadsheet_export import read_spreadsheet_layout, export_inventory_to_spreadsheet
+
+            st.caption("Optional die aktuelle Tabelle als Vorlage hochladen: Spalten, Zusatzspalten und nicht "
+                       "geänderte Zellen bleiben dann unverändert.")
+            layout_file = st.file_uploader("Vorlage (Lagerbestand CSV)", type=["csv"], key="spreadsheet_layout")
+            recalculate_bottles = st.checkbox(
+                "Flaschenspalten geänderter Zeilen neu berechnen (ml / 700)", value=False,
+                help="Sonst bleiben die von Hand gepflegten Flaschenwerte der Vorlage erhalten.")
+            try:
+                layout = read_spreadsheet_layout(layout_file) if layout_file is not None else None
+                formats = ['csv', 'xlsx'] if find_spec('openpyxl') is not None else ['csv']
+                for column, file_format in zip(st.columns(len(formats)), formats):
+                    output = io.BytesIO()
+                    export_inventory_to_spreadsheet(st.session_state.inventory_data, output, layout, file_format,
+                                                    recalculate_bottles=recalculate_bottles)
+                    with column:
+                        st.download_button(
+                            label=f"Als {file_format.upper()} herunterladen",
+                            data=output.getvalue(),
+                            file_name=f"Warenwirtschaft Rumbar - Lagerbestand.{file_format}",
+                            mime="text/csv" if file_format == 'csv' else
+                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+            except Exception as e:
+                st.error(str(e))
+
+        # Version history with diff between two versions
+        with st.expander("Versionsverlauf"):
+            versions_df = list_versions(get_version_store())
+            st.dataframe(versions_df, use_container_width=True)
+            
+            if len(versions_df) > 1:
+                version_ids = versions_df['version_id'].tolist()
+                col1, col2 = st.columns(2)
+                with col1:
+                    old_version_id = st.selectbox("Von Version", version_ids, index=len(version_ids) - 2)
+                with col2:
+                    new_version_id = st.selectbox("Bis Version", version_ids, index=len(version_ids) - 1)
+                st.dataframe(diff_versions(get_version_store(), old_version_id, new_version_id,
+                                           'inventory', 'ingredient_name'),
+                             use_container_width=True)
+        
+        # Recommended target stock from the sales history
+        with st.expander("Auto-Par: Soll-Bestand aus Verkäufen"):
+            from par_levels import calculate_par_levels, apply_par_levels
             
-            # Recalculate derived data
-            if st.session_state.recipe_data is not None:
-                st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
+            par_model = get_par_model() if st.session_state.recipe_data is not None else None
+            if par_model is None or not par_model['daily_usage']:
+                st.info("Für Auto-Par werden Rezepte und importierte Verkaufsdaten benötigt.")
+            else:
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    lead_time_days = st.number_input("Lieferzeit (Tage)", min_value=0, value=2)
+                with col2:
+                    review_period_days = st.number_input("Bestellrhythmus (Tage)", min_value=1, value=7)
+                with col3:
+                    service_level = st.slider("Servicegrad", min_value=0.5, max_value=0.999, value=0.95)
+                
+                par_df = calculate_par_levels(par_model, lead_time_days, review_period_days, service_level)
+                par_df = par_df.merge(st.session_state.inventory_data[['ingredient_name', 'target_stock_ml']]
+                                      .drop_duplicates('ingredient_name'), on='ingredient_name', how='left')
+                st.caption(f"Grundlage: {len(par_model['daily_usage'])} Verkaufstage der letzten "
+                           f"{par_model['window_days']} Tage")
+                st.dataframe(par_df[par_df['mean_daily_usage_ml'] > 0], use_container_width=True)
+                
+                if st.button("Empfohlenen Soll-Bestand übernehmen"):
+                    updated_inventory = apply_par_levels(st.session_state.inventory_data, par_df)
+                    if save_workspace({'inventory': updated_inventory}, "Soll-Bestand aus Auto-Par übernommen"):
+                        st.success("Soll-Bestand aktualisiert!")
+        
+        # Price history with effective dates and drink costs at any date
+        with st.expander("Preisverlauf"):
+            import pandas as pd
+            from datetime import date
+            from price_history import (create_price_history, add_price_changes, apply_prices_in_effect,
+                                       calculate_drink_costs_as_of)
+            
+            price_history = st.session_state.price_history
+            if price_history is None:
+                price_history = create_price_history()
+            
+            with st.form("price_change_form"):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    price_ingredient = st.selectbox("Zutat", st.session_state.inventory_data['ingredient_name'].unique())
+                with col2:
+                    price_value = st.number_input("Preis pro Liter (€)", min_value=0.0, step=0.5)
+                with col3:
+                    price_date = st.date_input("Gültig ab", key="price_effective_date")
+                if st.form_submit_button("Preis erfassen"):
+                    new_price = pd.DataFrame({'ingredient_name': [price_ingredient], 'price_per_liter': [price_value]})
+                    updated_history = add_price_changes(price_history, new_price, price_date, "Manuell erfasst")
+                    frames = {'price_history': updated_history}
+                    # Ein schon gültiger Preis gilt auch für den Lagerbestand (aktuelle Kosten, Margen, Was-wäre-wenn)
+                    if price_date <= date.today():
+                        frames['inventory'] = apply_prices_in_effect(st.session_state.inventory_data, updated_history,
+                                                                     date.today(), [price_ingredient])
+                    if save_workspace(frames, f"Preis für {price_ingredient} erfasst"):
+                        st.success("Preis erfasst!")
+            
+            st.dataframe(price_history, use_container_width=True)
+            
+            cost_date = st.date_input("Drink-Kosten zum Stichtag", key="drink_cost_date")
+            st.dataframe(calculate_drink_costs_as_of(price_history, st.session_state.recipe_data, [cost_date],
+                                                     st.session_state.inventory_data)
+                         if st.session_state.recipe_data is not None else None,
+                         use_container_width=True)
+        
+        # Low stock thresholds per ingredient and per drink (default: 15 drinks)
+        with st.expander("Warnschwellen"):
+            import pandas as pd
+            from low_stock_tracker import THRESHOLD_COLUMNS
+            
+            st.caption("Mindestanzahl Drinks pro Zutat oder Drink. Gelten beide, zählt die höhere Schwelle; "
+                       "ohne Eintrag gilt 15.")
+            thresholds = st.session_state.low_stock_thresholds
+            if thresholds is None:
+                thresholds = pd.DataFrame(columns=THRESHOLD_COLUMNS).astype({'threshold_drinks': float})
+            edited_thresholds = st.data_editor(
+                thresholds,
+                use_container_width=True,
+                num_rows="dynamic",
+                column_config={
+                    "scope": st.column_config.SelectboxColumn("Gilt für", options=["ingredient", "drink"]),
+                    "name": st.column_config.TextColumn("Zutat / Drink"),
+                    "threshold_drinks": st.column_config.NumberColumn("Schwelle (Drinks)", min_value=0)
+                },
+                key="low_stock_threshold_editor"
+            )
+            if st.button("Warnschwellen speichern"):
+                edited_thresholds = edited_thresholds.dropna(subset=['scope', 'name', 'threshold_drinks'])
+                if save_workspace({'low_stock_thresholds': edited_thresholds.reset_index(drop=True)},
+                                  "Warnschwellen geändert"):
+                    st.success("Warnschwellen gespeichert!")
+        
+        # Substitution groups: ingredients that may replace each other 1:1 in all recipes
+        with st.expander("Ersatzzutaten"):
+            from substitutions import create_substitution_groups
             
-            st.success("Inventory updated successfully!")
+            st.caption("Zutaten derselben Gruppe dürfen sich in allen Rezepten 1:1 ersetzen, z.B. zwei London "
+                       "Dry Gins. Zutaten mit niedrigerer Priorität werden als Ersatz bevorzugt.")
+            groups = st.session_state.substitution_groups
+            if groups is None:
+                groups = create_substitution_groups()
+            edited_groups = st.data_editor(
+                groups,
+                use_container_width=True,
+                num_rows="dynamic",
+                column_config={
+                    "group_name": st.column_config.TextColumn("Gruppe"),
+                    "ingredient_name": st.column_config.SelectboxColumn(
+                        "Zutat", options=sorted(st.session_state.inventory_data['ingredient_name'].dropna().unique())),
+                    "priority": st.column_config.NumberColumn("Priorität", min_value=0)
+                },
+                key="substitution_group_editor"
+            )
+            if st.button("Ersatzzutaten speichern"):
+                edited_groups = edited_groups.dropna(subset=['group_name', 'ingredient_name'])
+                if save_workspace({'substitution_groups': edited_groups.reset_index(drop=True)},
+                                  "Ersatzzutaten geändert"):
+                    st.success("Ersatzzutaten gespeichert!")
+            
+            substitute_df = st.session_state.substitute_availability
+            if substitute_df is not None:
+                st.write("Verfügbarkeit mit Ersatzzutaten")
+                st.dataframe(substitute_df.sort_values('max_drinks_with_substitutes'), use_container_width=True)
     else:
         st.info("Please upload inventory data or load demo data from the sidebar.")
 
@@ -212,16 +907,12 @@ elif page == "Rezepte":
     st.subheader("Import Recipe Data")
     recipe_file = st.file_uploader("Upload Recipe CSV File", type=["csv"])
     
-    if recipe_file is not None:
+    if recipe_file is not None and is_new_upload(recipe_file):
         try:
-            st.session_state.recipe_data = process_recipe_data(recipe_file)
-            st.success("Recipe data imported successfully!")
-            
-            # Recalculate derived data if inventory data is available
-            if st.session_state.inventory_data is not None:
-                st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
+            from data_processor import process_recipe_data
+            if save_workspace({'recipes': process_recipe_data(recipe_file)}, "Rezepte importiert"):
+                st.session_state.imported_files.add(recipe_file.file_id)
+                st.success("Recipe data imported successfully!")
         except Exception as e:
             st.error(f"Error importing recipe data: {str(e)}")
     
@@ -229,6 +920,8 @@ elif page == "Rezepte":
     st.subheader("Current Recipes")
     
     if st.session_state.recipe_data is not None:
+        from data_processor import update_recipe_data
+        
         # Allow editing recipe data
         edited_recipe = st.data_editor(
             st.session_state.recipe_data,
@@ -243,15 +936,8 @@ elif page == "Rezepte":
         
         # Update button
         if st.button("Update Recipes"):
-            st.session_state.recipe_data = update_recipe_data(edited_recipe)
-            
-            # Recalculate derived data
-            if st.session_state.inventory_data is not None:
-                st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
-            
-            st.success("Recipes updated successfully!")
+            if save_workspace({'recipes': update_recipe_data(edited_recipe)}, "Rezepte bearbeitet"):
+                st.success("Recipes updated successfully!")
     else:
         st.info("Please upload recipe data or load demo data from the sidebar.")
     
@@ -307,19 +993,73 @@ elif page == "Rezepte":
                     
                     # Add to existing recipes
                     if new_recipes:
+                        import pandas as pd
                         new_recipe_df = pd.DataFrame(new_recipes)
-                        st.session_state.recipe_data = pd.concat([st.session_state.recipe_data, new_recipe_df], ignore_index=True)
-                        
-                        # Recalculate derived data
-                        st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                        st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                        st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
+                        updated_recipes = pd.concat([st.session_state.recipe_data, new_recipe_df], ignore_index=True)
                         
-                        st.success(f"Recipe for '{new_drink_name}' added successfully!")
-                        st.rerun()
+                        if save_workspace({'recipes': updated_recipes}, f"Rezept '{new_drink_name}' hinzugefügt"):
+                            st.success(f"Recipe for '{new_drink_name}' added successfully!")
+                            st.rerun()
     else:
         st.info("Please make sure both inventory and recipe data are loaded before adding new recipes.")
 
+    # What-if scenarios: hypothetical price, recipe and menu changes, all evaluated in one batch
+    if st.session_state.recipe_data is not None and st.session_state.inventory_data is not None:
+        with st.expander("Was-wäre-wenn"):
+            import pandas as pd
+            from sales_history import list_periods
+            from what_if import (SCENARIO_CHANGE_TYPES, SCENARIO_COLUMNS, get_drink_sales, scenarios_from_table,
+                                 evaluate_scenarios, summarize_scenarios)
+
+            st.caption("Eine Zeile pro Änderung. Preise in €/Liter (ingredient_price) bzw. € brutto (sale_price), "
+                       "Mengen in ml (recipe_amount, add_drink) bzw. Stück pro Monat (quantity).")
+            scenario_table = st.data_editor(
+                pd.DataFrame({column: pd.Series(dtype=float if column == 'value' else object)
+                              for column in SCENARIO_COLUMNS}),
+                use_container_width=True,
+                num_rows="dynamic",
+                column_config={
+                    "scenario": st.column_config.TextColumn("Szenario"),
+                    "change": st.column_config.SelectboxColumn("Änderung", options=SCENARIO_CHANGE_TYPES),
+                    "drink_name": st.column_config.TextColumn("Drink"),
+                    "ingredient_name": st.column_config.SelectboxColumn(
+                        "Zutat", options=sorted(st.session_state.inventory_data['ingredient_name'].dropna().unique())),
+                    "value": st.column_config.NumberColumn("Wert")
+                },
+                key="what_if_editor"
+            )
+
+            months = list_periods(get_sales_history(), 'month')
+            drink_sales = None
+            if months:
+                month = st.selectbox("Verkaufsmengen und Preise aus Monat", months[::-1], key="what_if_month")
+                drink_sales = get_drink_sales(get_sales_history(), st.session_state.recipe_data, 'month', month)
+
+            if st.button("Szenarien berechnen"):
+                try:
+                    scenarios = scenarios_from_table(scenario_table)
+                    drink_results, ingredient_results = evaluate_scenarios(
+                        st.session_state.recipe_data, st.session_state.inventory_data, scenarios, drink_sales)
+                except (ValueError, KeyError) as e:
+                    st.error(f"Ungültige Szenario-Tabelle: {str(e)}")
+                    scenarios = None
+                if scenarios is not None:
+                    if drink_results is None:
+                        st.error("Die Szenarien konnten nicht berechnet werden.")
+                    else:
+                        st.dataframe(summarize_scenarios(drink_results), use_container_width=True)
+                        base_active = drink_results[drink_results['scenario'] == 'Basis'].set_index(
+                            'drink_name')['active']
+                        changed = drink_results[(drink_results['unit_cost_delta'].abs() > 1e-9)
+                                                | (drink_results['contribution_margin_delta'].abs() > 1e-9)
+                                                | (drink_results['active']
+                                                   != drink_results['drink_name'].map(base_active))]
+                        st.write("Veränderte Drinks")
+                        st.dataframe(changed, use_container_width=True)
+                        st.write("Zutatenbedarf")
+                        st.dataframe(ingredient_results[ingredient_results['demand_delta_ml'].abs() > 1e-9],
+                                     use_container_width=True)
+
 # Sales Import Page
 elif page == "Verkaufsdaten":
     st.title("Tägliche Verkaufsdaten importieren")
@@ -328,14 +1068,50 @@ elif page == "Verkaufsdaten":
     if st.session_state.recipe_data is None or st.session_state.inventory_data is None:
         st.warning("Please load recipe and inventory data first before importing sales data!")
     else:
-        # Upload sales CSV
+        import hashlib
+        import pandas as pd
+        from functools import partial
+        from data_processor import update_inventory_based_on_sales, calculate_sales_summary
+        from report_formats import REPORT_FORMATS, detect_report_format, read_sales_reports
+        from report_watcher import get_report_id
+        from shared_workspace import sync_from_storage
+        from storage import save_sales_report, deplete_stored_inventory
+        
+        # Upload sales CSV (day report or receipt journal, the format is detected from the file)
         st.subheader("Import Daily Sales Report")
-        sales_file = st.file_uploader("Upload Daily Sales Report CSV", type=["csv"])
+        sales_file = st.file_uploader("Upload Daily Sales Report CSV", type=["csv", "txt", "xlsx"],
+                                      help="Erkannte Formate: " + "; ".join(
+                                          report_format['description'] for report_format in REPORT_FORMATS.values()))
         
         if sales_file is not None:
             try:
-                # Process sales data
-                st.session_state.sales_data = process_sales_data(sales_file)
+                # Process sales data (a journal may contain several days)
+                report_format = detect_report_format(sales_file)
+                sales_reports = read_sales_reports(sales_file, report_format)
+                if not sales_reports:
+                    raise Exception("The file contains no sales")
+                st.session_state.sales_data = sales_reports[-1]
+                if len(sales_reports) > 1:
+                    st.info(f"{REPORT_FORMATS[report_format]['description']}: {len(sales_reports)} Tage "
+                            f"({sales_reports[0]['date']} bis {sales_reports[-1]['date']})")
+                
+                # Die Berichte werden wie vom Report-Watcher unter Datum und Z-Nummer gespeichert, so wird
+                # ein Bericht, den Watcher oder API schon kennen, ersetzt und nicht zweimal abgezogen
+                content_hash = hashlib.sha256(sales_file.getvalue()).hexdigest()
+                report_ids = [get_report_id(sales_report, content_hash) for sales_report in sales_reports]
+                
+                # Store the reports once per upload; the shared sales history and the drinks sold per day
+                # are updated from the database for all sessions
+                if is_new_upload(sales_file):
+                    for report_id, sales_report in zip(report_ids, sales_reports):
+                        save_sales_report(workspace['pool'], report_id, sales_report)
+                    sync_from_storage(workspace, f"Verkaufsbericht importiert ({sales_file.name})",
+                                      st.session_state.session_id)
+                    sync_workspace()
+                    st.session_state.imported_files.add(sales_file.file_id)
+                
+                # Nur der neue Tag wird für Auto-Par in Zutatenverbrauch umgerechnet
+                get_par_model()
                 
                 # Display sales data
                 st.subheader("Sales Data Summary")
@@ -344,11 +1120,17 @@ elif page == "Verkaufsdaten":
                 sales_date = "Unknown Date"
                 if st.session_state.sales_data.get('date'):
                     sales_date = st.session_state.sales_data['date']
+                if len(sales_reports) > 1:
+                    sales_date = f"{sales_reports[0]['date']} bis {sales_date}"
                 
                 st.write(f"Sales Date: {sales_date}")
                 
                 if 'products' in st.session_state.sales_data:
-                    products_df = pd.DataFrame(st.session_state.sales_data['products'])
+                    products_df = pd.DataFrame([dict(product, date=sales_report['date'])
+                                                for sales_report in sales_reports
+                                                for product in sales_report['products']])
+                    if len(sales_reports) == 1:
+                        products_df = products_df.drop(columns=['date'], errors='ignore')
                     st.dataframe(products_df, use_container_width=True)
                     
                     # Calculate and store sales summary
@@ -359,30 +1141,207 @@ elif page == "Verkaufsdaten":
                     st.write("Do you want to update your inventory based on these sales?")
                     
                     if st.button("Update Inventory"):
-                        # Update inventory based on sales
-                        updated_inventory = update_inventory_based_on_sales(
-                            st.session_state.inventory_data, 
-                            st.session_state.recipe_data, 
-                            st.session_state.sales_data
-                        )
+                        from substitutions import build_substitute_index
                         
-                        if updated_inventory is not None:
-                            st.session_state.inventory_data = updated_inventory
-                            
-                            # Recalculate derived data
-                            st.session_state.drink_costs = calculate_drink_costs(st.session_state.recipe_data, st.session_state.inventory_data)
-                            st.session_state.available_drinks = calculate_available_drinks(st.session_state.recipe_data, st.session_state.inventory_data)
-                            st.session_state.low_stock_warnings = get_low_stock_warnings(st.session_state.recipe_data, st.session_state.inventory_data)
-                            
+                        # Update the stored inventory day by day (for a journal), each report exactly once
+                        # for app, API and report watcher together; what an ingredient cannot cover is
+                        # taken from its substitutes
+                        substitute_index = build_substitute_index(st.session_state.substitution_groups)
+                        allocation = get_allocation()
+                        applied_reports = 0
+                        try:
+                            for report_id, sales_report in zip(report_ids, sales_reports):
+                                deplete = partial(update_inventory_based_on_sales,
+                                                  recipe_data=st.session_state.recipe_data, sales_data=sales_report,
+                                                  allocation=allocation, substitute_index=substitute_index)
+                                if deplete_stored_inventory(workspace['pool'], report_id, deplete) is not None:
+                                    applied_reports += 1
+                            depletion_error = None
+                        except Exception as e:
+                            depletion_error = e
+                        
+                        label = f"Verkäufe vom {sales_date} abgezogen"
+                        sync_from_storage(workspace, label, st.session_state.session_id)
+                        sync_workspace(label)
+                        if depletion_error is not None:
+                            st.error(f"Failed to update inventory based on sales data: {str(depletion_error)}")
+                        elif applied_reports:
                             st.success("Inventory updated successfully based on sales data!")
-                        else:
-                            st.error("Failed to update inventory based on sales data.")
+                        if depletion_error is None and applied_reports < len(sales_reports):
+                            st.info(f"{len(sales_reports) - applied_reports} Bericht(e) waren schon abgezogen "
+                                    "(z.B. vom Report-Watcher oder über die API) und wurden übersprungen.")
                 else:
                     st.error("No product data found in the sales report.")
             except Exception as e:
                 st.error(f"Error processing sales data: {str(e)}")
         else:
             st.info("Please upload a daily sales report CSV file.")
+        
+        # Generic "Divers." products are spread over the members of their Warengruppe
+        with st.expander("Sammelprodukte (Divers.) verteilen"):
+            from product_allocation import create_allocation_groups, get_unallocated_products
+
+            st.caption("Verkäufe wie \"Divers. Softgetränke\" haben kein Rezept. Sie werden nach dem Verkaufsmix "
+                       "der hier eingetragenen Drinks ihrer Warengruppe abgezogen. Mit Menge (ml) ist das Mitglied "
+                       "eine Zutat, z.B. 40ml Rum für einen Shot; ein Gewicht legt den Anteil fest.")
+            allocation_groups = st.session_state.allocation_groups
+            if allocation_groups is None:
+                allocation_groups = create_allocation_groups()
+            edited_allocation_groups = st.data_editor(
+                allocation_groups,
+                use_container_width=True,
+                num_rows="dynamic",
+                column_config={
+                    "group_name": st.column_config.TextColumn("Warengruppe"),
+                    "member_name": st.column_config.TextColumn("Drink / Zutat"),
+                    "amount_ml": st.column_config.NumberColumn("Menge (ml)", min_value=0),
+                    "weight": st.column_config.NumberColumn("Gewicht", min_value=0)
+                },
+                key="allocation_group_editor"
+            )
+            if st.button("Verteilung speichern"):
+                edited_allocation_groups = edited_allocation_groups.dropna(subset=['group_name', 'member_name'])
+                # Wird mit dem Workspace in der Datenbank gespeichert, also auch für API und Report-Watcher
+                if save_workspace({'allocation_groups': edited_allocation_groups.reset_index(drop=True)},
+                                  "Verteilung der Sammelprodukte geändert"):
+                    st.success("Verteilung gespeichert!")
+
+            allocation = get_allocation()
+            if allocation is not None and not allocation.empty:
+                st.write("Verbrauch pro verkauftem Sammelprodukt")
+                st.dataframe(allocation, use_container_width=True)
+            if st.session_state.sales_data is not None:
+                unallocated = get_unallocated_products(
+                    [product['product_name'] for product in st.session_state.sales_data.get('products', [])],
+                    allocation)
+                if unallocated:
+                    st.warning(f"Ohne Verteilung (wird nicht abgezogen): {', '.join(unallocated)}")
+
+        # Cash-up from the precomputed rollups of payments, taxes, tips and voids
+        from sales_history import list_periods, get_section_totals
+        months = list_periods(get_sales_history(), 'month')
+        if months:
+            from reconciliation import get_reconciliation_summary, calculate_cash_up
+            
+            st.subheader("Kassenabschluss")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                cash_month = st.selectbox("Monat", months[::-1], key="cash_up_month")
+            with col2:
+                opening_float = st.number_input("Wechselgeld pro Tag (€)", min_value=0.0, value=0.0, step=10.0)
+            with col3:
+                tips_in_drawer = st.checkbox("Bar-Trinkgeld bleibt in der Kasse", value=True)
+            
+            summary = get_reconciliation_summary(get_sales_history(), 'month', cash_month)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Umsatz", f"€{summary['sales_total']:.2f}")
+            col2.metric("Zahlungen", f"€{summary['payments_total']:.2f}",
+                        delta=f"{summary['payments_difference']:+.2f}" if abs(summary['payments_difference']) >= 0.01
+                        else None)
+            col3.metric("Trinkgeld", f"€{summary['tips_total']:.2f}")
+            col4.metric("Stornos", f"€{summary['voids_total']:.2f}", help=f"{summary['voids_quantity']} Stornos")
+            if abs(summary['tax_difference']) >= 0.01:
+                st.warning(f"Bruttoumsatz laut Steuern weicht um €{summary['tax_difference']:.2f} vom Umsatz ab")
+            
+            # Gezähltes Bargeld eintragen; Differenz = gezählt - erwartet
+            cash_up_df = calculate_cash_up(get_sales_history(), 'month', cash_month, st.session_state.cash_counts,
+                                           opening_float, tips_in_drawer=tips_in_drawer)
+            edited_cash_up = st.data_editor(
+                cash_up_df,
+                use_container_width=True,
+                disabled=[column for column in cash_up_df.columns if column != 'counted_cash'],
+                column_config={
+                    "date": st.column_config.TextColumn("Datum"),
+                    "cash_sales": st.column_config.NumberColumn("Bar-Umsatz (€)", format="%.2f"),
+                    "cash_tips": st.column_config.NumberColumn("Bar-Trinkgeld (€)", format="%.2f"),
+                    "expected_cash": st.column_config.NumberColumn("Soll-Kasse (€)", format="%.2f"),
+                    "counted_cash": st.column_config.NumberColumn("Gezählt (€)", format="%.2f", min_value=0),
+                    "difference": st.column_config.NumberColumn("Differenz (€)", format="%.2f")
+                },
+                key=f"cash_up_editor_{cash_month}"
+            )
+            counted = edited_cash_up.dropna(subset=['counted_cash'])
+            new_counts = {day: amount for day, amount in st.session_state.cash_counts.items()
+                          if not day.startswith(cash_month)}
+            new_counts.update(zip(counted['date'], counted['counted_cash'].astype(float)))
+            if new_counts != st.session_state.cash_counts:
+                st.session_state.cash_counts = new_counts
+                st.rerun()
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("Zahlungsarten")
+                st.dataframe(get_section_totals(get_sales_history(), 'payments', 'month', cash_month),
+                             use_container_width=True)
+                st.write("Steuern")
+                st.dataframe(get_section_totals(get_sales_history(), 'taxes', 'month', cash_month),
+                             use_container_width=True)
+            with col2:
+                st.write("Stornos")
+                st.dataframe(get_section_totals(get_sales_history(), 'voids', 'month', cash_month),
+                             use_container_width=True)
+                st.write("Tische")
+                st.dataframe(get_section_totals(get_sales_history(), 'tables', 'month', cash_month),
+                             use_container_width=True)
+
+# Stocktake Page
+elif page == "Inventur":
+    st.title("Inventur und Soll-Ist-Vergleich")
+    
+    if st.session_state.recipe_data is None or st.session_state.inventory_data is None:
+        st.warning("Bitte laden Sie zuerst Lagerbestand und Rezepte!")
+    else:
+        from data_processor import process_stocktake_data
+        from stock_ledger import (
+            add_stocktake, list_stocktakes, calculate_variance, summarize_variance,
+            apply_stocktake_to_inventory
+        )
+        
+        # Import stocktake counts
+        st.subheader("Inventur importieren")
+        st.caption("CSV mit den Spalten 'Zutat' und 'Gezählt (ml)' oder 'Gezählt (Flaschen)'")
+        count_date = st.date_input("Zähldatum (gezählt nach Geschäftsschluss)")
+        stocktake_file = st.file_uploader("Upload Stocktake CSV File", type=["csv"])
+        
+        if stocktake_file is not None:
+            try:
+                stocktake_data = process_stocktake_data(stocktake_file, count_date)
+                stock_ledger = add_stocktake(get_stock_ledger(), stocktake_data, stocktake_file.name)
+                if save_workspace({'stock_ledger': stock_ledger}, f"Inventur vom {count_date} erfasst"):
+                    st.success(f"Inventur vom {count_date} mit {len(stocktake_data)} Zutaten erfasst!")
+                st.dataframe(stocktake_data, use_container_width=True)
+                
+                if st.button("Lagerbestand auf gezählte Mengen setzen"):
+                    updated_inventory = apply_stocktake_to_inventory(st.session_state.inventory_data, stocktake_data)
+                    if save_workspace({'inventory': updated_inventory}, f"Inventur vom {count_date} übernommen"):
+                        st.success("Lagerbestand aktualisiert!")
+            except Exception as e:
+                st.error(f"Error importing stocktake data: {str(e)}")
+        
+        st.subheader("Erfasste Inventuren")
+        stocktakes_df = list_stocktakes(get_stock_ledger())
+        if stocktakes_df.empty:
+            st.info("Noch keine Inventur erfasst")
+        else:
+            st.dataframe(stocktakes_df, use_container_width=True)
+        
+        # Theoretical vs. actual usage between consecutive counts
+        st.subheader("Soll-Ist-Abweichung")
+        variance_df = calculate_variance(get_stock_ledger(), get_sales_history(),
+                                         st.session_state.recipe_data, st.session_state.inventory_data,
+                                         allocation=get_allocation())
+        if variance_df is None or variance_df.empty:
+            st.info("Für den Soll-Ist-Vergleich werden mindestens zwei Inventuren benötigt.")
+        else:
+            st.write("Negative Abweichung = mehr verbraucht als verkauft (Schwund)")
+            st.dataframe(variance_df, use_container_width=True)
+            
+            st.write("Schwund pro Monat")
+            st.dataframe(summarize_variance(variance_df, 'month', by_ingredient=False), use_container_width=True)
 
 # Display footer
 display_footer()
+
+# Zähler nach jedem Durchlauf exportieren, sie ändern sich nur bei Aktionen einer Sitzung
+if RUMBAR_METRICS_FILE:
+    write_metrics_file(RUMBAR_METRICS_FILE)
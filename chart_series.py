@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from data_processor import calculate_ingredient_usage
+from sales_history import list_periods, get_sales_frame
+from metrics import get_logger, log_error, timed
+
+logger = get_logger('chart_series')
+
+SERIES_COLUMNS = ['date', 'name', 'value']
+
+# Punkte pro Linie, die an den Browser geschickt werden
+DEFAULT_MAX_POINTS = 300
+
+def downsample_lttb(x, y, max_points=DEFAULT_MAX_POINTS):
+    """
+    Select the points of a line that keep its shape (Largest-Triangle-Three-Buckets)
+
+    The first and last point are always kept. The points in between are
+    split into max_points - 2 buckets; from every bucket the point is kept
+    that spans the largest triangle with the previously kept point and the
+    average of the next bucket, so peaks and dips survive the decimation.
+
+    Args:
+        x: Sorted x values (numbers)
+        y: y values
+        max_points: Number of points to keep
+
+    Returns:
+        numpy.ndarray: Indices of the kept points, ascending
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    # Grenzen aller Buckets vorab; Mittelwerte der Buckets über kumulierte Summen
+    edges = (np.arange(max_points - 1) * ((n - 2) / (max_points - 2))).astype(int) + 1
+    edges[-1] = n - 1
+    cumulative_x = np.concatenate(([0.0], np.cumsum(x)))
+    cumulative_y = np.concatenate(([0.0], np.cumsum(y)))
+    next_ends = np.append(edges[2:], n)
+    next_starts = edges[1:]
+    average_x = (cumulative_x[next_ends] - cumulative_x[next_starts]) / (next_ends - next_starts)
+    average_y = (cumulative_y[next_ends] - cumulative_y[next_starts]) / (next_ends - next_starts)
+
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[previous] - average_x[bucket]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y[bucket] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    selected[-1] = n - 1
+    return selected
+
+def downsample_series(series, max_points=DEFAULT_MAX_POINTS):
+    """
+    Downsample every line of a long series DataFrame with downsample_lttb
+
+    Args:
+        series: DataFrame with date, name and value, one line per name
+        max_points: Maximum number of points per line
+
+    Returns:
+        pandas.DataFrame: The kept rows, sorted by name and date
+    """
+    series = series.sort_values(['name', 'date'], kind='stable').reset_index(drop=True)
+    days = series['date'].to_numpy(dtype='datetime64[D]').astype(float)
+    values = series['value'].to_numpy(dtype=float)
+
+    kept = []
+    starts = np.flatnonzero(np.r_[True, series['name'].to_numpy()[1:] != series['name'].to_numpy()[:-1]])
+    for start, end in zip(starts, np.append(starts[1:], len(series))):
+        kept.append(start + downsample_lttb(days[start:end], values[start:end], max_points))
+
+    if not kept:
+        return series[SERIES_COLUMNS]
+    return series.iloc[np.concatenate(kept)][SERIES_COLUMNS].reset_index(drop=True)
+
+def get_sales_series(sales_history, section='products', value='quantity'):
+    """
+    Get the daily sales of every product or Warengruppe as a long series
+
+    Days with a report but without sales of a product count as zero.
+
+    Args:
+        sales_history: Sales history dictionary
+        section: 'products' or 'product_groups'
+        value: 'quantity' or 'total' (revenue)
+
+    Returns:
+        pandas.DataFrame: date, name and value
+    """
+    day_keys = list_periods(sales_history, 'day')
+    sales = get_sales_frame(sales_history, 'day', day_keys, section)
+    name_field = 'group_name' if section == 'product_groups' else 'product_name'
+    if sales.empty:
+        return pd.DataFrame(columns=SERIES_COLUMNS)
+
+    daily = sales.pivot_table(index='period', columns=name_field, values=value, aggfunc='sum', fill_value=0)
+    daily = daily.reindex(day_keys, fill_value=0)
+    series = daily.melt(ignore_index=False, var_name='name', value_name='value').reset_index()
+    series['date'] = pd.to_datetime(series['period'])
+    return series[SERIES_COLUMNS]
+
+def get_stock_series(inventory_data, recipe_data, sales_history, ledger=None, allocation=None):
+    """
+    Reconstruct the stock level of every ingredient at the end of each day
+
+    The series runs backwards from the current stock: the stock at the end
+    of a day is the current stock plus the recipe usage of all later sales
+    days minus all later deliveries from the stock ledger. It assumes that
+    the current inventory already contains all imported sales and deliveries.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        recipe_data: Recipe DataFrame
+        sales_history: Sales history dictionary
+        ledger: Optional stock ledger DataFrame (for the deliveries)
+        allocation: Optional allocation vectors for generic "Divers." products
+
+    Returns:
+        pandas.DataFrame: date, name (ingredient) and value (stock in ml)
+    """
+    current = inventory_data.dropna(subset=['ingredient_name']).groupby('ingredient_name')['current_stock_ml'].sum()
+
+    usage = calculate_ingredient_usage(get_sales_frame(sales_history, 'day'), recipe_data,
+                                       group_columns=['period'], allocation=allocation)
+    movements = [pd.DataFrame({'date': pd.to_datetime(usage['period']), 'name': usage['ingredient_name'],
+                               'net_ml': usage['usage_ml']})]
+    if ledger is not None:
+        deliveries = ledger[ledger['movement_type'] == 'delivery']
+        movements.append(pd.DataFrame({'date': deliveries['date'].dt.normalize(),
+                                       'name': deliveries['ingredient_name'], 'net_ml': -deliveries['amount_ml']}))
+    movements = pd.concat(movements, ignore_index=True)
+    movements = movements[movements['name'].isin(current.index)]
+    if movements.empty:
+        return pd.DataFrame(columns=SERIES_COLUMNS)
+
+    # Bestand am Tagesende = aktueller Bestand + Verbrauch - Lieferungen aller späteren Tage
+    daily = movements.groupby(['name', 'date'], as_index=False)['net_ml'].sum()
+    daily = daily.sort_values(['name', 'date'], ascending=[True, False])
+    later_net = daily.groupby('name')['net_ml'].cumsum() - daily['net_ml']
+    daily['value'] = (daily['name'].map(current) + later_net).clip(lower=0)
+    return daily.sort_values(['name', 'date'])[SERIES_COLUMNS].reset_index(drop=True)
+
+@timed
+def build_chart_series(inventory_data, recipe_data, sales_history, ledger=None, allocation=None,
+                       max_points=DEFAULT_MAX_POINTS):
+    """
+    Precompute the downsampled series of all history charts
+
+    Built once per data change; every line has at most max_points points,
+    however many years of history there are.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        recipe_data: Recipe DataFrame
+        sales_history: Sales history dictionary
+        ledger: Optional stock ledger DataFrame
+        allocation: Optional allocation vectors for generic "Divers." products
+        max_points: Maximum number of points per line
+
+    Returns:
+        dict: stock (ml per ingredient), product_sales (quantity per product) and
+            group_revenue (revenue per Warengruppe), each with date, name and value
+    """
+    try:
+        return {
+            'stock': downsample_series(get_stock_series(inventory_data, recipe_data, sales_history,
+                                                        ledger, allocation), max_points),
+            'product_sales': downsample_series(get_sales_series(sales_history, 'products', 'quantity'),
+                                               max_points),
+            'group_revenue': downsample_series(get_sales_series(sales_history, 'product_groups', 'total'),
+                                               max_points)
+        }
+
+    except Exception as e:
+        log_error(logger, "Error building chart series", e)
+        return None
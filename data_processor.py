@@ -3,8 +3,14 @@ import io
 import csv
 import re
 import numpy as np
+import logging
 from datetime import datetime
 
+from metrics import get_logger, increment, log_error, log_event, timed
+
+logger = get_logger('data_processor')
+
+@timed
 def process_inventory_data(inventory_file):
     """
     Process the inventory data CSV file
@@ -38,11 +44,148 @@ def process_inventory_data(inventory_file):
         inventory_data = inventory_data[inventory_data['ingredient_name'].notna() & 
                                         (inventory_data['ingredient_name'] != '')]
         
+        increment('rumbar_rows_parsed_total', len(inventory_data), file='inventory')
         return inventory_data
     
     except Exception as e:
+        increment('rumbar_parse_failures_total', file='inventory')
         raise Exception(f"Error processing inventory data: {str(e)}")
 
+@timed
+def process_stocktake_data(stocktake_file, count_date, bottle_size_ml=700):
+    """
+    Process a stocktake (Inventur) CSV file with physical counts
+    
+    The counts can be given in ml ("Gezählt (ml)") or in bottles
+    ("Gezählt (Flaschen)"). The columns of the inventory spreadsheet
+    ("Lagerbestand (ml)", "Lagerbestand in Flaschen (à 700ml)") are accepted as
+    well. An optional column "Flaschengröße (ml)" overrides the bottle size
+    per row.
+    
+    Args:
+        stocktake_file: The uploaded stocktake CSV file
+        count_date: Date of the count (date, datetime or YYYY-MM-DD string)
+        bottle_size_ml: Bottle size used for counts in bottles (default: 700ml)
+    
+    Returns:
+        pandas.DataFrame: count_date, ingredient_name and counted_ml
+    """
+    try:
+        df = pd.read_csv(stocktake_file, encoding='utf-8', delimiter=',')
+        df.columns = [col.strip() for col in df.columns]
+        
+        def to_number(column):
+            return pd.to_numeric(df[column].astype(str).str.replace(',', '.'), errors='coerce')
+        
+        counted_ml = pd.Series(np.nan, index=df.index)
+        for column in ['Gezählt (ml)', 'Lagerbestand (ml)']:
+            if column in df.columns:
+                counted_ml = counted_ml.fillna(to_number(column))
+        
+        bottle_sizes = bottle_size_ml
+        if 'Flaschengröße (ml)' in df.columns:
+            bottle_sizes = to_number('Flaschengröße (ml)').fillna(bottle_size_ml)
+        
+        for column in ['Gezählt (Flaschen)', 'Lagerbestand in Flaschen (à 700ml)']:
+            if column in df.columns:
+                counted_ml = counted_ml.fillna(to_number(column) * bottle_sizes)
+        
+        stocktake_data = pd.DataFrame({
+            'count_date': pd.Timestamp(count_date).normalize(),
+            'ingredient_name': df['Zutat'],
+            'counted_ml': counted_ml
+        })
+        
+        # Nur Zeilen mit Zutat und gezählter Menge übernehmen
+        stocktake_data = stocktake_data[stocktake_data['ingredient_name'].notna() &
+                                        (stocktake_data['ingredient_name'] != '') &
+                                        stocktake_data['counted_ml'].notna()]
+        
+        increment('rumbar_rows_parsed_total', len(stocktake_data), file='stocktake')
+        return stocktake_data.reset_index(drop=True)
+    
+    except Exception as e:
+        increment('rumbar_parse_failures_total', file='stocktake')
+        raise Exception(f"Error processing stocktake data: {str(e)}")
+
+@timed
+def process_delivery_data(delivery_file, delivery_date, bottle_size_ml=700, bottles_per_case=6):
+    """
+    Process a goods receipt (Wareneingang) CSV file, e.g. a supplier delivery note or invoice
+
+    The delivered amount can be given in ml ("Geliefert (ml)"), bottles
+    ("Geliefert (Flaschen)") or cases ("Geliefert (Kisten)"); several columns
+    in one row are added up. Optional columns "Flaschengröße (ml)" and
+    "Flaschen pro Kiste" override the sizes per row. The purchase price can be
+    given per liter ("Einkaufspreis pro Liter (EUR)"), per bottle ("Preis pro
+    Flasche (EUR)") or for the whole row ("Gesamtpreis (EUR)"). Files
+    separated by semicolons are accepted as well.
+
+    Args:
+        delivery_file: The uploaded delivery CSV file
+        delivery_date: Date of the delivery (date, datetime or YYYY-MM-DD string)
+        bottle_size_ml: Bottle size used for amounts in bottles or cases (default: 700ml)
+        bottles_per_case: Bottles per case used for amounts in cases (default: 6)
+
+    Returns:
+        pandas.DataFrame: delivery_date, ingredient_name, delivered_ml and price_per_liter
+            (one row per ingredient, price NaN if the file has none)
+    """
+    try:
+        df = pd.read_csv(delivery_file, encoding='utf-8-sig', sep=None, engine='python')
+        df.columns = [col.strip() for col in df.columns]
+
+        def to_number(column):
+            if column not in df.columns:
+                return pd.Series(np.nan, index=df.index)
+            # Rechnungen nutzen deutsche Zahlen mit Tausenderpunkt (1.234,50), Exporte teils 1234.5
+            values = df[column].astype(str).str.strip()
+            german = values.str.contains(',', regex=False)
+            values = values.where(~german, values.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+            return pd.to_numeric(values, errors='coerce')
+
+        bottle_sizes = to_number('Flaschengröße (ml)').fillna(bottle_size_ml)
+        case_sizes = to_number('Flaschen pro Kiste').fillna(bottles_per_case)
+
+        amounts = pd.DataFrame({
+            'ml': to_number('Geliefert (ml)'),
+            'bottles': to_number('Geliefert (Flaschen)') * bottle_sizes,
+            'cases': to_number('Geliefert (Kisten)') * case_sizes * bottle_sizes
+        })
+        delivered_ml = amounts.sum(axis=1, min_count=1)
+
+        # Zeilenpreis aus dem Preis pro Liter, pro Flasche oder dem Gesamtpreis
+        line_price = (to_number('Einkaufspreis pro Liter (EUR)') * delivered_ml / 1000).fillna(
+            to_number('Preis pro Flasche (EUR)') * delivered_ml / bottle_sizes).fillna(
+            to_number('Gesamtpreis (EUR)'))
+
+        lines = pd.DataFrame({
+            'ingredient_name': df['Zutat'].astype(str).str.strip().where(df['Zutat'].notna()),
+            'delivered_ml': delivered_ml,
+            'line_price': line_price,
+            'priced_ml': delivered_ml.where(line_price.notna())
+        })
+        lines = lines[lines['ingredient_name'].notna() & (lines['ingredient_name'] != '') &
+                      lines['delivered_ml'].notna()]
+
+        # Mehrere Zeilen derselben Zutat zusammenfassen, Preis gewichtet nach Menge
+        delivery_data = lines.groupby('ingredient_name', sort=False, as_index=False).agg(
+            delivered_ml=('delivered_ml', 'sum'),
+            line_price=('line_price', 'sum'),
+            priced_ml=('priced_ml', 'sum')
+        )
+        delivery_data['price_per_liter'] = (delivery_data['line_price'] /
+                                            delivery_data['priced_ml'].where(delivery_data['priced_ml'] > 0) * 1000)
+        delivery_data.insert(0, 'delivery_date', pd.Timestamp(delivery_date).normalize())
+
+        increment('rumbar_rows_parsed_total', len(lines), file='delivery')
+        return delivery_data[['delivery_date', 'ingredient_name', 'delivered_ml', 'price_per_liter']]
+
+    except Exception as e:
+        increment('rumbar_parse_failures_total', file='delivery')
+        raise Exception(f"Error processing delivery data: {str(e)}")
+
+@timed
 def process_recipe_data(recipe_file):
     """
     Process the recipe data CSV file
@@ -70,11 +213,106 @@ def process_recipe_data(recipe_file):
         # Convert amount column to numeric, handling different formats
         recipe_data['amount_ml'] = recipe_data['amount_ml'].astype(str).str.replace(',', '.').astype(float)
         
+        increment('rumbar_rows_parsed_total', len(recipe_data), file='recipes')
         return recipe_data
     
     except Exception as e:
+        increment('rumbar_parse_failures_total', file='recipes')
         raise Exception(f"Error processing recipe data: {str(e)}")
 
+def _parse_german_number(value):
+    """
+    Convert a number in German notation (e.g. "1.448,00") to float
+    
+    Args:
+        value: Number as string
+    
+    Returns:
+        float: Parsed number
+    """
+    return float(value.strip().replace('.', '').replace(',', '.'))
+
+def _find_section_rows(lines, section_name):
+    """
+    Collect the data rows of a named section in the day report
+    
+    A section starts with a line whose first field is the section name and
+    ends at the next line without any content.
+    
+    Args:
+        lines: Lines of the day report
+        section_name: Name of the section, e.g. "Warengruppen"
+    
+    Returns:
+        list: Rows of the section, each split into its stripped fields
+    """
+    rows = []
+    in_section = False
+    for line in lines:
+        if not in_section:
+            # Vor dem Abschnitt nur das erste Feld prüfen, nicht die ganze Zeile zerlegen
+            in_section = line.split(';', 1)[0].strip() == section_name
+            continue
+        if not line.strip(' \t\r\n;'):
+            break
+        rows.append([part.strip() for part in line.split(';')])
+    return rows
+
+def _parse_section_entries(lines, section_name, name_field, with_tip=False):
+    """
+    Parse the rows of a section in the format Name;;Anzahl;Total;%;Trinkgeld
+    
+    Args:
+        lines: Lines of the day report
+        section_name: Name of the section, e.g. "Zahlungsarten"
+        name_field: Key for the first column, e.g. 'payment_method'
+        with_tip: Also read the tip column
+    
+    Returns:
+        list: One dictionary per row (without the Total row)
+    """
+    entries = []
+    for parts in _find_section_rows(lines, section_name):
+        if len(parts) < 4 or not parts[0] or parts[0] == "Total":
+            continue
+        try:
+            entry = {
+                name_field: parts[0],
+                'quantity': int(parts[2] or 0),
+                'total': _parse_german_number(parts[3] or "0")
+            }
+            if with_tip:
+                entry['tip'] = _parse_german_number(parts[5]) if len(parts) > 5 and parts[5] else 0.0
+            entries.append(entry)
+        except ValueError:
+            pass  # Fehlerhafte Zeilen überspringen
+    return entries
+
+def _parse_tax_rates(lines):
+    """
+    Combine gross revenue, net revenue and tax per tax rate
+    
+    Args:
+        lines: Lines of the day report
+    
+    Returns:
+        list: Dictionaries with tax_rate (in percent), gross, net and tax
+    """
+    rates = {}
+    for section_name, field in (("Umsatz (Brutto)", 'gross'), ("Umsatz (Netto)", 'net'), ("Steuern", 'tax')):
+        for parts in _find_section_rows(lines, section_name):
+            # Steuersätze stehen als "19.000%" im Bericht (Punkt als Dezimaltrennzeichen)
+            if len(parts) < 4 or not parts[0].endswith('%'):
+                continue
+            try:
+                tax_rate = float(parts[0].rstrip('%'))
+                rates.setdefault(tax_rate, {'tax_rate': tax_rate, 'gross': 0.0, 'net': 0.0, 'tax': 0.0})
+                rates[tax_rate][field] = _parse_german_number(parts[3] or "0")
+            except ValueError:
+                pass  # Fehlerhafte Zeilen überspringen
+    return list(rates.values())
+
+@timed
 def process_sales_data(sales_file):
     """
     Process the daily sales report CSV file
@@ -83,7 +321,8 @@ def process_sales_data(sales_file):
         sales_file: The uploaded sales CSV file
     
     Returns:
-        dict: Processed sales data with date, total, and products
+        dict: Processed sales data with date, Z number, total, products, product groups,
+            payments, voids, tables, taxes and tips
     """
     try:
         # Zuerst lesen wir den gesamten Inhalt der Datei ein
@@ -106,151 +345,208 @@ def process_sales_data(sales_file):
         except:
             date_formatted = date_str
         
+        # Z-Nummer(n) des Kassenabschlusses extrahieren (Zeile "Enthalt Z;von;bis")
+        z_number = None
+        for line in lines[:10]:
+            parts = [part.strip() for part in line.split(';')]
+            if parts[0] == "Enthalt Z" and len(parts) > 2 and parts[1]:
+                z_number = parts[1] if parts[2] in ("", parts[1]) else f"{parts[1]}-{parts[2]}"
+                break
+        
         # Ergebnis-Dictionary initialisieren
         result = {
             'date': date_formatted,
+            'z_number': z_number,
             'total_sales': 0,
             'products': []
         }
         
-        # Jetzt suchen wir die Produktdaten
-        # Diese beginnen normalerweise mit einer Zeile, die "Produkte" in der ersten Spalte enthält
-        products_section_start = -1
-        for i, line in enumerate(lines):
-            if "Produkte;Total" in line or (line.startswith("Produkte") and ";Total;" in line):
-                products_section_start = i + 1  # Die nächste Zeile sollte die Header-Zeile sein
-                break
-        
-        # Wenn wir die Produkte-Sektion nicht gefunden haben, suchen wir nach "Produkte" am Anfang
-        if products_section_start == -1:
-            for i, line in enumerate(lines):
-                if line.startswith("Produkte;"):
-                    products_section_start = i + 2  # +2 weil wir die Header-Zeile überspringen wollen
-                    break
-        
-        # Als letzter Versuch suchen wir nach der Zeile, die mit "Produkte" beginnt
-        if products_section_start == -1:
-            for i, line in enumerate(lines):
-                if line.strip() and line.split(';')[0].strip() == "Produkte":
-                    products_section_start = i + 2  # +2 für die Header-Zeile
-                    break
-        
-        # Wenn wir die Produkte-Sektion gefunden haben
-        if products_section_start != -1 and products_section_start < len(lines):
-            # Finde den Anfang der tatsächlichen Produktdaten (nach den Header-Zeilen)
-            actual_products_start = products_section_start
+        # Produkte-Sektion auslesen (Name;PLU;Anzahl;Total;%;...), sie endet an der nächsten Leerzeile,
+        # damit bei anderer Reihenfolge der Abschnitte keine Tische oder Stornos als Produkte gelten
+        for parts in _find_section_rows(lines, "Produkte"):
+            product_name = parts[0]
             
-            # Überspringen Sie die Zeilen, bis Sie zur konkreten Produktliste kommen
-            # Dies ist normalerweise nach Zeile 80 im Bericht
-            for i in range(products_section_start, len(lines)):
-                if i >= 80 and i < len(lines) and lines[i].strip():
-                    actual_products_start = i
-                    break
+            # Zeilen ohne Produktname, mit Zahl als Name oder ohne Menge/Preis überspringen
+            if (len(parts) < 4 or not product_name or product_name.isdigit() or product_name == "Total"
+                    or not parts[2].isdigit() or not parts[3]):
+                continue
             
-            # Jetzt verarbeiten wir die tatsächlichen Produktdaten
-            for i in range(actual_products_start, len(lines)):
-                line = lines[i].strip()
-                
-                # Wenn wir eine leere Zeile erreichen oder eine, die nicht wie Produktdaten aussieht, brechen wir ab
-                if not line or not ";" in line:
-                    continue
-                
-                # Zeile in Teile zerlegen
-                parts = line.split(';')
-                
-                # Produktname sollte das erste Feld sein, aber manchmal kann es leer sein oder eine Zahl
-                product_name = parts[0].strip()
-                
-                # Wenn der Produktname nicht vorhanden ist oder nur eine Zahl ist, überspringen wir diese Zeile
-                if not product_name or product_name.isdigit():
-                    continue
-                
-                # Jetzt suchen wir die Mengen- und Gesamtpreis-Spalten
-                # In den meisten Fällen sollten sie direkt nach dem Produktnamen kommen
-                quantity_str = None
-                total_str = None
-                
-                # Durchsuchen Sie die Teile nach Zahlen, um Menge und Preis zu finden
-                for j in range(1, min(len(parts), 10)):  # Beschränke die Suche auf die ersten 10 Spalten
-                    part = parts[j].strip()
-                    
-                    # Wenn der Teil eine Zahl ist, könnte es die Menge sein
-                    if part.isdigit() and quantity_str is None:
-                        quantity_str = part
-                        # Der nächste Teil könnte der Preis sein
-                        if j+1 < len(parts):
-                            next_part = parts[j+1].strip()
-                            # Preis könnte ein Dezimalwert mit Komma sein
-                            if next_part and (next_part.replace(',', '.').replace('.', '').isdigit() or 
-                                            (next_part.count(',') == 1 and next_part.replace(',', '').isdigit())):
-                                total_str = next_part
-                        break
-                
-                # Wenn wir Menge und Preis gefunden haben, verarbeiten wir die Daten
-                if product_name and quantity_str and total_str:
-                    try:
-                        quantity = int(quantity_str)
-                        # Preisformatierung für deutsche Zahlenformate (Komma als Dezimaltrennzeichen)
-                        total = float(total_str.replace('.', '').replace(',', '.'))
-                        
-                        result['products'].append({
-                            'product_name': product_name,
-                            'quantity': quantity,
-                            'total': total
-                        })
-                        
-                        result['total_sales'] += total
-                    except (ValueError, TypeError) as e:
-                        print(f"Fehler beim Verarbeiten von Zeile {i}: {line} - {str(e)}")
-                        # Fehlerhafte Zeilen überspringen
-                        pass
-            
-            # Wenn wir keine Produkte gefunden haben, versuchen wir eine alternative Methode
-            if not result['products']:
-                print("Keine Produkte mit regulärem Parsing gefunden. Verwende alternative Methode.")
-                # Alternative Methode: Suchen nach Zeilen, die nach dem Muster "Name;0;Menge;Preis;%" aussehen
-                for i in range(actual_products_start, len(lines)):
-                    line = lines[i].strip()
-                    
-                    if not line or not ";" in line:
-                        continue
-                    
-                    parts = line.split(';')
-                    
-                    # Überprüfen, ob die Zeile dem erwarteten Format entspricht
-                    if len(parts) >= 5 and parts[1].strip() == "0" and parts[4].strip().endswith("%"):
-                        product_name = parts[0].strip()
-                        quantity_str = parts[2].strip()
-                        total_str = parts[3].strip()
-                        
-                        if product_name and quantity_str and total_str:
-                            try:
-                                quantity = int(quantity_str)
-                                total = float(total_str.replace('.', '').replace(',', '.'))
-                                
-                                result['products'].append({
-                                    'product_name': product_name,
-                                    'quantity': quantity,
-                                    'total': total
-                                })
-                                
-                                result['total_sales'] += total
-                            except (ValueError, TypeError):
-                                pass  # Fehlerhafte Zeilen überspringen
-        
+            try:
+                total = _parse_german_number(parts[3])
+                result['products'].append({
+                    'product_name': product_name,
+                    'quantity': int(parts[2]),
+                    'total': total
+                })
+                result['total_sales'] += total
+            except ValueError as e:
+                increment('rumbar_skipped_rows_total', file='sales_report')
+                log_event(logger, logging.WARNING, "Fehler beim Verarbeiten von Produktzeile",
+                          line=';'.join(parts), error=str(e))
+        
+        # Warengruppen-Sektion auslesen (Name;;Anzahl;Total;%;...)
+        result['product_groups'] = _parse_section_entries(lines, "Warengruppen", 'group_name')
+        
+        # Abrechnungsdaten für den Kassenabschluss
+        result['payments'] = _parse_section_entries(lines, "Zahlungsarten", 'payment_method', with_tip=True)
+        result['voids'] = _parse_section_entries(lines, "Stornos", 'reason')
+        result['tables'] = _parse_section_entries(lines, "Tische", 'table_name')
+        result['taxes'] = _parse_tax_rates(lines)
+        result['tips'] = 0.0
+        for parts in _find_section_rows(lines, "Umsatz"):
+            if parts[0] == "Trinkgeld" and len(parts) > 3 and parts[3]:
+                result['tips'] = _parse_german_number(parts[3])
+        
+        increment('rumbar_rows_parsed_total', len(result['products']), file='sales_report')
         return result
     
     except Exception as e:
+        increment('rumbar_parse_failures_total', file='sales_report')
         raise Exception(f"Error processing sales data: {str(e)}")
 
-def update_inventory_based_on_sales(inventory_data, recipe_data, sales_data):
+# Bekannte Abweichungen zwischen Kassen-Produktnamen und Rezeptnamen
+PRODUCT_NAME_ALIASES = {
+    'Adam küsst Eva': "Adam küsste Eva",
+    'Aperolles Sprizz': "Aperolless Sprizz",
+    'Radeberger Pils alkfrei 0,33l': "Radeberger Pils Alkoholfrei",
+    'Coca Cola 0,2l': "Cola",
+    'Kölsch für gute Freunde 0,2l': "Kölsch"
+}
+
+def normalize_product_name(product_name):
+    """
+    Normalize a POS product name for matching it against recipe names
+    
+    Removes serving sizes such as "0,33l" or "4cl" and ignores case and
+    surrounding whitespace.
+    
+    Args:
+        product_name: Product name from the sales report
+    
+    Returns:
+        str: Normalized name
+    """
+    name = re.sub(r'\s+\d+([,.]\d+)?\s*(l|cl|ml)$', '', str(product_name).strip(), flags=re.IGNORECASE)
+    return ' '.join(name.lower().split())
+
+# Sammelprodukte der Kasse, z.B. "Divers. Softgetränke" für alles aus der Warengruppe "Softgetränke"
+GENERIC_PRODUCT_PREFIX = "Divers."
+
+def get_generic_product_group(product_name):
+    """
+    Get the Warengruppe of a generic POS product such as "Divers. Softgetränke"
+    
+    Args:
+        product_name: Product name from the sales report
+    
+    Returns:
+        str: Name of the Warengruppe (None if the product is not generic)
+    """
+    name = str(product_name).strip()
+    if not name.startswith(GENERIC_PRODUCT_PREFIX):
+        return None
+    return name[len(GENERIC_PRODUCT_PREFIX):].strip() or None
+
+def map_products_to_drinks(product_names, recipe_data, product_mapping=None):
+    """
+    Map POS product names to drink names from the recipes
+    
+    Products are matched by an explicit mapping first, then by exact name,
+    by the known aliases in PRODUCT_NAME_ALIASES and finally by their
+    normalized name (see normalize_product_name).
+    
+    Args:
+        product_names: Iterable of product names from the sales reports
+        recipe_data: Recipe DataFrame
+        product_mapping: Optional dictionary {product name: drink name}
+    
+    Returns:
+        dict: Drink name for every product that could be mapped
+    """
+    drink_names = recipe_data['drink_name'].unique()
+    exact_names = set(drink_names)
+    normalized_names = {}
+    for drink_name in drink_names:
+        normalized_names.setdefault(normalize_product_name(drink_name), drink_name)
+    
+    mapping = {}
+    for product_name in product_names:
+        if product_mapping and product_name in product_mapping:
+            mapping[product_name] = product_mapping[product_name]
+        elif product_name in exact_names:
+            mapping[product_name] = product_name
+        elif PRODUCT_NAME_ALIASES.get(product_name) in exact_names:
+            mapping[product_name] = PRODUCT_NAME_ALIASES[product_name]
+        else:
+            drink_name = normalized_names.get(normalize_product_name(product_name))
+            if drink_name is not None:
+                mapping[product_name] = drink_name
+    
+    return mapping
+
+def _calculate_allocated_usage(product_sales, allocation):
+    """Distribute generic "Divers." products over ingredients with precomputed allocation vectors"""
+    groups = product_sales['product_name'].map(
+        {name: get_generic_product_group(name) for name in product_sales['product_name'].unique()})
+    usage = product_sales.assign(group_name=groups).dropna(subset=['group_name']).merge(
+        allocation[['group_name', 'ingredient_name', 'usage_ml']].rename(columns={'usage_ml': 'amount_ml'}),
+        on='group_name'
+    )
+    usage['usage_ml'] = usage['quantity'] * usage['amount_ml']
+    return usage
+
+def calculate_ingredient_usage(product_sales, recipe_data, product_mapping=None, group_columns=None, allocation=None):
+    """
+    Calculate the theoretical ingredient usage of sold products
+    
+    Args:
+        product_sales: DataFrame with product_name, quantity and optional grouping columns
+        recipe_data: Recipe DataFrame
+        product_mapping: Optional dictionary {product name: drink name}
+        group_columns: Columns to keep in the result, e.g. ['period'] (default: none)
+        allocation: Optional allocation vectors for generic "Divers." products (see product_allocation.py)
+    
+    Returns:
+        pandas.DataFrame: group_columns, ingredient_name and usage_ml
+    """
+    group_columns = list(group_columns or [])
+    mapping = map_products_to_drinks(product_sales['product_name'].unique(), recipe_data, product_mapping)
+    
+    # Verkäufe in einem Schritt über die Rezepte auf die Zutaten verteilen
+    sales = product_sales.assign(drink_name=product_sales['product_name'].map(mapping))
+    usage = sales.dropna(subset=['drink_name']).merge(
+        recipe_data[['drink_name', 'ingredient_name', 'amount_ml']], on='drink_name'
+    )
+    usage['usage_ml'] = usage['quantity'] * usage['amount_ml']
+    
+    if allocation is not None and not allocation.empty:
+        # Sammelprodukte ohne eigenes Rezept nach dem Verkaufsmix ihrer Warengruppe verteilen
+        allocated = _calculate_allocated_usage(sales[sales['drink_name'].isna()], allocation)
+        usage = pd.concat([usage[group_columns + ['ingredient_name', 'usage_ml']],
+                           allocated[group_columns + ['ingredient_name', 'usage_ml']]], ignore_index=True)
+    
+    return usage.groupby(group_columns + ['ingredient_name'], as_index=False)['usage_ml'].sum()
+
+@timed
+def update_inventory_based_on_sales(inventory_data, recipe_data, sales_data, allocation=None, substitute_index=None):
     """
     Update inventory based on sales data
     
+    Sold products are matched to the recipes with map_products_to_drinks
+    (exact names, aliases and normalized names), like the theoretical usage
+    of the stocktake variance, and all usage is deducted in one step.
+    Generic "Divers." products have no recipe. With allocation vectors
+    (see product_allocation.py) their quantity is spread over the
+    ingredients of their Warengruppe in one step instead of being skipped.
+    With a substitute index (see substitutions.py), usage that an
+    ingredient's own stock cannot cover is drawn from its substitutes.
+    
     Args:
         inventory_data: Current inventory DataFrame
         recipe_data: Recipe DataFrame
         sales_data: Sales data dictionary
+        allocation: Optional allocation vectors for generic products
+        substitute_index: Optional result of build_substitute_index
     
     Returns:
         pandas.DataFrame: Updated inventory data
@@ -259,51 +555,61 @@ def update_inventory_based_on_sales(inventory_data, recipe_data, sales_data):
         # Create a copy of the inventory data to avoid modifying the original
         updated_inventory = inventory_data.copy()
         
-        # Get the products from sales data
-        products = sales_data.get('products', [])
+        # Verkaufte Produkte wie bei der Soll-Menge der Inventur (calculate_variance) über Namen,
+        # Aliase und normalisierte Namen den Rezepten zuordnen
+        products = pd.DataFrame(sales_data.get('products', []), columns=['product_name', 'quantity'])
+        mapping = map_products_to_drinks(products['product_name'].unique(), recipe_data)
+        sales = products.assign(drink_name=products['product_name'].map(mapping))
+        
+        # Verkäufe in einem Schritt über die Rezepte auf die Zutaten verteilen
+        usage = sales.dropna(subset=['drink_name']).merge(
+            recipe_data[['drink_name', 'ingredient_name', 'amount_ml']], on='drink_name'
+        )
+        usage['usage_ml'] = usage['quantity'] * usage['amount_ml']
+        usage = [usage[['ingredient_name', 'usage_ml']]]
+        unmatched = sales[sales['drink_name'].isna()]
+        
+        if allocation is not None and not allocation.empty and not unmatched.empty:
+            # Sammelprodukte über die vorberechneten Verteilungsvektoren abziehen
+            allocated = _calculate_allocated_usage(unmatched, allocation)
+            unmatched = unmatched[~unmatched['product_name'].isin(allocated['product_name'])]
+            usage.append(allocated[['ingredient_name', 'usage_ml']])
+        unmatched_products = list(unmatched['product_name'])
+        usage_ml = pd.concat(usage, ignore_index=True).groupby('ingredient_name')['usage_ml'].sum()
         
-        # Track ingredients that couldn't be found
         missing_ingredients = []
-        
-        # Process each sold product
-        for product in products:
-            product_name = product['product_name']
-            quantity_sold = product['quantity']
-            
-            # Find recipes for this product
-            product_recipes = recipe_data[recipe_data['drink_name'] == product_name]
-            
-            if not product_recipes.empty:
-                # Process each ingredient in the recipe
-                for _, recipe_row in product_recipes.iterrows():
-                    ingredient_name = recipe_row['ingredient_name']
-                    amount_per_drink = recipe_row['amount_ml']
-                    
-                    # Find the ingredient in inventory
-                    ingredient_idx = updated_inventory[updated_inventory['ingredient_name'] == ingredient_name].index
-                    
-                    if len(ingredient_idx) > 0:
-                        # Calculate total amount used
-                        total_amount_used = amount_per_drink * quantity_sold
-                        
-                        # Update inventory
-                        current_stock = updated_inventory.at[ingredient_idx[0], 'current_stock_ml']
-                        new_stock = max(0, current_stock - total_amount_used)
-                        updated_inventory.at[ingredient_idx[0], 'current_stock_ml'] = new_stock
-                    else:
-                        missing_ingredients.append(ingredient_name)
+        if not usage_ml.empty and substitute_index is not None and not substitute_index.empty:
+            # Was der eigene Bestand nicht deckt, wird aus den Ersatzzutaten genommen
+            from substitutions import deplete_with_substitutes
+            updated_inventory, missing_ingredients = deplete_with_substitutes(
+                updated_inventory, usage_ml, substitute_index)
+        elif not usage_ml.empty:
+            # Abzug vom ersten Lagereintrag jeder Zutat, nie unter 0
+            first_rows = updated_inventory.drop_duplicates('ingredient_name')
+            first_rows = first_rows[first_rows['ingredient_name'].isin(usage_ml.index)]
+            missing_ingredients = list(usage_ml.index.difference(first_rows['ingredient_name']))
+            new_stock = first_rows['current_stock_ml'] - first_rows['ingredient_name'].map(usage_ml).values
+            updated_inventory.loc[first_rows.index, 'current_stock_ml'] = new_stock.clip(lower=0)
             
-        # Report if any ingredients were missing
+        # Report products and ingredients that could not be deducted
+        if unmatched_products:
+            increment('rumbar_unmatched_products_total', len(unmatched_products))
+            log_event(logger, logging.INFO, "Products without recipe were not deducted",
+                      date=sales_data.get('date'), products=unmatched_products)
         if missing_ingredients:
             missing_unique = list(set(missing_ingredients))
-            print(f"Warning: Could not find these ingredients in inventory: {', '.join(missing_unique)}")
+            increment('rumbar_missing_ingredients_total', len(missing_unique))
+            log_event(logger, logging.WARNING,
+                      f"Could not find these ingredients in inventory: {', '.join(missing_unique)}",
+                      date=sales_data.get('date'), ingredients=missing_unique)
         
         return updated_inventory
     
     except Exception as e:
-        print(f"Error updating inventory: {str(e)}")
+        log_error(logger, "Error updating inventory", e)
         return None
 
+@timed
 def calculate_drink_costs(recipe_data, inventory_data):
     """
     Calculate the cost of each drink based on its ingredients
@@ -316,61 +622,28 @@ def calculate_drink_costs(recipe_data, inventory_data):
         pandas.DataFrame: DataFrame with drink costs
     """
     try:
-        # Create a dictionary to store drink costs
-        drink_costs = {}
+        # Preis pro Zutat (bei doppelten Zutaten zählt der erste Eintrag)
+        prices = inventory_data.drop_duplicates('ingredient_name')[['ingredient_name', 'price_per_liter']]
         
-        # Get unique drink names
-        unique_drinks = recipe_data['drink_name'].unique()
+        # Rezepte in einem Schritt mit den Preisen verbinden
+        recipe_costs = recipe_data[['drink_name', 'ingredient_name', 'amount_ml']].merge(
+            prices, on='ingredient_name', how='left'
+        )
         
-        # Calculate cost for each drink
-        for drink_name in unique_drinks:
-            # Get all ingredients for this drink
-            drink_ingredients = recipe_data[recipe_data['drink_name'] == drink_name]
-            
-            total_cost = 0
-            cost_breakdown = []
-            
-            # Calculate cost for each ingredient
-            for _, ingredient_row in drink_ingredients.iterrows():
-                ingredient_name = ingredient_row['ingredient_name']
-                amount_ml = ingredient_row['amount_ml']
-                
-                # Find the ingredient in inventory
-                ingredient_info = inventory_data[inventory_data['ingredient_name'] == ingredient_name]
-                
-                if not ingredient_info.empty:
-                    # Get the price per liter and convert to price per ml
-                    price_per_liter = ingredient_info['price_per_liter'].values[0]
-                    price_per_ml = price_per_liter / 1000  # Convert to price per ml
-                    
-                    # Calculate cost for this ingredient
-                    ingredient_cost = amount_ml * price_per_ml
-                    total_cost += ingredient_cost
-                    
-                    cost_breakdown.append({
-                        'ingredient_name': ingredient_name,
-                        'amount_ml': amount_ml,
-                        'cost': ingredient_cost
-                    })
-            
-            # Store the total cost and breakdown
-            drink_costs[drink_name] = {
-                'total_cost': total_cost,
-                'cost_breakdown': cost_breakdown
-            }
+        # Zutaten ohne Lagereintrag kosten nichts (wie bisher)
+        recipe_costs['cost'] = recipe_costs['amount_ml'] * recipe_costs['price_per_liter'].fillna(0) / 1000
         
-        # Convert to DataFrame
-        cost_df = pd.DataFrame([
-            {'drink_name': drink_name, 'total_cost': data['total_cost']}
-            for drink_name, data in drink_costs.items()
-        ])
+        # Sum up per drink, keeping the order in which drinks appear in the recipes
+        cost_df = recipe_costs.groupby('drink_name', sort=False)['cost'].sum().reset_index()
+        cost_df = cost_df.rename(columns={'cost': 'total_cost'})
         
         return cost_df
     
     except Exception as e:
-        print(f"Error calculating drink costs: {str(e)}")
+        log_error(logger, "Error calculating drink costs", e)
         return None
 
+@timed
 def calculate_available_drinks(recipe_data, inventory_data):
     """
     Calculate how many of each drink can be made based on current inventory
@@ -442,7 +715,7 @@ def calculate_available_drinks(recipe_data, inventory_data):
         return available_df
     
     except Exception as e:
-        print(f"Error calculating available drinks: {str(e)}")
+        log_error(logger, "Error calculating available drinks", e)
         return None
 
 def export_low_stock_warnings_to_csv(warnings):
@@ -498,9 +771,10 @@ def export_low_stock_warnings_to_csv(warnings):
         return csv_data.encode()
     
     except Exception as e:
-        print(f"Error exporting low stock warnings: {str(e)}")
+        log_error(logger, "Error exporting low stock warnings", e)
         return None
 
+@timed
 def get_low_stock_warnings(recipe_data, inventory_data, threshold=15):
     """
     Get warnings for ingredients with low stock (can make fewer than threshold drinks)
@@ -577,7 +851,7 @@ def get_low_stock_warnings(recipe_data, inventory_data, threshold=15):
         return warnings
     
     except Exception as e:
-        print(f"Error generating low stock warnings: {str(e)}")
+        log_error(logger, "Error generating low stock warnings", e)
         return []
 
 def update_recipe_data(edited_recipe):
@@ -607,7 +881,7 @@ def update_recipe_data(edited_recipe):
         return updated_recipe
     
     except Exception as e:
-        print(f"Error updating recipe data: {str(e)}")
+        log_error(logger, "Error updating recipe data", e)
         return edited_recipe
 
 def update_inventory_data(edited_inventory):
@@ -641,7 +915,7 @@ def update_inventory_data(edited_inventory):
         return updated_inventory
     
     except Exception as e:
-        print(f"Error updating inventory data: {str(e)}")
+        log_error(logger, "Error updating inventory data", e)
         return edited_inventory
 
 def calculate_sales_summary(sales_data):
@@ -680,7 +954,7 @@ def calculate_sales_summary(sales_data):
         }
     
     except Exception as e:
-        print(f"Error calculating sales summary: {str(e)}")
+        log_error(logger, "Error calculating sales summary", e)
         return {
             'total_value': 0,
             'total_quantity': 0,
@@ -1,32 +1,13 @@
 import streamlit as st
-import pandas as pd
+import hashlib
 import io
 import os
-import base64
 
-def display_header():
-    """Display the application header with logo and title"""
-    # Header with logo and title
-    col1, col2 = st.columns([1, 3])
-    
-    with col1:
-        # Display RumBar logo
-        st.image("static/images/20241003_Logo_Rumbar_negativ.jpg", width=150)
-    
-    with col2:
-        st.title("Warenwirtschaft RumBar Falkensee")
-        st.subheader("Getränke-Management-System")
-
-def display_footer():
-    """Display the application footer"""
-    st.markdown("---")
-    st.markdown("© 2024 RumBar Falkensee - Warenwirtschaft System")
+# Vorkompilierte Demo-Daten, erzeugt mit: python helpers.py --build-demo-snapshot
+DEMO_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "demo_snapshot.npz")
 
-def load_demo_data():
-    """Load the demo data from the provided CSV files"""
-    try:
-        # Define the sample data content for inventory
-        inventory_csv = """Zutat,Lagerbestand (ml),,Lagerbestand in Flaschen (à 700ml),Einkaufspreis pro Liter (EUR),Soll-Lagerbestand in Flaschen für 50 Drinks,,
+# Sample data content for inventory
+DEMO_INVENTORY_CSV = """Zutat,Lagerbestand (ml),,Lagerbestand in Flaschen (à 700ml),Einkaufspreis pro Liter (EUR),Soll-Lagerbestand in Flaschen für 50 Drinks,,
 Havana Club 3 Años Rum,3300,,"3,81",5,5500,"7,86",1
 Limettensaft,6000,,"2,55",27,6000,"28,93",12
 Sodawasser,300,,"2,07",16,12500,"17,86",12
@@ -119,9 +100,9 @@ Kölsch,0,,9,13,15000,"21,43",
 Scheidgen Zero Sekt,0,,,,10000,"14,29",
 Captain Morgan Zero Rum,1000,,,,3000,"4,29",
 Triple Sec,1400,,,,,,"""
-        
-        # Define the sample data content for recipes
-        recipe_csv = """Getränkename,Zutat,Menge pro Drink (ml/cl)
+
+# Sample data content for recipes
+DEMO_RECIPE_CSV = """Getränkename,Zutat,Menge pro Drink (ml/cl)
 Mojito,Havana Club 3 Años Rum,50
 Mojito,Minze,10
 Mojito,Rohrzucker,2
@@ -268,17 +249,124 @@ Cuba Libre Havana Club,Havana Club 3 Años Rum,60
 Cuba Libre Havana Club,Cola,250
 Cuba Libre Worthy Park,Worthy Park Estate 109 (Overproof Rum),60
 Cuba Libre Worthy Park,Cola,250"""
+
+def display_header():
+    """Display the application header with logo and title"""
+    # Header with logo and title
+    col1, col2 = st.columns([1, 3])
+    
+    with col1:
+        # Display RumBar logo
+        st.image("static/images/20241003_Logo_Rumbar_negativ.jpg", width=150)
+    
+    with col2:
+        st.title("Warenwirtschaft RumBar Falkensee")
+        st.subheader("Getränke-Management-System")
+
+def display_footer():
+    """Display the application footer"""
+    st.markdown("---")
+    st.markdown("© 2024 RumBar Falkensee - Warenwirtschaft System")
+
+def save_frames_snapshot(path, frames, source_hash=""):
+    """
+    Save DataFrames column by column into a compressed numpy file (.npz)
+
+    Loading such a snapshot only copies the column arrays, which is much
+    faster than parsing and cleaning the original CSV files again.
+
+    Args:
+        path: Target file
+        frames: Dictionary {frame name: DataFrame}
+        source_hash: Hash of the data the frames were built from
+    """
+    import numpy as np
+
+    arrays = {'__frames__': np.array(list(frames.keys())), '__source_hash__': np.array(source_hash)}
+    for name, df in frames.items():
+        arrays[f"{name}.columns"] = np.array([str(column) for column in df.columns])
+        for key, values in [('index', df.index.to_numpy())] + [
+                (f"col{i}", df.iloc[:, i].to_numpy()) for i in range(df.shape[1])]:
+            if values.dtype == object:
+                # Texte als Unicode-Array speichern, fehlende Werte als Maske
+                missing = np.array([value is None or value != value for value in values], dtype=bool)
+                arrays[f"{name}.{key}.missing"] = missing
+                values = np.array(['' if is_missing else str(value) for value, is_missing in zip(values, missing)])
+            arrays[f"{name}.{key}"] = values
+
+    np.savez_compressed(path, **arrays)
+
+def load_frames_snapshot(path):
+    """
+    Load DataFrames saved with save_frames_snapshot
+
+    Args:
+        path: Snapshot file
+
+    Returns:
+        tuple: (dictionary {frame name: DataFrame}, source hash)
+    """
+    import numpy as np
+    import pandas as pd
+
+    def get_values(snapshot, key):
+        values = snapshot[key]
+        if f"{key}.missing" in snapshot.files:
+            values = values.astype(object)
+            values[snapshot[f"{key}.missing"]] = None
+        return values
+
+    frames = {}
+    with np.load(path, allow_pickle=False) as snapshot:
+        for name in snapshot['__frames__'].tolist():
+            columns = snapshot[f"{name}.columns"].tolist()
+            frames[name] = pd.DataFrame(
+                {column: get_values(snapshot, f"{name}.col{i}") for i, column in enumerate(columns)},
+                index=get_values(snapshot, f"{name}.index"),
+                columns=columns
+            )
+        source_hash = str(snapshot['__source_hash__'])
+    return frames, source_hash
+
+def _get_demo_source_hash():
+    """Hash of the demo CSV data, used to detect an outdated demo snapshot"""
+    return hashlib.sha256((DEMO_INVENTORY_CSV + DEMO_RECIPE_CSV).encode('utf-8')).hexdigest()
+
+def _parse_demo_csv():
+    """Parse the embedded demo CSV data"""
+    from data_processor import process_inventory_data, process_recipe_data
+    inventory_data = process_inventory_data(io.StringIO(DEMO_INVENTORY_CSV))
+    recipe_data = process_recipe_data(io.StringIO(DEMO_RECIPE_CSV))
+    return inventory_data, recipe_data
+
+def build_demo_snapshot(path=DEMO_SNAPSHOT_PATH):
+    """
+    Parse the demo CSV data and save the result as precompiled snapshot
+
+    Args:
+        path: Target file
+    """
+    inventory_data, recipe_data = _parse_demo_csv()
+    save_frames_snapshot(path, {'inventory': inventory_data, 'recipes': recipe_data}, _get_demo_source_hash())
+
+def load_demo_data():
+    """Load the demo data from the precompiled snapshot (or the embedded CSV data)"""
+    try:
+        # Schneller Weg: vorkompilierter Snapshot, solange er zu den CSV-Daten passt
+        try:
+            frames, source_hash = load_frames_snapshot(DEMO_SNAPSHOT_PATH)
+            if source_hash == _get_demo_source_hash():
+                return frames['inventory'], frames['recipes']
+        except (OSError, KeyError, ValueError):
+            pass
         
-        # Convert CSV strings to file-like objects
-        inventory_file = io.StringIO(inventory_csv)
-        recipe_file = io.StringIO(recipe_csv)
-        
-        # Process the data
-        from data_processor import process_inventory_data, process_recipe_data
-        inventory_data = process_inventory_data(inventory_file)
-        recipe_data = process_recipe_data(recipe_file)
-        
-        return inventory_data, recipe_data
+        return _parse_demo_csv()
     except Exception as e:
         st.error(f"Error loading demo data: {str(e)}")
         return None, None
+
+if __name__ == "__main__":
+    import sys
+    if "--build-demo-snapshot" in sys.argv:
+        build_demo_snapshot()
+        print(f"Demo snapshot written to {DEMO_SNAPSHOT_PATH}")
@@ -0,0 +1,416 @@
+import heapq
+import math
+
+import pandas as pd
+
+from data_processor import map_products_to_drinks
+from sales_history import list_periods, get_sales_frame
+
+THRESHOLD_COLUMNS = ['scope', 'name', 'threshold_drinks']
+
+DRINK_SALES_COLUMNS = ['date', 'drink_name', 'quantity']
+
+def create_low_stock_tracker(recipe_data, inventory_data, default_threshold=15,
+                             ingredient_thresholds=None, drink_thresholds=None, sales_velocity=None):
+    """
+    Create a tracker that keeps the low stock warnings in an indexed priority queue
+
+    An ingredient gets a warning if it is enough for fewer drinks than the
+    threshold of one of the drinks it is used in. The threshold of an
+    ingredient/drink pair is the stricter (higher) one of the ingredient and
+    the drink threshold; the default threshold applies if neither is set.
+
+    The warnings are ordered by urgency: the days the stock lasts at the
+    current sales velocity (drinks remaining weighted by how fast they sell),
+    then by the number of drinks remaining. Stock changes only recompute the
+    affected ingredients, so the warnings never have to be rebuilt from
+    scratch while the recipes stay the same.
+
+    Args:
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        default_threshold: Threshold in drinks for drinks/ingredients without own threshold
+        ingredient_thresholds: Optional dictionary {ingredient name: threshold in drinks}
+        drink_thresholds: Optional dictionary {drink name: threshold in drinks}
+        sales_velocity: Optional dictionary {drink name: drinks sold per day}
+
+    Returns:
+        dict: Low stock tracker
+    """
+    try:
+        # Rezeptindex: pro Zutat die Drinks mit ihrer Menge, pro Drink die Zutaten
+        recipes = recipe_data[recipe_data['amount_ml'] > 0]
+        usage = {}
+        drinks = {}
+        for drink_name, ingredient_name, amount_ml in zip(recipes['drink_name'], recipes['ingredient_name'],
+                                                          recipes['amount_ml']):
+            usage.setdefault(ingredient_name, []).append((drink_name, float(amount_ml)))
+            drinks.setdefault(drink_name, set()).add(ingredient_name)
+
+        tracker = {
+            'default_threshold': default_threshold,
+            'ingredient_thresholds': dict(ingredient_thresholds or {}),
+            'drink_thresholds': dict(drink_thresholds or {}),
+            'velocity': dict(sales_velocity or {}),
+            'usage': usage,
+            'drinks': drinks,
+            'stock': {},
+            'warnings': {},
+            'heap': [],
+            'positions': {}
+        }
+
+        stock = inventory_data.drop_duplicates('ingredient_name')
+        for ingredient_name, current_stock, target_stock in zip(
+                stock['ingredient_name'], stock['current_stock_ml'], stock['target_stock_ml']):
+            if ingredient_name in usage:
+                tracker['stock'][ingredient_name] = (float(current_stock), float(target_stock))
+                _refresh_ingredient(tracker, ingredient_name)
+
+        return tracker
+
+    except Exception as e:
+        raise Exception(f"Error creating low stock tracker: {str(e)}")
+
+def _get_threshold(tracker, ingredient_name, drink_name):
+    """Get the threshold in drinks for an ingredient used in a drink"""
+    thresholds = [threshold for threshold in (tracker['ingredient_thresholds'].get(ingredient_name),
+                                              tracker['drink_thresholds'].get(drink_name))
+                  if threshold is not None]
+    return max(thresholds) if thresholds else tracker['default_threshold']
+
+def _calculate_warning(tracker, ingredient_name):
+    """Calculate the warning of one ingredient (None if its stock is sufficient)"""
+    current_stock, target_stock = tracker['stock'][ingredient_name]
+
+    max_drinks_possible = None
+    most_limiting_drink = None
+    limiting_threshold = None
+    needed_for_thresholds = 0
+    daily_usage = 0
+    is_low = False
+
+    for drink_name, amount_ml in tracker['usage'][ingredient_name]:
+        threshold = _get_threshold(tracker, ingredient_name, drink_name)
+        drinks_possible = int(current_stock / amount_ml)
+        needed_for_thresholds += threshold * amount_ml
+        daily_usage += tracker['velocity'].get(drink_name, 0) * amount_ml
+
+        if drinks_possible < threshold:
+            is_low = True
+        if max_drinks_possible is None or drinks_possible < max_drinks_possible:
+            max_drinks_possible = drinks_possible
+            most_limiting_drink = drink_name
+            limiting_threshold = threshold
+
+    if not is_low:
+        return None
+
+    return {
+        'ingredient_name': ingredient_name,
+        'current_stock_ml': current_stock,
+        'target_stock_ml': max(target_stock, needed_for_thresholds),
+        'max_drinks_possible': max_drinks_possible,
+        'most_limiting_drink': most_limiting_drink,
+        'threshold_drinks': limiting_threshold,
+        'days_remaining': max(current_stock, 0) / daily_usage if daily_usage > 0 else None
+    }
+
+def _get_priority(warning):
+    """Sort key of a warning: fewest days remaining first, ingredients without sales last"""
+    days_remaining = warning['days_remaining'] if warning['days_remaining'] is not None else math.inf
+    return (days_remaining, warning['max_drinks_possible'], warning['ingredient_name'])
+
+# Indizierte Prioritätswarteschlange: binärer Min-Heap mit Position jeder Zutat im Heap
+
+def _heap_swap(tracker, i, j):
+    """Swap two heap entries and update their positions"""
+    heap = tracker['heap']
+    heap[i], heap[j] = heap[j], heap[i]
+    tracker['positions'][heap[i][1]] = i
+    tracker['positions'][heap[j][1]] = j
+
+def _sift_up(tracker, i):
+    """Move a heap entry up until its parent is more urgent"""
+    heap = tracker['heap']
+    while i > 0:
+        parent = (i - 1) // 2
+        if heap[i][0] >= heap[parent][0]:
+            break
+        _heap_swap(tracker, i, parent)
+        i = parent
+
+def _sift_down(tracker, i):
+    """Move a heap entry down until its children are less urgent"""
+    heap = tracker['heap']
+    while True:
+        smallest = i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < len(heap) and heap[child][0] < heap[smallest][0]:
+                smallest = child
+        if smallest == i:
+            break
+        _heap_swap(tracker, i, smallest)
+        i = smallest
+
+def _heap_set(tracker, ingredient_name, priority):
+    """Insert an ingredient or change its priority in O(log n)"""
+    position = tracker['positions'].get(ingredient_name)
+    if position is None:
+        tracker['heap'].append([priority, ingredient_name])
+        position = len(tracker['heap']) - 1
+        tracker['positions'][ingredient_name] = position
+        _sift_up(tracker, position)
+    else:
+        tracker['heap'][position][0] = priority
+        _sift_up(tracker, position)
+        _sift_down(tracker, tracker['positions'][ingredient_name])
+
+def _heap_remove(tracker, ingredient_name):
+    """Remove an ingredient from the heap in O(log n)"""
+    position = tracker['positions'].pop(ingredient_name, None)
+    if position is None:
+        return
+    heap = tracker['heap']
+    last = heap.pop()
+    if position < len(heap):
+        heap[position] = last
+        tracker['positions'][last[1]] = position
+        _sift_up(tracker, position)
+        _sift_down(tracker, tracker['positions'][last[1]])
+
+def _refresh_ingredient(tracker, ingredient_name):
+    """Recalculate the warning of one ingredient and update its place in the queue"""
+    warning = _calculate_warning(tracker, ingredient_name) if ingredient_name in tracker['stock'] else None
+    if warning is None:
+        tracker['warnings'].pop(ingredient_name, None)
+        _heap_remove(tracker, ingredient_name)
+    else:
+        tracker['warnings'][ingredient_name] = warning
+        _heap_set(tracker, ingredient_name, _get_priority(warning))
+
+def update_tracker_stock(tracker, inventory_data):
+    """
+    Take over the stock of an updated inventory (e.g. after a depletion or delivery)
+
+    Only ingredients whose current or target stock changed are recalculated.
+
+    Args:
+        tracker: Low stock tracker
+        inventory_data: Inventory DataFrame
+
+    Returns:
+        int: Number of ingredients that changed
+    """
+    stock = inventory_data.drop_duplicates('ingredient_name')
+    new_stock = {
+        ingredient_name: (float(current_stock), float(target_stock))
+        for ingredient_name, current_stock, target_stock in zip(
+            stock['ingredient_name'], stock['current_stock_ml'], stock['target_stock_ml'])
+        if ingredient_name in tracker['usage']
+    }
+
+    changed = [name for name, values in new_stock.items() if tracker['stock'].get(name) != values]
+    changed += [name for name in tracker['stock'] if name not in new_stock]
+
+    tracker['stock'] = new_stock
+    for ingredient_name in changed:
+        _refresh_ingredient(tracker, ingredient_name)
+    return len(changed)
+
+def apply_stock_movements(tracker, movements):
+    """
+    Apply stock movements to the tracker, e.g. the usage of a day report or a delivery
+
+    Args:
+        tracker: Low stock tracker
+        movements: Dictionary {ingredient name: change in ml} (negative for usage)
+    """
+    for ingredient_name, amount_ml in movements.items():
+        if ingredient_name in tracker['stock']:
+            current_stock, target_stock = tracker['stock'][ingredient_name]
+            tracker['stock'][ingredient_name] = (current_stock + amount_ml, target_stock)
+            _refresh_ingredient(tracker, ingredient_name)
+
+def set_tracker_thresholds(tracker, default_threshold=None, ingredient_thresholds=None, drink_thresholds=None):
+    """
+    Change the thresholds and recalculate the affected ingredients
+
+    Args:
+        tracker: Low stock tracker
+        default_threshold: New default threshold (None keeps the current one)
+        ingredient_thresholds: New dictionary {ingredient name: threshold} (None keeps the current one)
+        drink_thresholds: New dictionary {drink name: threshold} (None keeps the current one)
+    """
+    affected = set()
+
+    if default_threshold is not None and default_threshold != tracker['default_threshold']:
+        tracker['default_threshold'] = default_threshold
+        affected.update(tracker['stock'])
+
+    if ingredient_thresholds is not None:
+        old_thresholds = tracker['ingredient_thresholds']
+        affected.update(name for name in set(old_thresholds) | set(ingredient_thresholds)
+                        if old_thresholds.get(name) != ingredient_thresholds.get(name))
+        tracker['ingredient_thresholds'] = dict(ingredient_thresholds)
+
+    if drink_thresholds is not None:
+        old_thresholds = tracker['drink_thresholds']
+        for drink_name in set(old_thresholds) | set(drink_thresholds):
+            if old_thresholds.get(drink_name) != drink_thresholds.get(drink_name):
+                affected.update(tracker['drinks'].get(drink_name, ()))
+        tracker['drink_thresholds'] = dict(drink_thresholds)
+
+    for ingredient_name in affected:
+        _refresh_ingredient(tracker, ingredient_name)
+
+def set_tracker_velocity(tracker, sales_velocity):
+    """
+    Change the sales velocity and recalculate the ingredients of the affected drinks
+
+    Args:
+        tracker: Low stock tracker
+        sales_velocity: Dictionary {drink name: drinks sold per day}
+    """
+    old_velocity = tracker['velocity']
+    affected = set()
+    for drink_name in set(old_velocity) | set(sales_velocity):
+        if old_velocity.get(drink_name, 0) != sales_velocity.get(drink_name, 0):
+            affected.update(tracker['drinks'].get(drink_name, ()))
+    tracker['velocity'] = dict(sales_velocity)
+
+    for ingredient_name in affected:
+        _refresh_ingredient(tracker, ingredient_name)
+
+def get_urgent_warnings(tracker, n=None):
+    """
+    Get the most urgent low stock warnings
+
+    The heap is walked from the top with a small auxiliary heap, so the n
+    most urgent warnings take O(n log n) regardless of how many ingredients
+    are tracked.
+
+    Args:
+        tracker: Low stock tracker
+        n: Number of warnings (None for all)
+
+    Returns:
+        list: Warnings ordered by urgency (same keys as get_low_stock_warnings
+            plus threshold_drinks and days_remaining)
+    """
+    heap = tracker['heap']
+    limit = len(heap) if n is None else min(n, len(heap))
+
+    result = []
+    candidates = [(heap[0][0], 0)] if heap else []
+    while candidates and len(result) < limit:
+        _, position = heapq.heappop(candidates)
+        result.append(dict(tracker['warnings'][heap[position][1]]))
+        for child in (2 * position + 1, 2 * position + 2):
+            if child < len(heap):
+                heapq.heappush(candidates, (heap[child][0], child))
+    return result
+
+def get_warning_count(tracker):
+    """Get the number of ingredients with low stock"""
+    return len(tracker['heap'])
+
+def split_thresholds(threshold_data):
+    """
+    Split a threshold table into ingredient and drink thresholds
+
+    Args:
+        threshold_data: DataFrame with scope ('ingredient' or 'drink'), name and threshold_drinks
+
+    Returns:
+        tuple: (dictionary {ingredient name: threshold}, dictionary {drink name: threshold})
+    """
+    if threshold_data is None or threshold_data.empty:
+        return {}, {}
+    thresholds = threshold_data.dropna(subset=['name', 'threshold_drinks'])
+    by_scope = {scope: dict(zip(group['name'], group['threshold_drinks'].astype(float)))
+                for scope, group in thresholds.groupby('scope')}
+    return by_scope.get('ingredient', {}), by_scope.get('drink', {})
+
+def get_daily_drink_sales(sales_history, recipe_data, day_keys=None, product_mapping=None):
+    """
+    Count the drinks sold per day
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        day_keys: Days to count (default: all days of the history)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: date (YYYY-MM-DD), drink_name and quantity
+    """
+    sales = get_sales_frame(sales_history, 'day', day_keys)
+    mapping = map_products_to_drinks(sales['product_name'].unique(), recipe_data, product_mapping)
+    sales = sales.assign(drink_name=sales['product_name'].map(mapping)).dropna(subset=['drink_name'])
+    daily = sales.groupby(['period', 'drink_name'], as_index=False)['quantity'].sum()
+    return daily.rename(columns={'period': 'date'})[DRINK_SALES_COLUMNS]
+
+def merge_daily_drink_sales(drink_sales, new_sales, days):
+    """
+    Replace the given days of a daily drink sales table with new counts
+
+    Args:
+        drink_sales: Existing table from get_daily_drink_sales (or None)
+        new_sales: Counts of the new days
+        days: The days new_sales covers (days without any drink sold are removed)
+
+    Returns:
+        pandas.DataFrame: Merged table, sorted by date and drink
+    """
+    if drink_sales is not None:
+        new_sales = pd.concat([drink_sales[~drink_sales['date'].isin(set(days))], new_sales], ignore_index=True)
+    return new_sales.sort_values(['date', 'drink_name'], ignore_index=True)[DRINK_SALES_COLUMNS]
+
+def calculate_velocity_from_daily_sales(drink_sales, days=28):
+    """
+    Calculate how many of each drink are sold per day from daily drink counts
+
+    The velocity is the average over the last `days` calendar days up to
+    the latest day in the table (days without sales count as zero).
+
+    Args:
+        drink_sales: Table from get_daily_drink_sales
+        days: Length of the window in days
+
+    Returns:
+        pandas.DataFrame: drink_name and drinks_per_day
+    """
+    if drink_sales is None or drink_sales.empty:
+        return pd.DataFrame(columns=['drink_name', 'drinks_per_day'])
+
+    last_day = pd.Timestamp(drink_sales['date'].max())
+    first_day = (last_day - pd.Timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    velocity = drink_sales[drink_sales['date'] >= first_day].groupby('drink_name', as_index=False)['quantity'].sum()
+    velocity['drinks_per_day'] = velocity['quantity'] / days
+    return velocity[['drink_name', 'drinks_per_day']]
+
+def calculate_sales_velocity(sales_history, recipe_data, days=28, product_mapping=None):
+    """
+    Calculate how many of each drink are sold per day
+
+    The velocity is the average over the last `days` calendar days up to
+    the latest day in the sales history (days without report count as zero).
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        days: Length of the window in days
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: drink_name and drinks_per_day
+    """
+    day_keys = list_periods(sales_history, 'day')
+    if not day_keys:
+        return pd.DataFrame(columns=['drink_name', 'drinks_per_day'])
+
+    first_day = (pd.Timestamp(day_keys[-1]) - pd.Timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    drink_sales = get_daily_drink_sales(sales_history, recipe_data, [day for day in day_keys if day >= first_day],
+                                        product_mapping)
+    return calculate_velocity_from_daily_sales(drink_sales, days)
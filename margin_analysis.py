@@ -0,0 +1,406 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_processor import calculate_drink_costs, map_products_to_drinks
+from price_history import calculate_drink_costs_as_of
+from shared_workspace import get_frame_version
+from sales_history import (list_periods, get_period_keys, get_period_revision, get_history_id, get_product_sales,
+                           get_sales_frame)
+from metrics import get_logger, increment, log_error
+
+logger = get_logger('margin_analysis')
+
+# Ergebnisse pro (Rezeptversion, Preisversion, Verkaufshistorie, Zeitraum) zwischenspeichern
+_margin_cache = {}
+_MARGIN_CACHE_SIZE = 512
+# Menu-Engineering-Klassen pro Zeitraum (gleiche Schlüssel wie _margin_cache plus Popularitätsfaktor,
+# also auch pro Verkaufshistorie, damit Sitzungen nicht die Klassen anderer Sitzungen sehen)
+_menu_class_cache = {}
+# Beide Caches werden von mehreren Sitzungs- und API-Threads gleichzeitig benutzt
+_cache_lock = threading.Lock()
+
+MARGIN_COLUMNS = [
+    'period', 'drink_name', 'quantity', 'revenue', 'net_revenue',
+    'unit_cost', 'cost', 'pour_cost_pct', 'contribution_margin'
+]
+
+MENU_CLASSES = ['Star', 'Plowhorse', 'Puzzle', 'Dog']
+MENU_ENGINEERING_COLUMNS = [
+    'period', 'drink_name', 'quantity', 'revenue', 'menu_mix_pct', 'unit_contribution_margin',
+    'contribution_margin', 'high_popularity', 'high_contribution_margin', 'menu_class'
+]
+
+def _calculate_margins(period_sales, unit_costs, mapping, vat_rate):
+    """
+    Join product sales with the drink costs in one vectorized pass
+
+    Args:
+        period_sales: DataFrame with period, product_name, quantity and total
+        unit_costs: DataFrame with drink_name and total_cost per drink
+        mapping: Dictionary {product name: drink name}
+        vat_rate: VAT rate included in the POS revenue
+
+    Returns:
+        pandas.DataFrame: Margins per period and drink
+    """
+    sales = period_sales.assign(drink_name=period_sales['product_name'].map(mapping))
+    sales = sales.dropna(subset=['drink_name'])
+
+    margins = sales.groupby(['period', 'drink_name'], as_index=False)[['quantity', 'total']].sum()
+    margins = margins.merge(unit_costs, on='drink_name', how='left')
+
+    margins['revenue'] = margins['total'].astype(float)
+    margins['net_revenue'] = margins['revenue'] / (1 + vat_rate)
+    margins['unit_cost'] = margins['total_cost'].fillna(0)
+    margins['cost'] = margins['quantity'] * margins['unit_cost']
+    # Ohne Umsatz (z.B. Freigetränke) ist der Wareneinsatz nicht definiert
+    margins['pour_cost_pct'] = margins['cost'] / margins['net_revenue'].where(margins['net_revenue'] > 0) * 100
+    margins['contribution_margin'] = margins['net_revenue'] - margins['cost']
+
+    return margins[MARGIN_COLUMNS]
+
+def _calculate_margins_as_of(day_sales, period_type, daily_costs, mapping, vat_rate):
+    """
+    Cost the sales of every day with the drink costs of that day, then sum them up per period
+
+    Args:
+        day_sales: DataFrame with period (the day), product_name, quantity and total
+        period_type: Period type the margins are summed up to
+        daily_costs: DataFrame with date, drink_name and total_cost
+        mapping: Dictionary {product name: drink name}
+        vat_rate: VAT rate included in the POS revenue
+
+    Returns:
+        pandas.DataFrame: Margins per period and drink
+    """
+    sales = day_sales.assign(drink_name=day_sales['product_name'].map(mapping)).dropna(subset=['drink_name'])
+    sales = sales.groupby(['period', 'drink_name'], as_index=False)[['quantity', 'total']].sum()
+    sales['date'] = pd.to_datetime(sales['period']).astype('datetime64[ns]')
+    sales['period'] = [get_period_keys(day)[period_type] for day in sales['period']]
+
+    sales = sales.merge(daily_costs, on=['date', 'drink_name'], how='left')
+    sales['cost'] = sales['quantity'] * sales['total_cost'].fillna(0)
+
+    margins = sales.groupby(['period', 'drink_name'], as_index=False)[['quantity', 'total', 'cost']].sum()
+    margins['revenue'] = margins['total'].astype(float)
+    margins['net_revenue'] = margins['revenue'] / (1 + vat_rate)
+    # Durchschnittliche Kosten pro Drink im Zeitraum (gewichtet mit den Verkäufen je Tag)
+    margins['unit_cost'] = (margins['cost'] / margins['quantity'].where(margins['quantity'] != 0)).fillna(0)
+    margins['pour_cost_pct'] = margins['cost'] / margins['net_revenue'].where(margins['net_revenue'] > 0) * 100
+    margins['contribution_margin'] = margins['net_revenue'] - margins['cost']
+
+    return margins[MARGIN_COLUMNS]
+
+def _get_data_versions(recipe_data, inventory_data, price_history=None):
+    """Get the recipe version and the price version used as cache key"""
+    versions = (
+        get_frame_version(recipe_data, ['drink_name', 'ingredient_name', 'amount_ml']),
+        get_frame_version(inventory_data, ['ingredient_name', 'price_per_liter'])
+    )
+    if price_history is not None:
+        versions += (get_frame_version(price_history, ['ingredient_name', 'effective_date', 'price_per_liter']),)
+    return versions
+
+def _get_cache_keys(sales_history, recipe_data, inventory_data, period_type, period_keys,
+                    vat_rate, product_mapping, price_history=None):
+    """Get the cache key of every period (data versions, settings, history id and period revision)"""
+    data_versions = _get_data_versions(recipe_data, inventory_data, price_history)
+    mapping_key = tuple(sorted(product_mapping.items())) if product_mapping else None
+    history_id = get_history_id(sales_history)
+
+    return {
+        period_key: data_versions + (mapping_key, vat_rate, history_id, period_type, period_key,
+                                     get_period_revision(sales_history, period_type, period_key))
+        for period_key in period_keys
+    }
+
+def _get_margins(sales_history, recipe_data, inventory_data, period_type, period_keys,
+                 vat_rate, product_mapping, price_history=None):
+    """
+    Get the margins of several periods from the cache
+
+    All periods missing from the cache are calculated together in one
+    vectorized join and then cached per period. With a price history, the
+    sales of each day are costed with the prices in effect on that day.
+
+    Returns:
+        list: Margins DataFrame per requested period
+    """
+    cache_keys = _get_cache_keys(sales_history, recipe_data, inventory_data, period_type, period_keys,
+                                 vat_rate, product_mapping, price_history)
+    # Treffer unter der Sperre übernehmen, damit eine Verdrängung durch einen anderen Thread nichts ausmacht
+    with _cache_lock:
+        results = {period_key: _margin_cache[cache_key] for period_key, cache_key in cache_keys.items()
+                   if cache_key in _margin_cache}
+    missing_periods = [period_key for period_key in period_keys if period_key not in results]
+
+    if missing_periods:
+        increment('rumbar_recomputes_total', len(missing_periods), what='margins')
+    if missing_periods and price_history is not None:
+        # Tagesverkäufe aller fehlenden Zeiträume mit den Kosten des jeweiligen Tages bewerten
+        missing = set(missing_periods)
+        days = [day for day in list_periods(sales_history, 'day') if get_period_keys(day)[period_type] in missing]
+        day_sales = get_sales_frame(sales_history, 'day', days)
+
+        daily_costs = calculate_drink_costs_as_of(price_history, recipe_data, days, inventory_data)
+        mapping = map_products_to_drinks(day_sales['product_name'].unique(), recipe_data, product_mapping)
+        margins = _calculate_margins_as_of(day_sales, period_type, daily_costs, mapping, vat_rate)
+        margins = margins.sort_values(['period', 'contribution_margin'], ascending=[True, False])
+    elif missing_periods:
+        # Verkäufe aller fehlenden Zeiträume in einer Tabelle sammeln
+        period_sales = get_sales_frame(sales_history, period_type, missing_periods)
+
+        unit_costs = calculate_drink_costs(recipe_data, inventory_data)
+        mapping = map_products_to_drinks(period_sales['product_name'].unique(), recipe_data, product_mapping)
+        margins = _calculate_margins(period_sales, unit_costs, mapping, vat_rate)
+        margins = margins.sort_values(['period', 'contribution_margin'], ascending=[True, False])
+
+    if missing_periods:
+        margins_by_period = dict(tuple(margins.groupby('period', sort=False)))
+        with _cache_lock:
+            for period_key in missing_periods:
+                results[period_key] = margins_by_period.get(period_key, margins.iloc[0:0]).reset_index(drop=True)
+
+                # Älteste Einträge verwerfen, wenn der Cache voll ist
+                if len(_margin_cache) >= _MARGIN_CACHE_SIZE:
+                    del _margin_cache[next(iter(_margin_cache))]
+                _margin_cache[cache_keys[period_key]] = results[period_key]
+
+    return [results[period_key] for period_key in period_keys]
+
+def calculate_drink_margins(sales_history, recipe_data, inventory_data, period_type='month',
+                            period_key=None, vat_rate=0.19, product_mapping=None, price_history=None):
+    """
+    Calculate cost, revenue, pour cost and contribution margin per drink for one period
+
+    The POS revenue is gross, so pour cost and contribution margin are based
+    on the net revenue (revenue without VAT). With a price history, each day
+    is costed with the prices in effect on that day; otherwise the current
+    prices of the inventory are used. Results are cached per recipe version,
+    price version and period revision, so repeated calls only cost a
+    dictionary lookup.
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+        vat_rate: VAT rate included in the POS revenue (default: 19%)
+        product_mapping: Optional dictionary {product name: drink name}
+        price_history: Optional price history DataFrame (see price_history.py)
+
+    Returns:
+        pandas.DataFrame: Margins per drink, highest contribution margin first
+    """
+    try:
+        if period_key is None:
+            periods = list_periods(sales_history, period_type)
+            if not periods:
+                return pd.DataFrame(columns=MARGIN_COLUMNS)
+            period_key = periods[-1]
+
+        return _get_margins(sales_history, recipe_data, inventory_data, period_type,
+                            [period_key], vat_rate, product_mapping, price_history)[0]
+
+    except Exception as e:
+        log_error(logger, "Error calculating drink margins", e)
+        return None
+
+def calculate_margin_trend(sales_history, recipe_data, inventory_data, period_type='month',
+                           vat_rate=0.19, product_mapping=None, price_history=None):
+    """
+    Calculate the drink margins for every period of the sales history
+
+    Only periods that are not cached yet (or got new reports) are
+    recomputed, all of them in one vectorized pass.
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        vat_rate: VAT rate included in the POS revenue (default: 19%)
+        product_mapping: Optional dictionary {product name: drink name}
+        price_history: Optional price history DataFrame (see price_history.py)
+
+    Returns:
+        pandas.DataFrame: Margins per period and drink
+    """
+    try:
+        period_keys = list_periods(sales_history, period_type)
+        if not period_keys:
+            return pd.DataFrame(columns=MARGIN_COLUMNS)
+
+        period_margins = _get_margins(sales_history, recipe_data, inventory_data, period_type,
+                                      period_keys, vat_rate, product_mapping, price_history)
+        return pd.concat(period_margins, ignore_index=True)
+
+    except Exception as e:
+        log_error(logger, "Error calculating margin trend", e)
+        return None
+
+def _classify_menu_items(margins, popularity_factor):
+    """
+    Classify the drinks of all periods by popularity and contribution margin in one vectorized pass
+
+    A drink is popular when its share of all drinks sold in the period (menu
+    mix) reaches popularity_factor times the equal share 1 / number of drinks
+    (70% rule). Its contribution margin is high when the margin per drink
+    reaches the average margin per drink sold in the period.
+
+    Args:
+        margins: Margins DataFrame of one or more periods
+        popularity_factor: Factor of the equal share that counts as popular
+
+    Returns:
+        pandas.DataFrame: Menu engineering classes per period and drink
+    """
+    items = margins[margins['quantity'] > 0].copy()
+    by_period = items.groupby('period', sort=False)
+    period_quantity = by_period['quantity'].transform('sum')
+
+    items['menu_mix_pct'] = items['quantity'] / period_quantity * 100
+    items['unit_contribution_margin'] = items['contribution_margin'] / items['quantity']
+    average_margin = by_period['contribution_margin'].transform('sum') / period_quantity
+
+    popularity_threshold = popularity_factor * 100 / by_period['drink_name'].transform('count')
+
+    items['high_popularity'] = items['menu_mix_pct'] >= popularity_threshold
+    items['high_contribution_margin'] = items['unit_contribution_margin'] >= average_margin
+    items['menu_class'] = np.select(
+        [items['high_popularity'] & items['high_contribution_margin'],
+         items['high_popularity'],
+         items['high_contribution_margin']],
+        MENU_CLASSES[:3], default=MENU_CLASSES[3]
+    )
+    return items[MENU_ENGINEERING_COLUMNS]
+
+def _get_menu_classes(sales_history, recipe_data, inventory_data, period_type, period_keys,
+                      vat_rate, product_mapping, price_history, popularity_factor):
+    """
+    Get the menu engineering classes of several periods from the cache
+
+    Periods missing from the cache are classified together in one pass over
+    their (cached) margins and then cached per period, under the margin cache
+    key (which includes the history id) plus the popularity factor.
+
+    Returns:
+        list: Menu engineering DataFrame per requested period
+    """
+    cache_keys = {
+        period_key: cache_key + (popularity_factor,)
+        for period_key, cache_key in _get_cache_keys(sales_history, recipe_data, inventory_data, period_type,
+                                                     period_keys, vat_rate, product_mapping, price_history).items()
+    }
+    with _cache_lock:
+        results = {period_key: _menu_class_cache[cache_key] for period_key, cache_key in cache_keys.items()
+                   if cache_key in _menu_class_cache}
+    missing_periods = [period_key for period_key in period_keys if period_key not in results]
+
+    if missing_periods:
+        increment('rumbar_recomputes_total', len(missing_periods), what='menu_classes')
+        margins = pd.concat(_get_margins(sales_history, recipe_data, inventory_data, period_type, missing_periods,
+                                         vat_rate, product_mapping, price_history), ignore_index=True)
+        classes = _classify_menu_items(margins, popularity_factor)
+        classes_by_period = dict(tuple(classes.groupby('period', sort=False)))
+        with _cache_lock:
+            for period_key in missing_periods:
+                results[period_key] = classes_by_period.get(period_key, classes.iloc[0:0]).reset_index(drop=True)
+
+                if len(_menu_class_cache) >= _MARGIN_CACHE_SIZE:
+                    del _menu_class_cache[next(iter(_menu_class_cache))]
+                _menu_class_cache[cache_keys[period_key]] = results[period_key]
+
+    return [results[period_key] for period_key in period_keys]
+
+def classify_menu_items(sales_history, recipe_data, inventory_data, period_type='month', period_key=None,
+                        vat_rate=0.19, product_mapping=None, price_history=None, popularity_factor=0.7):
+    """
+    Classify the drinks of one period into Stars, Plowhorses, Puzzles and Dogs
+
+    Stars are popular with a high contribution margin, Plowhorses popular
+    with a low one, Puzzles unpopular with a high one and Dogs unpopular with
+    a low one. The classes are based on the drink margins of the period (see
+    calculate_drink_margins) and cached per recipe version, price version,
+    sales history and period revision like them.
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+        vat_rate: VAT rate included in the POS revenue (default: 19%)
+        product_mapping: Optional dictionary {product name: drink name}
+        price_history: Optional price history DataFrame (see price_history.py)
+        popularity_factor: Share of the equal menu mix that counts as popular (default: 70%)
+
+    Returns:
+        pandas.DataFrame: Menu engineering class per drink, highest contribution margin first
+    """
+    try:
+        if period_key is None:
+            periods = list_periods(sales_history, period_type)
+            if not periods:
+                return pd.DataFrame(columns=MENU_ENGINEERING_COLUMNS)
+            period_key = periods[-1]
+
+        return _get_menu_classes(sales_history, recipe_data, inventory_data, period_type, [period_key],
+                                 vat_rate, product_mapping, price_history, popularity_factor)[0]
+
+    except Exception as e:
+        log_error(logger, "Error classifying menu items", e)
+        return None
+
+def calculate_menu_class_trend(sales_history, recipe_data, inventory_data, period_type='month',
+                               vat_rate=0.19, product_mapping=None, price_history=None, popularity_factor=0.7):
+    """
+    Classify the drinks of every period of the sales history
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        vat_rate: VAT rate included in the POS revenue (default: 19%)
+        product_mapping: Optional dictionary {product name: drink name}
+        price_history: Optional price history DataFrame (see price_history.py)
+        popularity_factor: Share of the equal menu mix that counts as popular (default: 70%)
+
+    Returns:
+        pandas.DataFrame: Menu engineering class per period and drink
+    """
+    try:
+        period_keys = list_periods(sales_history, period_type)
+        if not period_keys:
+            return pd.DataFrame(columns=MENU_ENGINEERING_COLUMNS)
+
+        return pd.concat(_get_menu_classes(sales_history, recipe_data, inventory_data, period_type, period_keys,
+                                           vat_rate, product_mapping, price_history, popularity_factor),
+                         ignore_index=True)
+
+    except Exception as e:
+        log_error(logger, "Error calculating menu class trend", e)
+        return None
+
+def get_unmapped_products(sales_history, recipe_data, period_type='month', period_key=None,
+                          product_mapping=None):
+    """
+    List the products of a period that could not be mapped to a recipe
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: Unmapped products with quantity and total
+    """
+    product_sales = get_product_sales(sales_history, period_type, period_key)
+    mapping = map_products_to_drinks(product_sales['product_name'], recipe_data, product_mapping)
+    return product_sales[~product_sales['product_name'].isin(mapping.keys())].reset_index(drop=True)
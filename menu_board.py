@@ -0,0 +1,257 @@
+import html
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from data_processor import map_products_to_drinks
+from sales_history import get_product_sales
+from metrics import get_logger, increment, log_error
+
+logger = get_logger('menu_board')
+
+# Stufen eines Drinks auf der Karte
+MENU_BOARD_STATUS = ['hidden', 'few', 'available']
+
+# Neu laden, damit der Bildschirm hinter der Bar neue Stände ohne Bedienung zeigt
+MENU_BOARD_REFRESH_SECONDS = 60
+
+def create_menu_board(output_dir=None, min_drinks=1, few_drinks=5, title="Heute an der Bar"):
+    """
+    Create a live menu board for the screen behind the bar
+
+    The board lists the drinks that can be made. Drinks with fewer than
+    min_drinks portions are hidden, drinks with fewer than few_drinks are
+    marked as running out. It is only rendered again when a drink crosses
+    one of these thresholds.
+
+    Args:
+        output_dir: Directory for menu.html and menu.json (None: keep the board in memory only)
+        min_drinks: Minimum number of portions to show a drink
+        few_drinks: Number of portions below which a drink is marked as running out
+        title: Heading of the board
+
+    Returns:
+        dict: Menu board
+
+    Raises:
+        ValueError: If the thresholds are inconsistent (see check_menu_thresholds)
+    """
+    check_menu_thresholds(min_drinks, few_drinks)
+    return {
+        'output_dir': output_dir,
+        'min_drinks': min_drinks,
+        'few_drinks': few_drinks,
+        'title': title,
+        'state': None,
+        'prices': {},
+        'menu': [],
+        'html': None,
+        'json': None,
+        'generated_at': None
+    }
+
+def check_menu_thresholds(min_drinks, few_drinks):
+    """
+    Check the thresholds of a menu board
+
+    Args:
+        min_drinks: Minimum number of portions to show a drink
+        few_drinks: Number of portions below which a drink is marked as running out
+
+    Raises:
+        ValueError: If min_drinks is below 1 or few_drinks is below min_drinks
+    """
+    if min_drinks < 1:
+        raise ValueError(f"min_drinks must be at least 1, not {min_drinks}")
+    if few_drinks < min_drinks:
+        raise ValueError(f"few_drinks ({few_drinks}) must not be below min_drinks ({min_drinks})")
+
+def set_menu_board_options(board, min_drinks=None, few_drinks=None, prices=None):
+    """
+    Change the thresholds or prices of a menu board
+
+    The board is rendered again with the next update_menu_board. Callers that
+    share the board between threads must hold their lock around both calls.
+
+    Args:
+        board: Menu board from create_menu_board
+        min_drinks: New minimum number of portions (default: unchanged)
+        few_drinks: New "running out" threshold (default: unchanged)
+        prices: New dictionary {drink name: price} (default: unchanged, {} removes the prices)
+
+    Raises:
+        ValueError: If the thresholds are inconsistent
+    """
+    min_drinks = board['min_drinks'] if min_drinks is None else min_drinks
+    few_drinks = board['few_drinks'] if few_drinks is None else few_drinks
+    check_menu_thresholds(min_drinks, few_drinks)
+    board.update({'min_drinks': min_drinks, 'few_drinks': few_drinks, 'state': None})
+    if prices is not None:
+        board['prices'] = prices
+
+def _get_menu_state(available_drinks, min_drinks, few_drinks):
+    """Get the status code of every drink (0 hidden, 1 few, 2 available) as a cheap comparable key"""
+    # Liegt few_drinks unter min_drinks, wären ausgeblendete Drinks sonst als "wenige" markiert
+    few_drinks = max(few_drinks, min_drinks)
+    counts = available_drinks['max_drinks_possible'].to_numpy()
+    codes = (counts >= min_drinks).astype(np.int8) + (counts >= few_drinks)
+    return tuple(available_drinks['drink_name']), codes.tobytes()
+
+def build_menu(available_drinks, min_drinks=1, few_drinks=5, prices=None):
+    """
+    List the drinks of the menu board, sorted by name
+
+    Args:
+        available_drinks: Result of calculate_available_drinks
+        min_drinks: Minimum number of portions to show a drink
+        few_drinks: Number of portions below which a drink is marked as running out
+        prices: Optional dictionary {drink name: price}
+
+    Returns:
+        list: Dictionaries with drink_name, status ('few' or 'available') and price (None if unknown)
+    """
+    names, codes = _get_menu_state(available_drinks, min_drinks, few_drinks)
+    prices = prices or {}
+    return sorted((
+        {'drink_name': name, 'status': MENU_BOARD_STATUS[code], 'price': prices.get(name)}
+        for name, code in zip(names, np.frombuffer(codes, dtype=np.int8)) if code > 0
+    ), key=lambda item: item['drink_name'].lower())
+
+def _format_price(price):
+    """Format a price for the board, e.g. 9,50 €"""
+    return f"{price:.2f} €".replace('.', ',')
+
+def render_menu_html(menu, title="Heute an der Bar", generated_at=None):
+    """
+    Render the menu board as a static HTML page
+
+    Args:
+        menu: Result of build_menu
+        title: Heading of the board
+        generated_at: Time of the state shown (default: now)
+
+    Returns:
+        str: HTML page
+    """
+    generated_at = generated_at or datetime.now()
+    items = []
+    for item in menu:
+        price = f'<span class="price">{_format_price(item["price"])}</span>' if item['price'] is not None else ''
+        note = '<span class="note">nur noch wenige</span>' if item['status'] == 'few' else ''
+        items.append(f'<li class="{item["status"]}"><span class="name">{html.escape(item["drink_name"])}</span>'
+                     f'{note}{price}</li>')
+
+    return (
+        '<!DOCTYPE html>\n<html lang="de">\n<head>\n<meta charset="utf-8">\n'
+        f'<meta http-equiv="refresh" content="{MENU_BOARD_REFRESH_SECONDS}">\n'
+        f'<title>{html.escape(title)}</title>\n'
+        '<style>\n'
+        'body { background: #111; color: #f5f0e6; font-family: sans-serif; margin: 2em; }\n'
+        'h1 { font-size: 3em; margin: 0 0 0.5em; }\n'
+        'ul { list-style: none; padding: 0; columns: 2; font-size: 1.8em; }\n'
+        'li { display: flex; gap: 0.5em; padding: 0.2em 0; break-inside: avoid; }\n'
+        '.price { margin-left: auto; }\n'
+        '.note { color: #e0a040; font-size: 0.6em; align-self: center; }\n'
+        'footer { color: #888; margin-top: 1em; }\n'
+        '</style>\n</head>\n<body>\n'
+        f'<h1>{html.escape(title)}</h1>\n'
+        '<ul>\n' + '\n'.join(items) + '\n</ul>\n'
+        f'<footer>Stand: {generated_at.strftime("%d.%m.%Y %H:%M")}</footer>\n'
+        '</body>\n</html>\n'
+    )
+
+def render_menu_json(menu, generated_at=None):
+    """
+    Render the menu board as JSON (e.g. for a custom display)
+
+    Args:
+        menu: Result of build_menu
+        generated_at: Time of the state shown (default: now)
+
+    Returns:
+        str: JSON document with generated_at and drinks
+    """
+    generated_at = generated_at or datetime.now()
+    return json.dumps({'generated_at': generated_at.isoformat(timespec='seconds'), 'drinks': menu},
+                      ensure_ascii=False, indent=2)
+
+def _write_atomic(path, content):
+    """Write a text file in one atomic replace, so the screen never loads a half-written page"""
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def update_menu_board(board, available_drinks, prices=None):
+    """
+    Render the menu board again if a drink crossed a threshold or a price changed
+
+    The check only compares the status codes of all drinks, so the frequent
+    stock changes of a depletion that keep every drink on the same side of
+    the thresholds cost no rendering or file writes.
+
+    Args:
+        board: Menu board from create_menu_board
+        available_drinks: Result of calculate_available_drinks
+        prices: Optional dictionary {drink name: price} (default: keep the previous prices)
+
+    Returns:
+        bool: Whether the board was rendered again
+    """
+    try:
+        if available_drinks is None:
+            return False
+        if prices is None:
+            prices = board['prices']
+        state = _get_menu_state(available_drinks, board['min_drinks'], board['few_drinks'])
+        if state == board['state'] and prices == board['prices']:
+            return False
+
+        generated_at = datetime.now()
+        menu = build_menu(available_drinks, board['min_drinks'], board['few_drinks'], prices)
+        board.update({
+            'state': state,
+            'prices': prices,
+            'menu': menu,
+            'html': render_menu_html(menu, board['title'], generated_at),
+            'json': render_menu_json(menu, generated_at),
+            'generated_at': generated_at
+        })
+        if board['output_dir']:
+            os.makedirs(board['output_dir'], exist_ok=True)
+            _write_atomic(os.path.join(board['output_dir'], "menu.html"), board['html'])
+            _write_atomic(os.path.join(board['output_dir'], "menu.json"), board['json'])
+        increment('rumbar_recomputes_total', what='menu_board')
+        return True
+
+    except Exception as e:
+        log_error(logger, "Error updating menu board", e)
+        return False
+
+def get_menu_prices(sales_history, recipe_data, period_type='month', product_mapping=None):
+    """
+    Get the average selling price per drink from the latest period of the sales history
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        period_type: Period to average over, e.g. 'month' (the latest one is used)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        dict: {drink name: price}
+    """
+    sales = get_product_sales(sales_history, period_type)
+    sales = sales[sales['quantity'] > 0]
+    mapping = map_products_to_drinks(sales['product_name'].unique(), recipe_data, product_mapping)
+    sales = sales.assign(drink_name=sales['product_name'].map(mapping)).dropna(subset=['drink_name'])
+    totals = sales.groupby('drink_name')[['quantity', 'total']].sum()
+    return {name: round(float(price), 2) for name, price in (totals['total'] / totals['quantity']).items()}
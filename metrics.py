@@ -0,0 +1,224 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Grenzen der Dauer-Histogramme in Sekunden (wie die Prometheus-Client-Standardwerte)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Beschreibung der Metriken für die Prometheus-Ausgabe
+METRIC_HELP = {
+    'rumbar_rows_parsed_total': "Rows read from imported files",
+    'rumbar_parse_failures_total': "Imported files that could not be parsed",
+    'rumbar_skipped_rows_total': "Rows of imported files that were skipped as invalid",
+    'rumbar_unmatched_products_total': "Sold products without a matching recipe",
+    'rumbar_missing_ingredients_total': "Recipe ingredients missing from the inventory",
+    'rumbar_recomputes_total': "Recomputations of derived data",
+    'rumbar_errors_total': "Errors caught and logged instead of raised",
+    'rumbar_session_spills_total': "Idle sessions whose data was spilled to disk",
+    'rumbar_session_reloads_total': "Spilled sessions loaded again on use",
+    'rumbar_function_duration_seconds': "Duration of instrumented functions",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+def _label_key(labels):
+    """Turn keyword labels into a hashable, sorted key"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def increment(name, amount=1, **labels):
+    """
+    Increase a counter
+
+    Args:
+        name: Metric name, e.g. 'rumbar_rows_parsed_total'
+        amount: Amount to add
+        **labels: Labels of the series, e.g. file='inventory'
+    """
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    """
+    Record a value in a histogram
+
+    Args:
+        name: Metric name, e.g. 'rumbar_function_duration_seconds'
+        value: Observed value
+        buckets: Upper bounds of the buckets (used when the series is created)
+        **labels: Labels of the series
+    """
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': tuple(buckets), 'counts': [0] * len(buckets),
+                                            'sum': 0.0, 'count': 0}
+        position = bisect.bisect_left(histogram['buckets'], value)
+        if position < len(histogram['counts']):
+            histogram['counts'][position] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+@contextmanager
+def timer(name='rumbar_function_duration_seconds', **labels):
+    """Measure the duration of a block into a histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def timed(function):
+    """Decorator recording the duration of every call in rumbar_function_duration_seconds"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            observe('rumbar_function_duration_seconds', time.perf_counter() - start, function=function.__name__)
+    return wrapper
+
+def reset_metrics():
+    """Remove all recorded metrics"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def get_counter(name, **labels):
+    """Get the current value of a counter (0 if it was never increased)"""
+    with _lock:
+        return _counters.get((name, _label_key(labels)), 0)
+
+def _escape_label_value(value):
+    """Escape backslashes, quotes and line breaks in a label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    """Format a label key as {name="value",...} (empty string without labels)"""
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+def render_prometheus():
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Returns:
+        str: Metrics text (content type text/plain; version=0.0.4)
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, dict(value, counts=list(value['counts']))) for key, value in _histograms.items())
+
+    lines = []
+    described = set()
+    for (name, labels), value in counters:
+        if name not in described:
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            described.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), histogram in histograms:
+        if name not in described:
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            described.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(float(bound)))])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path):
+    """
+    Write all metrics to a file in one atomic replace (e.g. for the node exporter textfile collector)
+
+    Args:
+        path: Path of the metrics file (*.prom)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".prom.tmp")
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(render_prometheus())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, with the fields passed to log_event"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def get_logger(name):
+    """Get the logger of a module below the 'rumbar' logger"""
+    return logging.getLogger(f"rumbar.{name}")
+
+def configure_logging(level=logging.INFO, log_file=None):
+    """
+    Write the logs of all modules as JSON lines to stderr or a file
+
+    Without this call, warnings and errors still reach stderr as plain text.
+
+    Args:
+        level: Minimum level to log
+        log_file: Optional path of a log file (default: stderr)
+    """
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger("rumbar")
+    root.handlers = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+def log_event(logger, level, event, **fields):
+    """
+    Log an event with structured fields
+
+    Args:
+        logger: Logger from get_logger
+        level: Logging level, e.g. logging.WARNING
+        event: Description of the event
+        **fields: Additional fields of the JSON log line
+    """
+    logger.log(level, event, extra={'fields': fields})
+
+def log_error(logger, event, error, **fields):
+    """
+    Log a caught exception and count it in rumbar_errors_total
+
+    Args:
+        logger: Logger from get_logger
+        event: Description of what failed, e.g. "Error calculating drink costs"
+        error: The caught exception
+        **fields: Additional fields of the JSON log line
+    """
+    increment('rumbar_errors_total', module=logger.name.rpartition('.')[2])
+    logger.error(f"{event}: {str(error)}", exc_info=error, extra={'fields': dict(fields, error=str(error))})
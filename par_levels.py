@@ -0,0 +1,183 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from data_processor import calculate_ingredient_usage
+from shared_workspace import get_frame_version
+from sales_history import list_periods, get_period_revision, get_sales_frame
+from metrics import get_logger, log_error
+
+logger = get_logger('par_levels')
+
+PAR_LEVEL_COLUMNS = [
+    'ingredient_name', 'mean_daily_usage_ml', 'std_daily_usage_ml', 'lead_time_days',
+    'coverage_days', 'safety_stock_ml', 'recommended_target_ml', 'recommended_bottles'
+]
+
+def create_par_model(recipe_data, window_days=56, product_mapping=None):
+    """
+    Create a model that keeps the daily ingredient usage needed for par levels
+
+    The model stores one usage vector (ml per ingredient) per sales day of
+    the window. update_par_model only converts new or changed days into
+    ingredient usage, so a new day report does not recompute the whole
+    history.
+
+    Args:
+        recipe_data: Recipe DataFrame
+        window_days: Number of calendar days up to the latest report used for the statistics
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        dict: Par level model
+    """
+    ingredients = sorted(recipe_data['ingredient_name'].dropna().unique())
+    return {
+        'recipe_data': recipe_data,
+        'recipe_version': get_frame_version(recipe_data, ['drink_name', 'ingredient_name', 'amount_ml']),
+        'product_mapping': dict(product_mapping or {}),
+        'window_days': window_days,
+        'ingredients': ingredients,
+        'ingredient_index': {name: i for i, name in enumerate(ingredients)},
+        'daily_usage': {},
+        'day_revisions': {}
+    }
+
+def update_par_model(model, sales_history, recipe_data=None):
+    """
+    Bring the daily usage of the model up to date with the sales history
+
+    Only days that are new or whose report was replaced are converted into
+    ingredient usage (in one batch). Days that dropped out of the window
+    are removed. If the recipes changed, the model is rebuilt.
+
+    Args:
+        model: Par level model from create_par_model
+        sales_history: Sales history dictionary
+        recipe_data: Current recipe DataFrame (default: the recipes of the model)
+
+    Returns:
+        dict: The updated model (a new model if the recipes changed)
+    """
+    try:
+        if recipe_data is not None and get_frame_version(
+                recipe_data, ['drink_name', 'ingredient_name', 'amount_ml']) != model['recipe_version']:
+            model = create_par_model(recipe_data, model['window_days'], model['product_mapping'])
+
+        day_keys = list_periods(sales_history, 'day')
+        if day_keys:
+            first_day = (pd.Timestamp(day_keys[-1]) - pd.Timedelta(days=model['window_days'] - 1)).strftime("%Y-%m-%d")
+            day_keys = [day for day in day_keys if day >= first_day]
+
+        revisions = {day: get_period_revision(sales_history, 'day', day) for day in day_keys}
+        for day in [day for day in model['daily_usage'] if day not in revisions]:
+            del model['daily_usage'][day]
+            del model['day_revisions'][day]
+
+        changed_days = [day for day, revision in revisions.items() if model['day_revisions'].get(day) != revision]
+        if not changed_days:
+            return model
+
+        # Alle geänderten Tage in einem Schritt über die Rezepte in Zutatenverbrauch umrechnen
+        usage = calculate_ingredient_usage(get_sales_frame(sales_history, 'day', changed_days),
+                                           model['recipe_data'], model['product_mapping'], ['period'])
+        usage_matrix = np.zeros((len(changed_days), len(model['ingredients'])))
+        day_positions = {day: i for i, day in enumerate(changed_days)}
+        usage_matrix[usage['period'].map(day_positions).to_numpy(),
+                     usage['ingredient_name'].map(model['ingredient_index']).to_numpy()] = usage['usage_ml'].to_numpy()
+
+        for day, day_usage in zip(changed_days, usage_matrix):
+            model['daily_usage'][day] = day_usage
+            model['day_revisions'][day] = revisions[day]
+        return model
+
+    except Exception as e:
+        raise Exception(f"Error updating par level model: {str(e)}")
+
+def calculate_par_levels(model, lead_time_days=2, review_period_days=7, service_level=0.95, bottle_size_ml=700):
+    """
+    Calculate the recommended target stock of all ingredients in one vectorized pass
+
+    The target covers the expected usage until the next delivery arrives
+    (review period + lead time) plus a safety stock for days with more
+    sales than usual:
+
+        target = mean * (R + L) + z * std * sqrt(R + L)
+
+    mean and std are the daily usage over the calendar days of the window
+    (days without report count as zero), z is the normal quantile of the
+    service level.
+
+    Args:
+        model: Par level model, updated with update_par_model
+        lead_time_days: Days from ordering to delivery, or dictionary {ingredient name: days}
+        review_period_days: Days between two orders
+        service_level: Probability of not running out before the next delivery (e.g. 0.95)
+        bottle_size_ml: Bottle size for the recommended number of bottles
+
+    Returns:
+        pandas.DataFrame: Recommended target stock per ingredient
+    """
+    try:
+        ingredients = model['ingredients']
+        days = sorted(model['daily_usage'])
+        if not days or not ingredients:
+            return pd.DataFrame(columns=PAR_LEVEL_COLUMNS)
+
+        # Kalendertage im Fenster, auch Tage ohne Bericht (Ruhetage)
+        calendar_days = min((pd.Timestamp(days[-1]) - pd.Timestamp(days[0])).days + 1, model['window_days'])
+        usage_matrix = np.vstack([model['daily_usage'][day] for day in days])
+
+        mean = usage_matrix.sum(axis=0) / calendar_days
+        variance = (usage_matrix ** 2).sum(axis=0) / calendar_days - mean ** 2
+        std = np.sqrt(np.clip(variance, 0, None))
+
+        if isinstance(lead_time_days, dict):
+            lead_times = np.array([lead_time_days.get(name, 2) for name in ingredients], dtype=float)
+        else:
+            lead_times = np.full(len(ingredients), float(lead_time_days))
+        coverage_days = lead_times + review_period_days
+
+        z = NormalDist().inv_cdf(service_level)
+        safety_stock = z * std * np.sqrt(coverage_days)
+        target = mean * coverage_days + safety_stock
+
+        return pd.DataFrame({
+            'ingredient_name': ingredients,
+            'mean_daily_usage_ml': mean,
+            'std_daily_usage_ml': std,
+            'lead_time_days': lead_times,
+            'coverage_days': coverage_days,
+            'safety_stock_ml': safety_stock,
+            'recommended_target_ml': target,
+            'recommended_bottles': np.ceil(target / bottle_size_ml).astype(int)
+        })
+
+    except Exception as e:
+        log_error(logger, "Error calculating par levels", e)
+        return None
+
+def apply_par_levels(inventory_data, par_levels, only_used=True):
+    """
+    Set target_stock_ml of the inventory to the recommended target stock
+
+    Args:
+        inventory_data: Inventory DataFrame
+        par_levels: Result of calculate_par_levels
+        only_used: Keep the current target of ingredients without sales in the window
+
+    Returns:
+        pandas.DataFrame: Updated inventory data
+    """
+    recommended = par_levels
+    if only_used:
+        recommended = recommended[recommended['mean_daily_usage_ml'] > 0]
+    recommended = recommended.set_index('ingredient_name')['recommended_target_ml'].apply(math.ceil)
+
+    updated_inventory = inventory_data.copy()
+    updated_inventory['target_stock_ml'] = (
+        updated_inventory['ingredient_name'].map(recommended).fillna(updated_inventory['target_stock_ml'])
+    )
+    return updated_inventory
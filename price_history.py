@@ -0,0 +1,208 @@
+import pandas as pd
+
+from metrics import get_logger, log_error
+
+logger = get_logger('price_history')
+
+PRICE_HISTORY_COLUMNS = ['ingredient_name', 'effective_date', 'price_per_liter', 'source']
+
+def create_price_history():
+    """
+    Create an empty price history
+
+    Every row is a price per liter that applies to an ingredient from its
+    effective date until the next row of the same ingredient.
+
+    Returns:
+        pandas.DataFrame: Empty price history
+    """
+    return pd.DataFrame({
+        'ingredient_name': pd.Series(dtype=object),
+        'effective_date': pd.Series(dtype='datetime64[ns]'),
+        'price_per_liter': pd.Series(dtype=float),
+        'source': pd.Series(dtype=object)
+    })
+
+def _lookup_prices(price_history, keys):
+    """
+    Find the price in effect for (ingredient_name, date) pairs with a sorted as-of join
+
+    Args:
+        price_history: Price history DataFrame
+        keys: DataFrame with ingredient_name and date
+
+    Returns:
+        pandas.DataFrame: keys with price_per_liter (NaN before the first price of an ingredient)
+    """
+    # merge_asof verlangt für den Schlüssel exakt denselben Datentyp auf beiden Seiten
+    keys = keys.astype({'ingredient_name': object, 'date': 'datetime64[ns]'}).sort_values('date', kind='stable')
+    history = price_history[['ingredient_name', 'effective_date', 'price_per_liter']].astype(
+        {'ingredient_name': object, 'effective_date': 'datetime64[ns]'}).sort_values('effective_date', kind='stable')
+
+    return pd.merge_asof(keys, history, left_on='date', right_on='effective_date',
+                         by='ingredient_name', direction='backward').drop(columns='effective_date')
+
+def add_price_changes(price_history, prices, effective_date, source=""):
+    """
+    Record prices that apply from a date on
+
+    Only prices that differ from the price in effect at that date are
+    recorded. A price recorded for the same ingredient and date before is
+    replaced.
+
+    Args:
+        price_history: Price history DataFrame
+        prices: DataFrame with ingredient_name and price_per_liter
+        effective_date: Date from which the prices apply
+        source: Description of the source, e.g. "Lagerbestand importiert"
+
+    Returns:
+        pandas.DataFrame: The updated price history
+    """
+    try:
+        date = pd.Timestamp(effective_date).normalize()
+        new_prices = prices[['ingredient_name', 'price_per_liter']].dropna().drop_duplicates('ingredient_name')
+        new_prices = new_prices.astype({'ingredient_name': object, 'price_per_liter': float})
+
+        # Einträge desselben Tages werden ersetzt, verglichen wird mit dem Preis davor
+        same_day = (price_history['effective_date'] == date) & price_history['ingredient_name'].isin(
+            new_prices['ingredient_name'])
+        remaining = price_history[~same_day]
+
+        in_effect = _lookup_prices(remaining, new_prices[['ingredient_name']].assign(date=date))
+        in_effect = new_prices.merge(in_effect, on='ingredient_name', how='left', suffixes=('', '_in_effect'))
+        changed = in_effect[in_effect['price_per_liter'] != in_effect['price_per_liter_in_effect']]
+
+        new_rows = pd.DataFrame({
+            'ingredient_name': changed['ingredient_name'],
+            'effective_date': date,
+            'price_per_liter': changed['price_per_liter'],
+            'source': source
+        }).astype({'effective_date': 'datetime64[ns]'})
+
+        updated_history = pd.concat([remaining, new_rows], ignore_index=True) if not new_rows.empty else remaining
+        return updated_history.sort_values(['ingredient_name', 'effective_date']).reset_index(drop=True)
+
+    except Exception as e:
+        raise Exception(f"Error recording price changes: {str(e)}")
+
+def get_changed_prices(previous_inventory, inventory_data):
+    """
+    Get the prices of an inventory that differ from the previous inventory
+
+    Args:
+        previous_inventory: Inventory DataFrame before the change (None: all prices are new)
+        inventory_data: Inventory DataFrame after the change
+
+    Returns:
+        pandas.DataFrame: ingredient_name and price_per_liter of the changed and new ingredients
+    """
+    prices = inventory_data[['ingredient_name', 'price_per_liter']].dropna().drop_duplicates('ingredient_name')
+    if previous_inventory is None:
+        return prices.reset_index(drop=True)
+
+    previous_prices = previous_inventory.drop_duplicates('ingredient_name').set_index('ingredient_name')['price_per_liter']
+    changed = prices['ingredient_name'].map(previous_prices) != prices['price_per_liter']
+    return prices[changed].reset_index(drop=True)
+
+def apply_prices_in_effect(inventory_data, price_history, date, ingredients=None):
+    """
+    Set price_per_liter of the inventory to the prices in effect at a date
+
+    Ingredients without a recorded price at that date keep their price.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        price_history: Price history DataFrame
+        date: Date of the prices, usually today
+        ingredients: Optional list of the ingredients to update (default: all)
+
+    Returns:
+        pandas.DataFrame: Updated inventory data
+    """
+    names = inventory_data['ingredient_name'].dropna().unique() if ingredients is None else ingredients
+    keys = pd.DataFrame({'ingredient_name': list(names), 'date': pd.Timestamp(date).normalize()})
+    in_effect = _lookup_prices(price_history, keys).dropna(subset=['price_per_liter'])
+    in_effect = in_effect.set_index('ingredient_name')['price_per_liter']
+
+    updated_inventory = inventory_data.copy()
+    updated_inventory['price_per_liter'] = (
+        updated_inventory['ingredient_name'].map(in_effect).fillna(updated_inventory['price_per_liter'])
+    )
+    return updated_inventory
+
+def get_prices_as_of(price_history, dates, inventory_data=None):
+    """
+    Get the price per liter of every ingredient at several dates
+
+    Args:
+        price_history: Price history DataFrame
+        dates: Dates to look up
+        inventory_data: Optional inventory DataFrame; its price_per_liter is used
+            for dates before the first recorded price of an ingredient
+
+    Returns:
+        pandas.DataFrame: date, ingredient_name and price_per_liter
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize().unique().astype('datetime64[ns]')
+    ingredients = set(price_history['ingredient_name'])
+    if inventory_data is not None:
+        ingredients |= set(inventory_data['ingredient_name'].dropna())
+
+    keys = pd.MultiIndex.from_product([sorted(ingredients), dates], names=['ingredient_name', 'date']).to_frame(index=False)
+    prices = _lookup_prices(price_history, keys)
+
+    if inventory_data is not None:
+        current_prices = inventory_data.drop_duplicates('ingredient_name').set_index('ingredient_name')['price_per_liter']
+        prices['price_per_liter'] = prices['price_per_liter'].fillna(prices['ingredient_name'].map(current_prices))
+
+    return prices[['date', 'ingredient_name', 'price_per_liter']].sort_values(['date', 'ingredient_name']).reset_index(drop=True)
+
+def calculate_drink_costs_as_of(price_history, recipe_data, dates, inventory_data=None):
+    """
+    Calculate the cost of every drink at several dates in one vectorized pass
+
+    The prices of all ingredients at all dates are looked up with one sorted
+    as-of join, then joined with the recipes and summed per date and drink.
+
+    Args:
+        price_history: Price history DataFrame
+        recipe_data: Recipe DataFrame
+        dates: Dates to cost the drinks at
+        inventory_data: Optional inventory DataFrame with the prices used before
+            the first recorded price of an ingredient
+
+    Returns:
+        pandas.DataFrame: date, drink_name and total_cost
+    """
+    try:
+        prices = get_prices_as_of(price_history, dates, inventory_data)
+
+        recipe_costs = recipe_data[['drink_name', 'ingredient_name', 'amount_ml']].astype(
+            {'ingredient_name': object}).merge(prices, on='ingredient_name', how='left')
+        # Zutaten ohne Preis kosten nichts (wie in calculate_drink_costs)
+        recipe_costs['cost'] = recipe_costs['amount_ml'] * recipe_costs['price_per_liter'].fillna(0) / 1000
+
+        costs = recipe_costs.dropna(subset=['date']).groupby(['date', 'drink_name'], as_index=False)['cost'].sum()
+        return costs.rename(columns={'cost': 'total_cost'})
+
+    except Exception as e:
+        log_error(logger, "Error calculating drink costs as of dates", e)
+        return None
+
+def calculate_drink_costs_for_range(price_history, recipe_data, start_date, end_date, inventory_data=None):
+    """
+    Calculate the cost of every drink for every day of a date range
+
+    Args:
+        price_history: Price history DataFrame
+        recipe_data: Recipe DataFrame
+        start_date: First day
+        end_date: Last day
+        inventory_data: Optional inventory DataFrame (see calculate_drink_costs_as_of)
+
+    Returns:
+        pandas.DataFrame: date, drink_name and total_cost
+    """
+    return calculate_drink_costs_as_of(price_history, recipe_data, pd.date_range(start_date, end_date, freq='D'),
+                                       inventory_data)
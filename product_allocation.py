@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from data_processor import get_generic_product_group, map_products_to_drinks
+from sales_history import list_periods, get_sales_frame
+from metrics import get_logger, log_error
+
+logger = get_logger('product_allocation')
+
+ALLOCATION_GROUP_COLUMNS = ['group_name', 'member_name', 'amount_ml', 'weight']
+
+ALLOCATION_COLUMNS = ['group_name', 'ingredient_name', 'usage_ml']
+
+def create_allocation_groups():
+    """
+    Create an empty table of allocation groups
+
+    Every row assigns a member to the Warengruppe of a generic POS product,
+    e.g. "Gin Tonic" to "Longdrinks" for "Divers. Longdrinks". A member is
+    a drink (or POS product) with a recipe, or an ingredient that is poured
+    with amount_ml per sale, e.g. 40ml rum for an unnamed shot. The optional
+    weight fixes the share of a member; without a weight, its share follows
+    the historical sales mix of the group.
+
+    Returns:
+        pandas.DataFrame: Empty allocation groups
+    """
+    return pd.DataFrame({
+        'group_name': pd.Series(dtype=object),
+        'member_name': pd.Series(dtype=object),
+        'amount_ml': pd.Series(dtype=float),
+        'weight': pd.Series(dtype=float)
+    })
+
+def _get_member_sales(sales_history, recipe_data, days, product_mapping):
+    """Sum the drinks sold in the last `days` days of the sales history (all days for None)"""
+    day_keys = list_periods(sales_history, 'day') if sales_history is not None else []
+    if not day_keys:
+        return {}
+    if days is not None:
+        first_day = (pd.Timestamp(day_keys[-1]) - pd.Timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        day_keys = [day for day in day_keys if day >= first_day]
+
+    sales = get_sales_frame(sales_history, 'day', day_keys)
+    mapping = map_products_to_drinks(sales['product_name'].unique(), recipe_data, product_mapping)
+    sales = sales.assign(drink_name=sales['product_name'].map(mapping)).dropna(subset=['drink_name'])
+    return sales.groupby('drink_name')['quantity'].sum().to_dict()
+
+def build_allocation(allocation_groups, recipe_data, sales_history=None, days=90, product_mapping=None):
+    """
+    Precompute the ingredient usage of one sold generic product per Warengruppe
+
+    The shares of the members are their weights, or else their sales over
+    the last `days` days of the sales history. Members without weight and
+    without sales get no share; in a group without any such sales, every
+    member without weight counts equally. The result is one vector per
+    group, so that depletion only needs a single merge.
+
+    Args:
+        allocation_groups: Allocation groups DataFrame
+        recipe_data: Recipe DataFrame
+        sales_history: Optional sales history dictionary for the historical mix
+        days: Length of the history window in days (None for the whole history)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: group_name, ingredient_name and usage_ml per sold generic product
+    """
+    try:
+        empty = pd.DataFrame({'group_name': pd.Series(dtype=object), 'ingredient_name': pd.Series(dtype=object),
+                              'usage_ml': pd.Series(dtype=float)})
+        if allocation_groups is None or allocation_groups.empty or recipe_data is None:
+            return empty
+
+        groups = allocation_groups.dropna(subset=['group_name', 'member_name']).astype(
+            {'group_name': object, 'member_name': object})
+        groups = groups.assign(amount_ml=pd.to_numeric(groups['amount_ml'], errors='coerce'),
+                               weight=pd.to_numeric(groups['weight'], errors='coerce'))
+        groups = groups.drop_duplicates(['group_name', 'member_name']).reset_index(drop=True)
+        if groups.empty:
+            return empty
+
+        # Mitglieder mit Menge sind Zutaten, alle anderen Drinks mit Rezept
+        is_ingredient = groups['amount_ml'].notna().to_numpy()
+        mapping = map_products_to_drinks(groups.loc[~is_ingredient, 'member_name'].unique(), recipe_data,
+                                         product_mapping)
+        drink_names = groups['member_name'].map(mapping).where(~is_ingredient)
+
+        # Anteile: feste Gewichte, sonst der historische Verkaufsmix der Gruppe
+        member_sales = _get_member_sales(sales_history, recipe_data, days, product_mapping)
+        sold = drink_names.map(member_sales).fillna(0).to_numpy(dtype=float)
+        weights = groups['weight'].to_numpy(dtype=float)
+        unweighted = np.isnan(weights)
+        group_codes, group_names = pd.factorize(groups['group_name'])
+        group_sold = np.bincount(group_codes, weights=np.where(unweighted, sold, 0), minlength=len(group_names))
+        shares = np.where(unweighted, np.where(group_sold[group_codes] > 0, sold, 1.0), weights)
+        shares = np.where(is_ingredient | drink_names.notna().to_numpy(), np.clip(shares, 0, None), 0)
+        group_total = np.bincount(group_codes, weights=shares, minlength=len(group_names))
+        shares = np.divide(shares, group_total[group_codes], out=np.zeros_like(shares),
+                           where=group_total[group_codes] > 0)
+
+        members = groups.assign(drink_name=drink_names, share=shares)
+        members = members[members['share'] > 0]
+
+        drink_usage = members.dropna(subset=['drink_name']).merge(
+            recipe_data[['drink_name', 'ingredient_name', 'amount_ml']].rename(columns={'amount_ml': 'recipe_ml'}),
+            on='drink_name'
+        )
+        drink_usage['usage_ml'] = drink_usage['share'] * drink_usage['recipe_ml']
+        ingredient_usage = members[members['drink_name'].isna()].assign(ingredient_name=lambda df: df['member_name'])
+        ingredient_usage['usage_ml'] = ingredient_usage['share'] * ingredient_usage['amount_ml']
+
+        allocation = pd.concat([drink_usage[ALLOCATION_COLUMNS], ingredient_usage[ALLOCATION_COLUMNS]],
+                               ignore_index=True)
+        return allocation.groupby(['group_name', 'ingredient_name'], as_index=False)['usage_ml'].sum()
+
+    except Exception as e:
+        log_error(logger, "Error building product allocation", e)
+        return None
+
+def get_unallocated_products(product_names, allocation):
+    """
+    Find generic "Divers." products whose Warengruppe has no allocation
+
+    Args:
+        product_names: Iterable of product names from the sales reports
+        allocation: Result of build_allocation
+
+    Returns:
+        list: Generic product names that are not deducted from the inventory
+    """
+    allocated_groups = set() if allocation is None else set(allocation['group_name'])
+    return sorted({name for name in product_names
+                   if get_generic_product_group(name) is not None
+                   and get_generic_product_group(name) not in allocated_groups})
@@ -0,0 +1,100 @@
+import pandas as pd
+
+from sales_history import list_periods, get_period_keys
+
+CASH_UP_COLUMNS = ['date', 'cash_sales', 'cash_tips', 'expected_cash', 'counted_cash', 'difference']
+
+def get_reconciliation_summary(history, period_type='month', period_key=None):
+    """
+    Reconcile sales, payments, taxes and tips of a period from the precomputed rollups
+
+    The sales total of the products should equal the sum of all payment
+    methods and the gross revenue of all tax rates; the tips of the payment
+    methods should add up to the Trinkgeld of the report.
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+
+    Returns:
+        dict: Totals of the period and the differences between them (None if the period has no sales)
+    """
+    rollups = history['rollups'][period_type]
+    if period_key is None and rollups:
+        period_key = max(rollups.keys())
+    bucket = rollups.get(period_key)
+    if bucket is None:
+        return None
+
+    def section_sum(section, field):
+        return sum(entry[field] for entry in bucket.get(section, {}).values())
+
+    summary = {
+        'period': period_key,
+        'report_count': bucket['report_count'],
+        'sales_total': bucket['total_sales'],
+        'payments_total': section_sum('payments', 'total'),
+        'gross_total': section_sum('taxes', 'gross'),
+        'net_total': section_sum('taxes', 'net'),
+        'tax_total': section_sum('taxes', 'tax'),
+        'tips_total': bucket.get('tips', 0),
+        'payment_tips_total': section_sum('payments', 'tip'),
+        'voids_quantity': section_sum('voids', 'quantity'),
+        'voids_total': section_sum('voids', 'total')
+    }
+    summary['payments_difference'] = summary['payments_total'] - summary['sales_total']
+    summary['tax_difference'] = summary['gross_total'] - summary['sales_total']
+    summary['tips_difference'] = summary['payment_tips_total'] - summary['tips_total']
+    return summary
+
+def calculate_cash_up(history, period_type='month', period_key=None, cash_counts=None, opening_float=0.0,
+                      cash_method="Bar", tips_in_drawer=True):
+    """
+    Compare the expected cash of every day of a period with the counted cash
+
+    The expected cash of a day is the opening float plus the cash payments
+    of the day (plus the cash tips if they stay in the drawer). Every day is
+    a lookup in the day rollups, so a month-end cash-up does not re-parse
+    any report.
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+        cash_counts: Optional dictionary {day (YYYY-MM-DD): counted cash}
+        opening_float: Change in the drawer at the start of every day
+        cash_method: Name of the cash payment method in the report
+        tips_in_drawer: Whether cash tips stay in the drawer
+
+    Returns:
+        pandas.DataFrame: One row per day with cash sales, tips, expected and counted cash and difference
+    """
+    cash_counts = cash_counts or {}
+    periods = list_periods(history, period_type)
+    if period_key is None and periods:
+        period_key = periods[-1]
+
+    rows = []
+    day_rollups = history['rollups']['day']
+    for day in list_periods(history, 'day'):
+        # Tag, Monat und Jahr sind Präfixe des Tages, nur Wochen müssen berechnet werden
+        if period_type == 'week' and get_period_keys(day)['week'] != period_key:
+            continue
+        if period_type != 'week' and not day.startswith(period_key or ''):
+            continue
+        cash = day_rollups[day].get('payments', {}).get(cash_method, {})
+        cash_sales = cash.get('total', 0.0)
+        cash_tips = cash.get('tip', 0.0)
+        expected_cash = opening_float + cash_sales + (cash_tips if tips_in_drawer else 0.0)
+        counted_cash = cash_counts.get(day)
+        rows.append({
+            'date': day,
+            'cash_sales': cash_sales,
+            'cash_tips': cash_tips,
+            'expected_cash': expected_cash,
+            'counted_cash': counted_cash,
+            'difference': None if counted_cash is None else counted_cash - expected_cash
+        })
+
+    return pd.DataFrame(rows, columns=CASH_UP_COLUMNS).astype({'counted_cash': float, 'difference': float})
@@ -0,0 +1,354 @@
+import glob
+import io
+import json
+import os
+import shutil
+import time
+
+from data_processor import process_sales_data
+
+REPORT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attached_assets", "report_corpus")
+
+# Trennzeile zwischen den Abschnitten eines Tagesberichts
+SECTION_SEPARATOR = ";;;;"
+
+def _is_empty_line(line):
+    """Check whether a report line has no content in any field"""
+    return not any(part.strip() for part in line.split(';'))
+
+def _split_sections(report_text):
+    """Split a day report into blocks of lines separated by empty lines"""
+    blocks = [[]]
+    for line in report_text.replace('\r\n', '\n').split('\n'):
+        if _is_empty_line(line):
+            blocks.append([])
+        else:
+            blocks[-1].append(line)
+    return [block for block in blocks if block]
+
+def _join_sections(blocks, line_ending='\r\n'):
+    """Join blocks of lines into a day report"""
+    lines = []
+    for block in blocks:
+        lines.extend(block)
+        lines.append(SECTION_SEPARATOR)
+    return line_ending.join(lines) + line_ending
+
+def _find_block(blocks, section_name):
+    """Get the position of the block that starts with a section name (None if missing)"""
+    for i, block in enumerate(blocks):
+        if block[0].split(';')[0].strip() == section_name:
+            return i
+    return None
+
+def _format_german_number(value):
+    """Format a number in German notation with thousands separator, e.g. 1.448,00"""
+    return f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def build_report_variants(report_text, expected, n_products=2000):
+    """
+    Derive synthetic variants of a real day report together with their expected parse results
+
+    The variants cover format drift seen (or to be expected) in POS exports:
+    other section orders, empty or missing sections, many products, several
+    registers in one report and other line endings/encodings. The expected
+    result of every variant follows from the reviewed result of the real
+    report, so it does not depend on the parser that is checked.
+
+    Args:
+        report_text: Content of the real day report
+        expected: Reviewed parse result of the real report
+        n_products: Number of products of the "many_products" variant
+
+    Returns:
+        dict: {variant name: (report content as bytes, expected parse result)}
+    """
+    blocks = _split_sections(report_text)
+    # Die ersten beiden Blöcke (Kopf mit Datum/Z-Nummer, Spaltenköpfe + Umsatz) bleiben immer vorne
+    head, sections = blocks[:2], blocks[2:]
+    empty_result = dict(expected, total_sales=0,
+                        **{key: [] for key, value in expected.items() if isinstance(value, list)})
+    variants = {}
+
+    reordered = head + sections[::-1]
+    variants['sections_reordered'] = (_join_sections(reordered).encode('utf-8'), expected)
+
+    variants['lf_line_endings'] = (_join_sections(blocks, '\n').encode('utf-8'), expected)
+    variants['utf8_bom'] = (b'\xef\xbb\xbf' + _join_sections(blocks).encode('utf-8'), expected)
+
+    products_position = _find_block(blocks, "Produkte")
+    empty_products = [block[:1] if i == products_position else block for i, block in enumerate(blocks)]
+    # Leerer Produkte-Abschnitt vor den übrigen Abschnitten: deren Zeilen dürfen nicht als Produkte gelten
+    empty_products = head + [empty_products[products_position]] + [
+        block for i, block in enumerate(empty_products[2:], 2) if i != products_position]
+    variants['empty_products'] = (_join_sections(empty_products).encode('utf-8'),
+                                  dict(expected, total_sales=0, products=[]))
+
+    variants['empty_sections'] = (_join_sections(head + [block[:1] for block in sections]).encode('utf-8'),
+                                  empty_result)
+
+    groups_position = _find_block(blocks, "Warengruppen")
+    without_groups = [block for i, block in enumerate(blocks) if i != groups_position]
+    variants['missing_product_groups'] = (_join_sections(without_groups).encode('utf-8'),
+                                          dict(expected, product_groups=[]))
+
+    products = [{'product_name': f"Produkt {i:05d}", 'quantity': i % 50 + 1,
+                 'total': round((i % 50 + 1) * (4.5 + i % 7) * (1 + i % 3 * 50), 2)}
+                for i in range(n_products)]
+    product_lines = [f"{product['product_name']};0;{product['quantity']};{_format_german_number(product['total'])};"
+                     f"0,00 %;;{product['quantity']};{_format_german_number(product['total'])};;0;0,00"
+                     for product in products]
+    many_products = [block[:1] + product_lines if i == products_position else block for i, block in enumerate(blocks)]
+    variants['many_products'] = (_join_sections(many_products).encode('utf-8'),
+                                 dict(expected, products=products,
+                                      total_sales=round(sum(product['total'] for product in products), 2)))
+
+    # Mehrere Kassen: Z-Bereich im Kopf, eine Zeile pro Kasse in den Umsatzdetails
+    z_from = int(expected['z_number'].split('-')[0])
+    registers = [[f"Enthalt Z;{z_from};{z_from + 2};;" if line.startswith("Enthalt Z") else line for line in block]
+                 for block in blocks]
+    details_position = _find_block(registers, "Umsatzdetails")
+    if details_position is not None:
+        registers[details_position] = registers[details_position][:1] + [
+            f"Kasse {i};;;0,00;0,00 %;0,00" for i in range(1, 4)] + registers[details_position][1:]
+    variants['multiple_registers'] = (_join_sections(registers).encode('utf-8'),
+                                      dict(expected, z_number=f"{z_from}-{z_from + 2}"))
+
+    return variants
+
+def check_expected_totals(expected, tolerance=0.01):
+    """
+    Check that the sections of a parse result add up to the totals of the report
+
+    This check does not use any parser, so it also catches a wrong result
+    that a faulty parser wrote as candidate: products, Warengruppen,
+    payments and taxes each have to add up to the total sales, the payment
+    tips to the tips and net plus tax to gross for every tax rate.
+
+    Args:
+        expected: Parse result of a real day report
+        tolerance: Allowed rounding difference in EUR
+
+    Returns:
+        list: Descriptions of the totals that do not add up
+    """
+    problems = []
+    total_sales = expected.get('total_sales', 0)
+    sums = [
+        ('products', 'total', total_sales),
+        ('product_groups', 'total', total_sales),
+        ('payments', 'total', total_sales),
+        ('payments', 'tip', expected.get('tips', 0)),
+        ('taxes', 'gross', total_sales)
+    ]
+    for section, field, total in sums:
+        rows = expected.get(section)
+        if rows and abs(sum(row.get(field, 0) for row in rows) - total) > tolerance:
+            problems.append(f"{section}.{field} adds up to {sum(row.get(field, 0) for row in rows):.2f}, "
+                            f"not {total:.2f}")
+    for row in expected.get('taxes', []):
+        if abs(row['net'] + row['tax'] - row['gross']) > tolerance:
+            problems.append(f"taxes {row['tax_rate']}%: net + tax is not gross")
+    return problems
+
+def add_report_to_corpus(report_path, corpus_dir=REPORT_CORPUS_DIR, parser=process_sales_data):
+    """
+    Copy a real day report into the corpus and write the parse result as candidate
+
+    The candidate (<name>.candidate.json) comes from the parser under test,
+    so it is not used as expected result until it has been checked against
+    the report by hand and approved with approve_report.
+
+    Args:
+        report_path: Path of the day report
+        corpus_dir: Corpus directory
+        parser: Parser creating the candidate
+
+    Returns:
+        str: Path of the candidate
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(report_path))[0]
+    shutil.copyfile(report_path, os.path.join(corpus_dir, f"{name}.csv"))
+
+    with open(report_path, 'rb') as report_file:
+        candidate = parser(report_file)
+    candidate_path = os.path.join(corpus_dir, f"{name}.candidate.json")
+    with open(candidate_path, 'w', encoding='utf-8') as candidate_file:
+        json.dump(candidate, candidate_file, ensure_ascii=False, indent=1)
+    return candidate_path
+
+def approve_report(name, corpus_dir=REPORT_CORPUS_DIR):
+    """
+    Turn the reviewed candidate of a real report into its expected result
+
+    Args:
+        name: Report name (file name without .csv)
+        corpus_dir: Corpus directory
+
+    Returns:
+        str: Path of the expected result
+
+    Raises:
+        ValueError: If the totals of the candidate do not add up
+    """
+    candidate_path = os.path.join(corpus_dir, f"{name}.candidate.json")
+    with open(candidate_path, encoding='utf-8') as candidate_file:
+        problems = check_expected_totals(json.load(candidate_file))
+    if problems:
+        raise ValueError(f"Candidate of {name} does not add up: {'; '.join(problems)}")
+
+    expected_path = os.path.join(corpus_dir, f"{name}.expected.json")
+    os.replace(candidate_path, expected_path)
+    return expected_path
+
+def build_report_corpus(corpus_dir=REPORT_CORPUS_DIR):
+    """
+    Write the synthetic variants of every real report in the corpus with their expected results
+
+    Args:
+        corpus_dir: Corpus directory
+
+    Returns:
+        int: Number of variants written
+    """
+    count = 0
+    for report_path in _list_real_reports(corpus_dir):
+        name = os.path.splitext(os.path.basename(report_path))[0]
+        with open(report_path, 'r', encoding='utf-8', newline='') as report_file:
+            report_text = report_file.read()
+        with open(os.path.join(corpus_dir, f"{name}.expected.json"), encoding='utf-8') as expected_file:
+            expected = json.load(expected_file)
+
+        for variant, (content, variant_expected) in build_report_variants(report_text, expected).items():
+            with open(os.path.join(corpus_dir, f"{name}--{variant}.csv"), 'wb') as variant_file:
+                variant_file.write(content)
+            with open(os.path.join(corpus_dir, f"{name}--{variant}.expected.json"), 'w',
+                      encoding='utf-8') as expected_file:
+                json.dump(variant_expected, expected_file, ensure_ascii=False, indent=1)
+            count += 1
+    return count
+
+def _has_expected_result(report_path):
+    """Check whether a report of the corpus has an approved expected result"""
+    return os.path.exists(os.path.splitext(report_path)[0] + ".expected.json")
+
+def _list_real_reports(corpus_dir):
+    """List the real (not synthetic) reports of the corpus with an approved expected result"""
+    return [path for path in sorted(glob.glob(os.path.join(corpus_dir, "*.csv")))
+            if "--" not in os.path.basename(path) and _has_expected_result(path)]
+
+def load_report_corpus(corpus_dir=REPORT_CORPUS_DIR):
+    """
+    Load all reports of the corpus with their expected results (reports still waiting for review are skipped)
+
+    Args:
+        corpus_dir: Corpus directory
+
+    Returns:
+        dict: {report name: (report content as bytes, expected parse result)}
+    """
+    corpus = {}
+    for report_path in filter(_has_expected_result, sorted(glob.glob(os.path.join(corpus_dir, "*.csv")))):
+        name = os.path.splitext(os.path.basename(report_path))[0]
+        with open(report_path, 'rb') as report_file:
+            content = report_file.read()
+        with open(os.path.join(corpus_dir, f"{name}.expected.json"), encoding='utf-8') as expected_file:
+            corpus[name] = (content, json.load(expected_file))
+    return corpus
+
+def _normalize_result(value):
+    """Round floats so that parse results can be compared with the stored expected results"""
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, dict):
+        return {key: _normalize_result(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize_result(item) for item in value]
+    return value
+
+def check_report_corpus(corpus=None, parser=process_sales_data):
+    """
+    Parse every report of the corpus and compare the result with the expected result
+
+    Args:
+        corpus: Result of load_report_corpus (default: the corpus in REPORT_CORPUS_DIR)
+        parser: Parser to check
+
+    Returns:
+        list: Mismatches as dictionaries with report, field, expected and actual
+    """
+    if corpus is None:
+        corpus = load_report_corpus()
+
+    mismatches = []
+    for name, (content, expected) in corpus.items():
+        # Die Erwartung echter Berichte muss in sich aufgehen, unabhängig vom Parser
+        if "--" not in name:
+            mismatches.extend({'report': name, 'field': 'expected totals', 'expected': None, 'actual': problem}
+                              for problem in check_expected_totals(expected))
+        try:
+            actual = _normalize_result(parser(io.BytesIO(content)))
+        except Exception as e:
+            mismatches.append({'report': name, 'field': 'error', 'expected': None, 'actual': str(e)})
+            continue
+
+        expected = _normalize_result(expected)
+        for field in sorted(set(expected) | set(actual)):
+            if expected.get(field) != actual.get(field):
+                mismatches.append({'report': name, 'field': field,
+                                   'expected': expected.get(field), 'actual': actual.get(field)})
+    return mismatches
+
+def benchmark_parser(corpus=None, parser=process_sales_data, repeat=20):
+    """
+    Measure the parser throughput on the corpus
+
+    Args:
+        corpus: Result of load_report_corpus (default: the corpus in REPORT_CORPUS_DIR)
+        parser: Parser to measure
+        repeat: Number of times every report is parsed
+
+    Returns:
+        list: Per report (and "Total") the size in bytes, seconds per report, MB/s and reports/s
+    """
+    if corpus is None:
+        corpus = load_report_corpus()
+
+    results = []
+    for name, (content, _) in corpus.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parser(io.BytesIO(content))
+        seconds = (time.perf_counter() - start) / repeat
+        results.append({'report': name, 'bytes': len(content), 'seconds': seconds,
+                        'mb_per_s': len(content) / seconds / 1e6, 'reports_per_s': 1 / seconds})
+
+    total_bytes = sum(result['bytes'] for result in results)
+    total_seconds = sum(result['seconds'] for result in results)
+    if total_seconds > 0:
+        results.append({'report': 'Total', 'bytes': total_bytes, 'seconds': total_seconds,
+                        'mb_per_s': total_bytes / total_seconds / 1e6, 'reports_per_s': len(corpus) / total_seconds})
+    return results
+
+if __name__ == "__main__":
+    import sys
+    if "--add" in sys.argv:
+        report_path = sys.argv[sys.argv.index("--add") + 1]
+        print(f"Candidate written to {add_report_to_corpus(report_path)} - check it against the report, "
+              f"then run --approve <name>")
+    if "--approve" in sys.argv:
+        print(f"Expected result written to {approve_report(sys.argv[sys.argv.index('--approve') + 1])}")
+    if "--build" in sys.argv:
+        print(f"{build_report_corpus()} synthetic reports written to {REPORT_CORPUS_DIR}")
+    if "--benchmark" in sys.argv:
+        for result in benchmark_parser():
+            print(f"{result['report']:<60} {result['bytes']:>9} B {result['mb_per_s']:>8.2f} MB/s "
+                  f"{result['reports_per_s']:>9.1f} reports/s")
+
+    mismatches = check_report_corpus()
+    for mismatch in mismatches:
+        print(f"{mismatch['report']}: {mismatch['field']} differs (expected {str(mismatch['expected'])[:80]}, "
+              f"got {str(mismatch['actual'])[:80]})")
+    print(f"{len(load_report_corpus())} reports checked, {len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
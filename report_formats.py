@@ -0,0 +1,400 @@
+import csv
+import io
+import itertools
+import os
+from datetime import datetime, timedelta
+
+from data_processor import process_sales_data
+from metrics import get_logger, increment, timed
+
+logger = get_logger('report_formats')
+
+# So viel vom Dateianfang wird für die Formaterkennung gelesen
+FINGERPRINT_BYTES = 4096
+
+# Registrierte Berichtsformate: Name -> detect, iter_records und Beschreibung
+REPORT_FORMATS = {}
+
+# Felder der Datensätze, die ein Format liefert, und unter welchem Schlüssel sie im Tagesbericht landen
+RECORD_SECTIONS = {
+    'product': ('products', 'product_name', ['quantity', 'total']),
+    'product_group': ('product_groups', 'group_name', ['quantity', 'total']),
+    'payment': ('payments', 'payment_method', ['quantity', 'total', 'tip']),
+    'void': ('voids', 'reason', ['quantity', 'total']),
+    'table': ('tables', 'table_name', ['quantity', 'total']),
+    'tax': ('taxes', 'tax_rate', ['gross', 'net', 'tax'])
+}
+
+# Spaltennamen der Bonjournale verschiedener Kassen (Kleinbuchstaben)
+JOURNAL_COLUMNS = {
+    'date': ['datum', 'date', 'buchungsdatum', 'zeitpunkt', 'datum/uhrzeit'],
+    'receipt': ['beleg', 'belegnummer', 'bon', 'bonnummer', 'rechnung', 'receipt'],
+    'product_name': ['produkt', 'artikel', 'artikelname', 'bezeichnung', 'product'],
+    'group_name': ['warengruppe', 'produktgruppe', 'kategorie', 'group'],
+    'quantity': ['menge', 'anzahl', 'quantity'],
+    'total': ['betrag', 'total', 'umsatz', 'brutto', 'summe', 'amount'],
+    'payment_method': ['zahlungsart', 'zahlart', 'payment'],
+    'tip': ['trinkgeld', 'tip'],
+    'table_name': ['tisch', 'table'],
+    'tax_rate': ['steuersatz', 'mwst', 'tax rate']
+}
+
+# Datumsformate der Bonjournale, mit oder ohne Uhrzeit
+JOURNAL_DATE_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y",
+                        "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+def register_report_format(name, detect, iter_records, description=""):
+    """
+    Register a parser for a POS report format
+
+    detect gets the first FINGERPRINT_BYTES of a file and returns a score
+    (0 = not this format); the format with the highest score is used.
+    iter_records gets the file and yields one dictionary per record, see
+    assemble_sales_reports.
+
+    Args:
+        name: Name of the format, e.g. 'day_report'
+        detect: Function (head bytes) -> score
+        iter_records: Function (report file) -> iterator of records
+        description: Short description for the user
+    """
+    REPORT_FORMATS[name] = {'detect': detect, 'iter_records': iter_records, 'description': description}
+
+def _read_head(report_file, size=FINGERPRINT_BYTES):
+    """Read the first bytes of a path or file object without moving its position"""
+    if isinstance(report_file, (str, os.PathLike)):
+        with open(report_file, 'rb') as file:
+            return file.read(size)
+    position = report_file.tell()
+    head = report_file.read(size)
+    report_file.seek(position)
+    return head if isinstance(head, bytes) else head.encode('utf-8')
+
+def _decode_head(head):
+    """Decode a file head for fingerprinting (a character cut off at the end is ignored)"""
+    return head.decode('utf-8-sig', errors='ignore')
+
+def detect_report_format(report_file):
+    """
+    Detect the format of a report from the first few KB of the file
+
+    Args:
+        report_file: Path or binary file object of the report
+
+    Returns:
+        str: Name of the registered format
+    """
+    head = _read_head(report_file)
+    scores = {name: report_format['detect'](head) for name, report_format in REPORT_FORMATS.items()}
+    name, score = max(scores.items(), key=lambda item: item[1], default=(None, 0))
+    if not score:
+        raise Exception("Unknown report format (known formats: " + ", ".join(REPORT_FORMATS) + ")")
+    return name
+
+def _open_binary(report_file):
+    """Open a path for reading or use a file object as it is"""
+    if isinstance(report_file, (str, os.PathLike)):
+        return open(report_file, 'rb'), True
+    return report_file, False
+
+def iter_report_records(report_file, format_name=None):
+    """
+    Stream the records of a report in the common record format
+
+    Args:
+        report_file: Path or binary file object of the report
+        format_name: Registered format (default: detected from the file)
+
+    Yields:
+        dict: Records, see assemble_sales_reports
+    """
+    format_name = format_name or detect_report_format(report_file)
+    if format_name not in REPORT_FORMATS:
+        raise Exception(f"Unknown report format {format_name}")
+    return REPORT_FORMATS[format_name]['iter_records'](report_file)
+
+def assemble_sales_reports(records):
+    """
+    Combine records into one sales data dictionary per business day
+
+    Every record has a 'type' and a 'date' (YYYY-MM-DD). Types are
+    'report' (with z_number), 'tip' (with amount) and the types in
+    RECORD_SECTIONS with their name and value fields. Records with the same
+    name are added up, so journals can yield one record per receipt line.
+
+    Args:
+        records: Iterable of records
+
+    Returns:
+        list: Sales data dictionaries like those of process_sales_data, oldest day first
+    """
+    days = {}
+    for record in records:
+        day = days.get(record['date'])
+        if day is None:
+            day = days[record['date']] = {
+                'date': record['date'],
+                'z_number': None,
+                'total_sales': 0,
+                **{section: {} for section, _, _ in RECORD_SECTIONS.values()},
+                'tips': 0.0
+            }
+
+        record_type = record['type']
+        if record_type == 'report':
+            day['z_number'] = record.get('z_number')
+        elif record_type == 'tip':
+            day['tips'] += record['amount']
+        else:
+            section, name_field, fields = RECORD_SECTIONS[record_type]
+            entry = day[section].get(record[name_field])
+            if entry is None:
+                day[section][record[name_field]] = {name_field: record[name_field],
+                                                    **{field: record.get(field, 0) for field in fields}}
+            else:
+                for field in fields:
+                    entry[field] += record.get(field, 0)
+            if record_type == 'product':
+                day['total_sales'] += record['total']
+
+    for day in days.values():
+        for section, _, _ in RECORD_SECTIONS.values():
+            day[section] = list(day[section].values())
+    return [days[date] for date in sorted(days)]
+
+@timed
+def read_sales_reports(report_file, format_name=None):
+    """
+    Read a POS export of any registered format
+
+    Args:
+        report_file: Path or binary file object of the report
+        format_name: Registered format (default: detected from the first few KB)
+
+    Returns:
+        list: One sales data dictionary per business day, oldest first
+    """
+    try:
+        return assemble_sales_reports(iter_report_records(report_file, format_name))
+
+    except Exception as e:
+        increment('rumbar_parse_failures_total', file=format_name or 'report')
+        raise Exception(f"Error reading sales report: {str(e)}")
+
+def parse_sales_report(report_file, format_name=None):
+    """
+    Read a POS export that covers exactly one business day (drop-in for process_sales_data)
+
+    Args:
+        report_file: Path or binary file object of the report
+        format_name: Registered format (default: detected from the first few KB)
+
+    Returns:
+        dict: Sales data of the day
+    """
+    reports = read_sales_reports(report_file, format_name)
+    if len(reports) != 1:
+        raise Exception(f"Expected a report of one day, found {len(reports)} days")
+    return reports[0]
+
+# Tagesbericht (Z-Bericht) der bisherigen Kasse
+
+def _detect_day_report(head):
+    """Score the head of a file as semicolon day report ("Datum:", "Enthalt Z" and section names)"""
+    text = _decode_head(head)
+    first_fields = {line.split(';', 1)[0].strip() for line in text.splitlines() if ';' in line}
+    markers = {"Datum:", "Enthalt Z", "Umsatz", "Umsatz (Brutto)", "Steuern", "Zahlungsarten"}
+    return len(first_fields & markers)
+
+def _iter_day_report_records(report_file):
+    """
+    Yield the records of a day report
+
+    A day report holds the totals of one day in a few KB, so it is parsed
+    as a whole with process_sales_data and then turned into records.
+    """
+    file, opened = _open_binary(report_file)
+    try:
+        sales_data = process_sales_data(file)
+    finally:
+        if opened:
+            file.close()
+
+    date = sales_data['date']
+    yield {'type': 'report', 'date': date, 'z_number': sales_data['z_number']}
+    for record_type, (section, _, _) in RECORD_SECTIONS.items():
+        for entry in sales_data.get(section, []):
+            yield {'type': record_type, 'date': date, **entry}
+    yield {'type': 'tip', 'date': date, 'amount': sales_data.get('tips', 0.0)}
+
+# Bonjournal: eine Zeile pro verkauftem Artikel (CSV oder Excel)
+
+def _find_journal_columns(header):
+    """Map the columns of a journal header to record fields (None if it is not a journal)"""
+    names = [str(name or '').strip().lower() for name in header]
+    positions = {}
+    for field, aliases in JOURNAL_COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                positions[field] = names.index(alias)
+                break
+    if not {'date', 'product_name', 'quantity', 'total'} <= positions.keys():
+        return None
+    return positions
+
+def _detect_receipt_journal(head):
+    """Score the head of a file as CSV receipt journal (header with date, product, quantity and amount)"""
+    text = _decode_head(head)
+    header = text.splitlines()[0] if text else ""
+    delimiter = max(';,\t', key=header.count)
+    positions = _find_journal_columns(next(csv.reader([header], delimiter=delimiter), []))
+    # Mit Belegnummer eindeutig, sonst nur ein Kandidat
+    return 0 if positions is None else (3 if 'receipt' in positions else 2)
+
+def _parse_journal_date(value, day_start_hour, date_formats):
+    """
+    Get the business day of a journal timestamp (sales before day_start_hour belong to the day before)
+
+    The format that matched is moved to the front of date_formats, so the
+    following rows of the journal are parsed with a single attempt.
+    """
+    if isinstance(value, datetime):
+        timestamp = value
+    else:
+        text = str(value).strip()
+        for position, date_format in enumerate(date_formats):
+            try:
+                timestamp = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            if position:
+                date_formats.insert(0, date_formats.pop(position))
+            break
+        else:
+            raise ValueError(f"Unknown date {text}")
+    if timestamp.hour < day_start_hour:
+        timestamp -= timedelta(days=1)
+    return timestamp.strftime("%Y-%m-%d")
+
+def _parse_journal_number(value):
+    """Parse a journal cell that holds a number (German notation in CSV, numbers in Excel)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value or '').strip().replace('€', '').strip()
+    if not text:
+        return 0.0
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    return float(text)
+
+def _text(value):
+    """Get a journal cell as stripped text ('' for empty cells)"""
+    return '' if value is None else str(value).strip()
+
+def _iter_journal_rows(rows, file_type, day_start_hour=6):
+    """Turn the rows of a receipt journal (header first) into records, one receipt line at a time"""
+    rows = iter(rows)
+    positions = _find_journal_columns(next(rows, []))
+    if positions is None:
+        raise Exception("Journal header needs the columns Datum, Produkt, Menge and Betrag")
+    # Fehlende optionale Spalten zeigen auf eine angehängte leere Zelle
+    width = max(positions.values()) + 1
+    columns = {field: positions.get(field, width) for field in JOURNAL_COLUMNS}
+    padding = [None] * (width + 1)
+
+    seen_receipts = set()
+    date_formats = list(JOURNAL_DATE_FORMATS)
+    # Viele Zeilen teilen sich einen Zeitstempel: jeden nur einmal umrechnen
+    business_days = {}
+    count = 0
+    for row in rows:
+        if not row or not any(_text(value) for value in row):
+            continue
+        row = list(row[:width]) + padding[len(row[:width]):]
+        product_name = _text(row[columns['product_name']])
+        try:
+            timestamp = row[columns['date']]
+            date = business_days.get(timestamp)
+            if date is None:
+                if len(business_days) > 10000:
+                    business_days.clear()
+                date = business_days[timestamp] = _parse_journal_date(timestamp, day_start_hour, date_formats)
+            quantity = _parse_journal_number(row[columns['quantity']])
+            total = _parse_journal_number(row[columns['total']])
+        except ValueError:
+            increment('rumbar_skipped_rows_total', file=file_type)
+            continue
+        if not product_name:
+            increment('rumbar_skipped_rows_total', file=file_type)
+            continue
+        count += 1
+        quantity = int(quantity) if quantity == int(quantity) else quantity
+
+        # Zahlungen und Tische zählen pro Beleg, Trinkgeld steht in jeder Zeile des Belegs
+        receipt = row[columns['receipt']]
+        new_receipt = receipt is None or (date, receipt) not in seen_receipts
+        if receipt is not None:
+            seen_receipts.add((date, receipt))
+
+        yield {'type': 'product', 'date': date, 'product_name': product_name, 'quantity': quantity, 'total': total}
+        group_name = _text(row[columns['group_name']])
+        if group_name:
+            yield {'type': 'product_group', 'date': date, 'group_name': group_name,
+                   'quantity': quantity, 'total': total}
+        tip = _parse_journal_number(row[columns['tip']]) if new_receipt else 0.0
+        payment_method = _text(row[columns['payment_method']])
+        if payment_method:
+            yield {'type': 'payment', 'date': date, 'payment_method': payment_method,
+                   'quantity': int(new_receipt), 'total': total, 'tip': tip}
+        if tip:
+            yield {'type': 'tip', 'date': date, 'amount': tip}
+        table_name = _text(row[columns['table_name']])
+        if table_name:
+            yield {'type': 'table', 'date': date, 'table_name': table_name,
+                   'quantity': int(new_receipt), 'total': total}
+        tax_cell = row[columns['tax_rate']]
+        if _text(tax_cell):
+            tax_rate = _parse_journal_number(tax_cell.rstrip('%') if isinstance(tax_cell, str) else tax_cell)
+            net = total / (1 + tax_rate / 100)
+            yield {'type': 'tax', 'date': date, 'tax_rate': tax_rate, 'gross': total, 'net': net, 'tax': total - net}
+
+    increment('rumbar_rows_parsed_total', count, file=file_type)
+
+def _iter_receipt_journal_records(report_file):
+    """Stream the records of a CSV receipt journal line by line"""
+    file, opened = _open_binary(report_file)
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        header = text.readline()
+        delimiter = max(';,\t', key=header.count)
+        rows = itertools.chain(csv.reader([header], delimiter=delimiter), csv.reader(text, delimiter=delimiter))
+        yield from _iter_journal_rows(rows, 'receipt_journal')
+    finally:
+        if opened:
+            text.close()
+        else:
+            text.detach()
+
+def _detect_excel_journal(head):
+    """Score the head of a file as Excel workbook (XLSX files are ZIP archives)"""
+    return 1 if head.startswith(b'PK\x03\x04') else 0
+
+def _iter_excel_journal_records(report_file):
+    """Stream the records of the first sheet of an Excel receipt journal"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise Exception("Excel reports need the package openpyxl (pip install openpyxl)")
+
+    workbook = load_workbook(report_file, read_only=True, data_only=True)
+    try:
+        yield from _iter_journal_rows(workbook.active.iter_rows(values_only=True), 'excel_journal')
+    finally:
+        workbook.close()
+
+register_report_format('day_report', _detect_day_report, _iter_day_report_records,
+                       "Tagesbericht (Z-Bericht) mit Abschnitten, Semikolon-getrennt")
+register_report_format('receipt_journal', _detect_receipt_journal, _iter_receipt_journal_records,
+                       "Bonjournal als CSV, eine Zeile pro Artikel")
+register_report_format('excel_journal', _detect_excel_journal, _iter_excel_journal_records,
+                       "Bonjournal als Excel-Datei (.xlsx)")
@@ -0,0 +1,261 @@
+"""
+Watch a directory for POS day reports and import them automatically
+
+    python report_watcher.py /pfad/zu/kassenberichten --db rumbar.db [--archive rumbar_archive]
+
+Every new report-day-YYYY-MM-DD-<id>.csv is parsed, stored and deducted from
+the inventory exactly once. Processed files are recorded in a journal in the
+database, so restarting the watcher does not process anything twice. Files
+that fail (e.g. while the database is locked) are not journaled and are tried
+again on the next scan. Generic products ("Divers. ...") are deducted
+with the allocation groups the app stores in the database (see
+product_allocation.py). What an ingredient cannot cover is taken from its
+substitutes (the substitution groups of the app, see substitutions.py). With
+--archive, every report is also added to the out-of-core sales archive
+(see sales_archive.py). When the
+HTTP API is running as well, start the watcher inside it instead
+(api_server.py --watch DIR), so the API sees new reports right away. The
+inventory is read and deducted in one database transaction, so changes the
+app stores in the meantime (deliveries, counts) are not overwritten.
+"""
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+
+from data_processor import update_inventory_based_on_sales
+from product_allocation import build_allocation
+from report_formats import parse_sales_report
+from sales_archive import add_report_to_archive
+from sales_history import create_sales_history, add_sales_report
+from substitutions import build_substitute_index
+from metrics import configure_logging, get_logger, log_error, log_event, write_metrics_file
+from storage import (
+    ConnectionPool, load_inventory, load_recipes, load_allocation_groups, load_substitution_groups,
+    load_sales_reports, save_sales_report, is_depletion_applied, deplete_stored_inventory, is_file_processed, record_processed_file
+)
+
+logger = get_logger('report_watcher')
+
+REPORT_FILE_PATTERN = re.compile(r'^report-day-\d{4}-\d{2}-\d{2}-.+\.csv$', re.IGNORECASE)
+
+def get_report_id(sales_data, content_hash):
+    """
+    Build the id under which a day report is stored
+
+    The id consists of the report date and the Z number, so a report that is
+    exported again (with a different file name or content) is still
+    recognized. Reports without Z number fall back to the content hash.
+
+    Args:
+        sales_data: Sales data dictionary from parse_sales_report
+        content_hash: SHA-256 of the file content
+
+    Returns:
+        str: Report id
+    """
+    if sales_data.get('z_number'):
+        return f"{sales_data['date']}-Z{sales_data['z_number']}"
+    return f"{sales_data['date']}-{content_hash[:12]}"
+
+def find_new_report_files(pool, directory, settle_seconds=2.0):
+    """
+    Find report files in a directory that are not in the journal yet
+
+    Files modified within the last settle_seconds are skipped, because the
+    POS may still be writing them.
+
+    Args:
+        pool: ConnectionPool
+        directory: Directory to scan
+        settle_seconds: Minimum age of a file before it is processed
+
+    Returns:
+        list: Paths of the new report files, oldest first
+    """
+    now_ns = time.time_ns()
+    new_files = []
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not REPORT_FILE_PATTERN.match(entry.name):
+                continue
+            stat = entry.stat()
+            if now_ns - stat.st_mtime_ns < settle_seconds * 1e9:
+                continue
+            if not is_file_processed(pool, entry.name, stat.st_size, stat.st_mtime_ns):
+                new_files.append((entry.name, entry.path))
+
+    # Dateinamen enthalten das Datum, daher ergibt die Sortierung die zeitliche Reihenfolge
+    return [path for _, path in sorted(new_files)]
+
+def load_allocation(pool, recipe_data):
+    """
+    Build the allocation of generic POS products from the stored allocation groups
+
+    The sales mix of the groups comes from the stored day reports.
+
+    Args:
+        pool: ConnectionPool
+        recipe_data: Recipe DataFrame
+
+    Returns:
+        pandas.DataFrame: Allocation from build_allocation (None without stored groups)
+    """
+    allocation_groups = load_allocation_groups(pool)
+    if allocation_groups is None:
+        return None
+    sales_history = create_sales_history()
+    for report_id, sales_data in load_sales_reports(pool):
+        add_sales_report(sales_history, sales_data, report_id)
+    return build_allocation(allocation_groups, recipe_data, sales_history)
+
+def process_report_file(pool, path, archive_dir=None, allocation=None, substitute_index=None):
+    """
+    Import one report file and deduct it from the stored inventory
+
+    Args:
+        pool: ConnectionPool
+        path: Path of the report file
+        archive_dir: Optional directory of the sales archive the report is added to
+        allocation: Optional allocation of generic POS products (default: built from the stored groups)
+        substitute_index: Optional substitute index from build_substitute_index
+            (default: built from the stored substitution groups)
+
+    Returns:
+        dict: file_name, report_id, status and sales_data of the processed file
+    """
+    file_name = os.path.basename(path)
+    stat = os.stat(path)
+    with open(path, 'rb') as report_file:
+        content = report_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    result = {'file_name': file_name, 'report_id': None, 'status': None, 'sales_data': None}
+
+    # Gleicher Inhalt unter anderem Namen: nur im Journal vermerken
+    if is_file_processed(pool, file_name, stat.st_size, stat.st_mtime_ns, content_hash):
+        result['status'] = 'duplicate'
+        record_processed_file(pool, content_hash, file_name, stat.st_size, stat.st_mtime_ns,
+                              None, None, result['status'])
+        return result
+
+    try:
+        sales_data = parse_sales_report(io.BytesIO(content))
+        report_id = get_report_id(sales_data, content_hash)
+        save_sales_report(pool, report_id, sales_data)
+        if archive_dir:
+            add_report_to_archive(archive_dir, sales_data, report_id)
+        result.update({'report_id': report_id, 'sales_data': sales_data})
+
+        inventory_data = load_inventory(pool)
+        recipe_data = load_recipes(pool)
+
+        if is_depletion_applied(pool, report_id):
+            result['status'] = 'already applied'
+        elif inventory_data is None or recipe_data is None:
+            # Nicht ins Journal schreiben, damit die Datei beim nächsten Durchlauf erneut versucht wird
+            result['status'] = 'pending (no inventory)'
+            return result
+        else:
+            if allocation is None:
+                allocation = load_allocation(pool, recipe_data)
+            if substitute_index is None:
+                substitute_index = build_substitute_index(load_substitution_groups(pool))
+            # Der Bestand wird erst in der Schreibtransaktion gelesen, damit Änderungen der App erhalten bleiben
+            updated_inventory = deplete_stored_inventory(
+                pool, report_id,
+                lambda stored_inventory: update_inventory_based_on_sales(stored_inventory, recipe_data, sales_data,
+                                                                         allocation, substitute_index)
+            )
+            result['status'] = 'applied' if updated_inventory is not None else 'already applied'
+
+    except Exception as e:
+        # Fehler (z.B. gesperrte Datenbank, halb synchronisierte Datei) nicht ins Journal schreiben,
+        # damit die Datei beim nächsten Durchlauf erneut versucht wird
+        log_error(logger, "Error processing report file", e, file_name=file_name)
+        result['status'] = f"error: {str(e)}"
+        return result
+
+    record_processed_file(pool, content_hash, file_name, stat.st_size, stat.st_mtime_ns,
+                          result['report_id'], (result['sales_data'] or {}).get('z_number'), result['status'])
+    return result
+
+def log_report_result(result):
+    """Log the status of a processed report file (errors are already logged by process_report_file)"""
+    if not result['status'].startswith('error'):
+        log_event(logger, logging.INFO, "Report file processed", file_name=result['file_name'],
+                  report_id=result['report_id'], status=result['status'])
+
+def process_new_reports(pool, directory, settle_seconds=2.0, archive_dir=None, allocation=None, substitute_index=None):
+    """
+    Import all new report files of a directory
+
+    Args:
+        pool: ConnectionPool
+        directory: Directory to scan
+        settle_seconds: Minimum age of a file before it is processed
+        archive_dir: Optional directory of the sales archive the reports are added to
+        allocation: Optional allocation of generic POS products (default: built from the stored groups)
+        substitute_index: Optional substitute index (default: built from the stored substitution groups)
+
+    Returns:
+        list: Results of process_report_file
+    """
+    return [process_report_file(pool, path, archive_dir, allocation, substitute_index)
+            for path in find_new_report_files(pool, directory, settle_seconds)]
+
+def watch_directory(pool, directory, interval=10, settle_seconds=2.0, archive_dir=None, metrics_file=None):
+    """
+    Poll a directory and import new reports until interrupted
+
+    Args:
+        pool: ConnectionPool
+        directory: Directory to watch
+        interval: Seconds between two scans
+        settle_seconds: Minimum age of a file before it is processed
+        archive_dir: Optional directory of the sales archive the reports are added to
+        metrics_file: Optional file the metrics are written to after every scan (Prometheus text format)
+    """
+    log_event(logger, logging.INFO, "Watching report directory", directory=directory, interval=interval)
+    while True:
+        for result in process_new_reports(pool, directory, settle_seconds, archive_dir):
+            log_report_result(result)
+        if metrics_file:
+            write_metrics_file(metrics_file)
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import POS day reports from a directory")
+    parser.add_argument("directory", help="Directory the POS writes its day reports to")
+    parser.add_argument("--db", default="rumbar.db", help="SQLite database file")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between two scans")
+    parser.add_argument("--once", action="store_true", help="Process the current files and exit")
+    parser.add_argument("--archive", help="Directory of the out-of-core sales archive")
+    parser.add_argument("--metrics-file", help="File to write the metrics to after every scan (e.g. rumbar.prom)")
+    parser.add_argument("--log-file", help="Write JSON log lines to this file instead of stderr")
+    parser.add_argument("--log-level", default="INFO", help="Minimum log level (DEBUG, INFO, WARNING, ERROR)")
+    args = parser.parse_args()
+
+    configure_logging(getattr(logging, args.log_level.upper(), logging.INFO), args.log_file)
+
+    pool = ConnectionPool(args.db, size=1)
+    try:
+        if args.once:
+            for result in process_new_reports(pool, args.directory, archive_dir=args.archive):
+                log_report_result(result)
+            if args.metrics_file:
+                write_metrics_file(args.metrics_file)
+        else:
+            watch_directory(pool, args.directory, args.interval, archive_dir=args.archive,
+                            metrics_file=args.metrics_file)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+
+if __name__ == "__main__":
+    main()
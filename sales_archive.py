@@ -0,0 +1,399 @@
+"""
+Out-of-core archive of the POS day reports
+
+    python sales_archive.py rumbar_archive --import-db rumbar.db
+    python sales_archive.py rumbar_archive --usage Limettensaft --from 2023-01-01 --to 2025-12-31
+
+The archive keeps one directory per month. Every month stores the sold
+products and product groups column by column as .npy files (report, day,
+name code, quantity, total), the names are stored once in a dictionary.
+Queries map the columns of one month at a time into memory (np.load with
+mmap_mode) and aggregate them chunk by chunk, so the memory needed does not
+grow with the number of years in the archive. Months outside the requested
+date range are not opened at all.
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from data_processor import map_products_to_drinks
+from sales_history import get_period_keys
+from metrics import get_logger, log_error
+
+logger = get_logger('sales_archive')
+
+# Spalten der Tabellen einer Monatspartition
+TABLE_COLUMNS = {
+    'report': np.int32,
+    'day': 'datetime64[D]',
+    'name': np.int32,
+    'quantity': np.int64,
+    'total': np.float64
+}
+ARCHIVE_TABLES = {'products': 'product_name', 'product_groups': 'group_name'}
+
+def _load_dictionary(archive_dir):
+    """Load the product and group names of the archive ({table: [names]})"""
+    path = os.path.join(archive_dir, "dictionary.json")
+    if not os.path.exists(path):
+        return {table: [] for table in ARCHIVE_TABLES}
+    with open(path, encoding='utf-8') as dictionary_file:
+        return json.load(dictionary_file)
+
+def _save_dictionary(archive_dir, dictionary):
+    """Store the names of the archive (replacing the file only when it is completely written)"""
+    path = os.path.join(archive_dir, "dictionary.json")
+    with open(path + ".tmp", 'w', encoding='utf-8') as dictionary_file:
+        json.dump(dictionary, dictionary_file, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def list_archive_months(archive_dir, start_date=None, end_date=None):
+    """
+    List the month partitions of the archive that overlap a date range
+
+    Args:
+        archive_dir: Archive directory
+        start_date: Optional first day (YYYY-MM-DD)
+        end_date: Optional last day (YYYY-MM-DD)
+
+    Returns:
+        list: Month keys (YYYY-MM), oldest first
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    months = sorted(name for name in os.listdir(archive_dir)
+                    if len(name) == 7 and name[4] == '-' and os.path.isdir(os.path.join(archive_dir, name)))
+    if start_date:
+        months = [month for month in months if month >= str(start_date)[:7]]
+    if end_date:
+        months = [month for month in months if month <= str(end_date)[:7]]
+    return months
+
+def _read_partition(archive_dir, month, mmap_mode=None):
+    """Read the reports and the column arrays of a month partition"""
+    partition_dir = os.path.join(archive_dir, month)
+    with open(os.path.join(partition_dir, "reports.json"), encoding='utf-8') as reports_file:
+        reports = json.load(reports_file)
+    tables = {
+        table: {column: np.load(os.path.join(partition_dir, f"{table}.{column}.npy"), mmap_mode=mmap_mode)
+                for column in TABLE_COLUMNS}
+        for table in ARCHIVE_TABLES
+    }
+    return reports, tables
+
+def _write_partition(archive_dir, month, reports, tables):
+    """Write a month partition to a new directory and swap it in"""
+    partition_dir = os.path.join(archive_dir, month)
+    new_dir = partition_dir + ".new"
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
+
+    for table, columns in tables.items():
+        for column, values in columns.items():
+            np.save(os.path.join(new_dir, f"{table}.{column}.npy"), values)
+    with open(os.path.join(new_dir, "reports.json"), 'w', encoding='utf-8') as reports_file:
+        json.dump(reports, reports_file, ensure_ascii=False)
+
+    # Alte Partition erst entfernen, wenn die neue vollständig geschrieben ist
+    old_dir = partition_dir + ".old"
+    if os.path.isdir(partition_dir):
+        os.replace(partition_dir, old_dir)
+    os.replace(new_dir, partition_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def _empty_tables():
+    """Create empty column arrays for all tables of a partition"""
+    return {table: {column: np.array([], dtype=dtype) for column, dtype in TABLE_COLUMNS.items()}
+            for table in ARCHIVE_TABLES}
+
+def add_reports_to_archive(archive_dir, reports):
+    """
+    Add processed day reports to the archive
+
+    Every touched month is rewritten once, however many of its reports are
+    added. A report already archived under the same id is replaced.
+
+    Args:
+        archive_dir: Archive directory (created if missing)
+        reports: List of tuples (report_id, sales_data) with sales data from process_sales_data
+
+    Returns:
+        int: Number of reports added or replaced
+    """
+    try:
+        os.makedirs(archive_dir, exist_ok=True)
+        dictionary = _load_dictionary(archive_dir)
+        codes = {table: {name: code for code, name in enumerate(names)} for table, names in dictionary.items()}
+
+        by_month = {}
+        for report_id, sales_data in reports:
+            # Prüfen, ob das Datum gültig ist, bevor etwas geschrieben wird
+            get_period_keys(sales_data['date'])
+            by_month.setdefault(sales_data['date'][:7], []).append((report_id or sales_data['date'], sales_data))
+
+        partitions = {}
+        for month, month_reports in by_month.items():
+            if os.path.isdir(os.path.join(archive_dir, month)):
+                month_index, tables = _read_partition(archive_dir, month)
+            else:
+                month_index, tables = [], _empty_tables()
+            report_codes = {report['report_id']: code for code, report in enumerate(month_index)}
+
+            new_rows = {table: {column: [] for column in TABLE_COLUMNS} for table in ARCHIVE_TABLES}
+            replaced = []
+            # Derselbe Bericht mehrfach im Stapel: nur der letzte zählt
+            for report_id, sales_data in dict(month_reports).items():
+                entry = {'report_id': report_id, 'date': sales_data['date'],
+                         'z_number': sales_data.get('z_number'), 'total_sales': sales_data.get('total_sales', 0)}
+                if report_id in report_codes:
+                    replaced.append(report_codes[report_id])
+                    month_index[report_codes[report_id]] = entry
+                else:
+                    report_codes[report_id] = len(month_index)
+                    month_index.append(entry)
+
+                for table, name_field in ARCHIVE_TABLES.items():
+                    for row in sales_data.get(table, []):
+                        name = row[name_field]
+                        if name not in codes[table]:
+                            codes[table][name] = len(dictionary[table])
+                            dictionary[table].append(name)
+                        columns = new_rows[table]
+                        columns['report'].append(report_codes[report_id])
+                        columns['day'].append(sales_data['date'])
+                        columns['name'].append(codes[table][name])
+                        columns['quantity'].append(row['quantity'])
+                        columns['total'].append(row['total'])
+
+            for table, columns in tables.items():
+                keep = ~np.isin(columns['report'], replaced)
+                tables[table] = {column: np.concatenate([values[keep],
+                                                         np.array(new_rows[table][column], dtype=TABLE_COLUMNS[column])])
+                                 for column, values in columns.items()}
+            partitions[month] = (month_index, tables)
+
+        # Zuerst das Wörterbuch, damit jede geschriebene Partition nur bekannte Namen enthält
+        _save_dictionary(archive_dir, dictionary)
+        for month, (month_index, tables) in partitions.items():
+            _write_partition(archive_dir, month, month_index, tables)
+
+        return sum(len(month_reports) for month_reports in by_month.values())
+
+    except Exception as e:
+        raise Exception(f"Error adding reports to sales archive: {str(e)}")
+
+def add_report_to_archive(archive_dir, sales_data, report_id=None):
+    """
+    Add one processed day report to the archive (see add_reports_to_archive)
+
+    Args:
+        archive_dir: Archive directory
+        sales_data: Sales data dictionary from process_sales_data
+        report_id: Unique id of the report (default: the report date)
+    """
+    add_reports_to_archive(archive_dir, [(report_id, sales_data)])
+
+def iter_archive_chunks(archive_dir, table='products', start_date=None, end_date=None):
+    """
+    Iterate over the rows of the archive one month at a time
+
+    The columns are memory-mapped; only the months overlapping the date
+    range are opened, and rows are only copied if a month has to be cut
+    at the range limits.
+
+    Args:
+        archive_dir: Archive directory
+        table: 'products' or 'product_groups'
+        start_date: Optional first day (YYYY-MM-DD)
+        end_date: Optional last day (YYYY-MM-DD)
+
+    Yields:
+        tuple: Month key and a dictionary {column: numpy array}
+    """
+    start = np.datetime64(str(start_date)[:10], 'D') if start_date else None
+    end = np.datetime64(str(end_date)[:10], 'D') if end_date else None
+
+    for month in list_archive_months(archive_dir, start_date, end_date):
+        _, tables = _read_partition(archive_dir, month, mmap_mode='r')
+        columns = tables[table]
+        days = columns['day']
+        if len(days) == 0:
+            continue
+
+        mask = None
+        if start is not None and days.min() < start:
+            mask = days >= start
+        if end is not None and days.max() > end:
+            mask = (days <= end) if mask is None else mask & (days <= end)
+        if mask is not None:
+            columns = {column: values[mask] for column, values in columns.items()}
+        yield month, columns
+
+def _get_period_codes(days, period_type, period_positions, period_keys):
+    """Map the days of a chunk to positions in the list of result periods"""
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    positions = []
+    for day in unique_days:
+        period_key = get_period_keys(str(day))[period_type]
+        if period_key not in period_positions:
+            period_positions[period_key] = len(period_keys)
+            period_keys.append(period_key)
+        positions.append(period_positions[period_key])
+    return np.array(positions, dtype=np.int64)[day_index]
+
+def aggregate_archive_sales(archive_dir, period_type='month', table='products', start_date=None, end_date=None,
+                            names=None):
+    """
+    Sum quantity and revenue per period and product (or product group) over the archive
+
+    Args:
+        archive_dir: Archive directory
+        period_type: One of 'day', 'week', 'month', 'year'
+        table: 'products' or 'product_groups'
+        start_date: Optional first day (YYYY-MM-DD)
+        end_date: Optional last day (YYYY-MM-DD)
+        names: Optional list of product or group names to include
+
+    Returns:
+        pandas.DataFrame: period, product_name (or group_name), quantity and total
+    """
+    try:
+        name_field = ARCHIVE_TABLES[table]
+        dictionary = _load_dictionary(archive_dir)[table]
+        selected = None
+        if names is not None:
+            codes = {name: code for code, name in enumerate(dictionary)}
+            selected = np.array([codes[name] for name in names if name in codes], dtype=np.int32)
+
+        period_positions, period_keys = {}, []
+        quantity = np.zeros((0, len(dictionary)))
+        total = np.zeros((0, len(dictionary)))
+
+        for _, columns in iter_archive_chunks(archive_dir, table, start_date, end_date):
+            if selected is not None:
+                columns = {column: values[np.isin(columns['name'], selected)] for column, values in columns.items()}
+            periods = _get_period_codes(columns['day'], period_type, period_positions, period_keys)
+
+            # Ergebnis nur um die neuen Zeiträume erweitern, dann den Monat in einem Schritt aufsummieren
+            if len(period_keys) > len(quantity):
+                growth = len(period_keys) - len(quantity)
+                quantity = np.vstack([quantity, np.zeros((growth, len(dictionary)))])
+                total = np.vstack([total, np.zeros((growth, len(dictionary)))])
+            np.add.at(quantity, (periods, columns['name']), columns['quantity'])
+            np.add.at(total, (periods, columns['name']), columns['total'])
+
+        period_index, name_index = np.nonzero(quantity)
+        result = pd.DataFrame({
+            'period': np.array(period_keys, dtype=object)[period_index] if period_keys else [],
+            name_field: np.array(dictionary, dtype=object)[name_index] if dictionary else [],
+            'quantity': quantity[period_index, name_index].astype(int),
+            'total': total[period_index, name_index]
+        })
+        return result.sort_values(['period', name_field]).reset_index(drop=True)
+
+    except Exception as e:
+        log_error(logger, "Error aggregating sales archive", e)
+        return None
+
+def calculate_archive_ingredient_usage(archive_dir, recipe_data, ingredient_names=None, period_type='month',
+                                       start_date=None, end_date=None, product_mapping=None):
+    """
+    Calculate the ingredient usage per period from the archived sales
+
+    The products of the archive are mapped to drinks once. Every month is
+    then converted with one matrix product (quantity x ml per product) and
+    summed per period, so only one month is held in memory at a time.
+
+    Args:
+        archive_dir: Archive directory
+        recipe_data: Recipe DataFrame
+        ingredient_names: Optional list of ingredients (default: all ingredients of the recipes)
+        period_type: One of 'day', 'week', 'month', 'year'
+        start_date: Optional first day (YYYY-MM-DD)
+        end_date: Optional last day (YYYY-MM-DD)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: period, ingredient_name and usage_ml
+    """
+    try:
+        products = _load_dictionary(archive_dir)['products']
+        if ingredient_names is None:
+            ingredient_names = sorted(recipe_data['ingredient_name'].dropna().unique())
+        ingredient_positions = {name: i for i, name in enumerate(ingredient_names)}
+
+        # ml pro verkauftem Produkt und Zutat (Produkte ohne Rezept verbrauchen nichts)
+        drinks = map_products_to_drinks(products, recipe_data, product_mapping)
+        recipes = recipe_data[recipe_data['ingredient_name'].isin(ingredient_positions)]
+        ml_per_product = np.zeros((len(products), len(ingredient_names)))
+        mapped = pd.DataFrame({'code': np.arange(len(products)), 'drink_name': [drinks.get(name) for name in products]},
+                              ).astype({'drink_name': object}).dropna()
+        lines = mapped.merge(recipes[['drink_name', 'ingredient_name', 'amount_ml']].astype({'drink_name': object}),
+                             on='drink_name')
+        np.add.at(ml_per_product, (lines['code'].to_numpy(), lines['ingredient_name'].map(ingredient_positions).to_numpy()),
+                  lines['amount_ml'].to_numpy(dtype=float))
+        used_products = np.flatnonzero(ml_per_product.any(axis=1))
+
+        period_positions, period_keys = {}, []
+        usage = np.zeros((0, len(ingredient_names)))
+        for _, columns in iter_archive_chunks(archive_dir, 'products', start_date, end_date):
+            rows = np.isin(columns['name'], used_products)
+            if not rows.any():
+                continue
+            periods = _get_period_codes(columns['day'][rows], period_type, period_positions, period_keys)
+            if len(period_keys) > len(usage):
+                usage = np.vstack([usage, np.zeros((len(period_keys) - len(usage), len(ingredient_names)))])
+
+            row_usage = columns['quantity'][rows, None] * ml_per_product[columns['name'][rows]]
+            np.add.at(usage, periods, row_usage)
+
+        period_index, ingredient_index = np.nonzero(usage)
+        result = pd.DataFrame({
+            'period': np.array(period_keys, dtype=object)[period_index] if period_keys else [],
+            'ingredient_name': np.array(ingredient_names, dtype=object)[ingredient_index] if ingredient_names else [],
+            'usage_ml': usage[period_index, ingredient_index]
+        })
+        return result.sort_values(['period', 'ingredient_name']).reset_index(drop=True)
+
+    except Exception as e:
+        log_error(logger, "Error calculating ingredient usage from sales archive", e)
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the out-of-core sales archive")
+    parser.add_argument("archive", help="Archive directory")
+    parser.add_argument("--import-db", help="Add all day reports stored in this SQLite database")
+    parser.add_argument("--usage", action="append", help="Ingredient whose usage per period is printed")
+    parser.add_argument("--period", default="month", choices=['day', 'week', 'month', 'year'])
+    parser.add_argument("--from", dest="start_date", help="First day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", help="Last day (YYYY-MM-DD)")
+    parser.add_argument("--db", default="rumbar.db", help="SQLite database with the recipes")
+    args = parser.parse_args()
+
+    from storage import ConnectionPool, load_sales_reports, load_recipes
+
+    if args.import_db:
+        pool = ConnectionPool(args.import_db, size=1)
+        try:
+            print(f"{add_reports_to_archive(args.archive, load_sales_reports(pool))} reports archived")
+        finally:
+            pool.close()
+
+    if args.usage:
+        pool = ConnectionPool(args.db, size=1)
+        try:
+            recipe_data = load_recipes(pool)
+        finally:
+            pool.close()
+        if recipe_data is None:
+            parser.error(f"No recipes in {args.db}")
+        usage = calculate_archive_ingredient_usage(args.archive, recipe_data, args.usage, args.period,
+                                                   args.start_date, args.end_date)
+        print(usage.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
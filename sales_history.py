@@ -0,0 +1,401 @@
+import copy
+import heapq
+import uuid
+import pandas as pd
+from datetime import datetime
+
+# Zeiträume, für die Rollups gepflegt werden (vom feinsten zum gröbsten)
+PERIOD_TYPES = ['day', 'week', 'month', 'year']
+
+# Abrechnungsabschnitte des Tagesberichts mit ihrem Schlüsselfeld und den summierten Feldern
+FINANCIAL_SECTIONS = {
+    'payments': ('payment_method', ['quantity', 'total', 'tip']),
+    'voids': ('reason', ['quantity', 'total']),
+    'tables': ('table_name', ['quantity', 'total']),
+    'taxes': ('tax_rate', ['gross', 'net', 'tax'])
+}
+
+def create_sales_history():
+    """
+    Create an empty sales history store
+
+    Returns:
+        dict: Sales history with the imported reports and the rollups per period type
+    """
+    return {
+        'reports': {},
+        'rollups': {period_type: {} for period_type in PERIOD_TYPES},
+        'revision': 0,
+        'history_id': uuid.uuid4().hex
+    }
+
+def get_history_id(history):
+    """
+    Get the identity of a sales history
+
+    Revisions start at 0 in every history, so caches shared by several
+    histories (e.g. of different sessions) need the identity in their key.
+
+    Args:
+        history: Sales history dictionary
+
+    Returns:
+        str: Id of the history
+    """
+    return history.setdefault('history_id', uuid.uuid4().hex)
+
+def get_period_keys(date_str):
+    """
+    Get the day, week, month and year key for a report date
+
+    Args:
+        date_str: Report date in the format YYYY-MM-DD
+
+    Returns:
+        dict: Period key for each period type
+    """
+    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
+    iso_year, iso_week, _ = date_obj.isocalendar()
+
+    return {
+        'day': date_obj.strftime("%Y-%m-%d"),
+        'week': f"{iso_year}-W{iso_week:02d}",
+        'month': date_obj.strftime("%Y-%m"),
+        'year': date_obj.strftime("%Y")
+    }
+
+def _add_to_entries(entries, name, values, sign):
+    """Add (sign=1) or remove (sign=-1) the values (e.g. quantity and total) of one product, group or payment method"""
+    entry = entries.setdefault(name, {field: 0 for field in values})
+    for field, value in values.items():
+        entry[field] += sign * value
+
+    # Einträge, die durch das Entfernen eines Berichts leer werden, löschen
+    if all(abs(value) < 1e-9 for value in entry.values()):
+        del entries[name]
+
+def _apply_report_to_rollups(history, report, sign):
+    """
+    Add or remove a single report to/from all rollups
+
+    Only the buckets of the report's day, week, month and year are touched,
+    so the cost is proportional to the number of products in the report.
+    Every touched bucket gets a new revision, which lets derived results
+    (e.g. margins) be cached per period.
+    """
+    history['revision'] = history.get('revision', 0) + 1
+
+    for period_type, period_key in get_period_keys(report['date']).items():
+        rollups = history['rollups'][period_type]
+        bucket = rollups.setdefault(period_key, {
+            'report_count': 0,
+            'total_sales': 0.0,
+            'products': {},
+            'product_groups': {},
+            'tips': 0.0,
+            **{section: {} for section in FINANCIAL_SECTIONS}
+        })
+        bucket['revision'] = history['revision']
+
+        bucket['report_count'] += sign
+        bucket['total_sales'] += sign * report.get('total_sales', 0)
+        bucket['tips'] += sign * report.get('tips', 0)
+
+        for product in report.get('products', []):
+            _add_to_entries(bucket['products'], product['product_name'],
+                            {'quantity': product['quantity'], 'total': product['total']}, sign)
+
+        for group in report.get('product_groups', []):
+            _add_to_entries(bucket['product_groups'], group['group_name'],
+                            {'quantity': group['quantity'], 'total': group['total']}, sign)
+
+        # Zahlungsarten, Stornos, Tische und Steuern schon beim Import aufsummieren
+        for section, (name_field, fields) in FINANCIAL_SECTIONS.items():
+            for row in report.get(section, []):
+                _add_to_entries(bucket[section], row[name_field],
+                                {field: row.get(field, 0) for field in fields}, sign)
+
+        # Zeiträume ohne Berichte entfernen
+        if bucket['report_count'] <= 0:
+            del rollups[period_key]
+
+def add_sales_report(history, sales_data, report_id=None):
+    """
+    Add a processed day report to the sales history and update the rollups
+
+    A report that was already added under the same id is replaced, so
+    importing the same file twice does not count its sales twice.
+
+    Args:
+        history: Sales history dictionary from create_sales_history
+        sales_data: Sales data dictionary from process_sales_data
+        report_id: Unique id of the report (default: the report date)
+
+    Returns:
+        dict: The updated sales history
+    """
+    try:
+        # Prüfen, ob das Datum gültig ist, bevor etwas verändert wird
+        get_period_keys(sales_data['date'])
+
+        report_key = report_id or sales_data['date']
+        report = {
+            'date': sales_data['date'],
+            'total_sales': sales_data.get('total_sales', 0),
+            'products': list(sales_data.get('products', [])),
+            'product_groups': list(sales_data.get('product_groups', [])),
+            'tips': sales_data.get('tips', 0),
+            **{section: list(sales_data.get(section, [])) for section in FINANCIAL_SECTIONS}
+        }
+
+        previous_report = history['reports'].get(report_key)
+        if previous_report is not None:
+            _apply_report_to_rollups(history, previous_report, -1)
+
+        history['reports'][report_key] = report
+        _apply_report_to_rollups(history, report, 1)
+
+        return history
+
+    except Exception as e:
+        raise Exception(f"Error adding sales report to history: {str(e)}")
+
+def add_sales_reports(history, reports):
+    """
+    Add several day reports to a copy of the sales history
+
+    The given history is not changed, so a history shared by several
+    sessions can be updated while they read it. Only the report index, the
+    rollup indexes and the buckets of the touched periods are copied; all
+    other buckets are shared with the given history. Revisions continue, so
+    caches keyed by period revision stay valid.
+
+    Args:
+        history: Sales history dictionary
+        reports: List of tuples (report_id, sales_data)
+
+    Returns:
+        dict: The new sales history
+    """
+    new_history = {
+        'reports': dict(history['reports']),
+        'rollups': {period_type: dict(rollups) for period_type, rollups in history['rollups'].items()},
+        'revision': history.get('revision', 0),
+        'history_id': get_history_id(history)
+    }
+
+    copied = set()
+    for report_id, sales_data in reports:
+        dates = [sales_data['date']]
+        previous_report = new_history['reports'].get(report_id or sales_data['date'])
+        if previous_report is not None:
+            dates.append(previous_report['date'])
+
+        # Buckets vor der ersten Änderung kopieren, die alte Historie bleibt unverändert
+        for date in dates:
+            for period_type, period_key in get_period_keys(date).items():
+                rollups = new_history['rollups'][period_type]
+                if (period_type, period_key) not in copied and period_key in rollups:
+                    rollups[period_key] = copy.deepcopy(rollups[period_key])
+                copied.add((period_type, period_key))
+
+        add_sales_report(new_history, sales_data, report_id)
+
+    return new_history
+
+def remove_sales_report(history, report_id):
+    """
+    Remove a report from the sales history and update the rollups
+
+    Args:
+        history: Sales history dictionary
+        report_id: Id of the report to remove
+
+    Returns:
+        dict: The updated sales history
+    """
+    report = history['reports'].pop(report_id, None)
+    if report is not None:
+        _apply_report_to_rollups(history, report, -1)
+    return history
+
+def list_periods(history, period_type):
+    """
+    List the periods that contain sales, oldest first
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+
+    Returns:
+        list: Sorted period keys
+    """
+    return sorted(history['rollups'][period_type].keys())
+
+def _get_bucket(history, period_type, period_key):
+    """Get the rollup bucket of a period (default: the latest period)"""
+    rollups = history['rollups'][period_type]
+    if period_key is None and rollups:
+        period_key = max(rollups.keys())
+    return rollups.get(period_key)
+
+def get_period_revision(history, period_type, period_key):
+    """
+    Get the revision of a period, which changes whenever a report of the period changes
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period key
+
+    Returns:
+        int: Revision of the period (None if the period has no sales)
+    """
+    bucket = history['rollups'][period_type].get(period_key)
+    return None if bucket is None else bucket.get('revision')
+
+def get_product_sales(history, period_type='month', period_key=None):
+    """
+    Get quantity and revenue per product of a period as a DataFrame
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+
+    Returns:
+        pandas.DataFrame: Columns product_name, quantity and total
+    """
+    bucket = _get_bucket(history, period_type, period_key)
+    if bucket is None:
+        return pd.DataFrame(columns=['product_name', 'quantity', 'total'])
+
+    return pd.DataFrame({
+        'product_name': list(bucket['products'].keys()),
+        'quantity': [data['quantity'] for data in bucket['products'].values()],
+        'total': [data['total'] for data in bucket['products'].values()]
+    })
+
+def get_sales_frame(history, period_type='day', period_keys=None, section='products'):
+    """
+    Get quantity and revenue per period and product as one long DataFrame
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_keys: Periods to include (default: all periods)
+        section: 'products' or 'product_groups' (per Warengruppe)
+
+    Returns:
+        pandas.DataFrame: Columns period, product_name (group_name for product groups), quantity and total
+    """
+    rollups = history['rollups'][period_type]
+    if period_keys is None:
+        period_keys = sorted(rollups.keys())
+
+    rows = [
+        (period_key, name, data['quantity'], data['total'])
+        for period_key in period_keys if period_key in rollups
+        for name, data in rollups[period_key][section].items()
+    ]
+    name_field = 'group_name' if section == 'product_groups' else 'product_name'
+    return pd.DataFrame(rows, columns=['period', name_field, 'quantity', 'total'])
+
+def get_top_sellers(history, period_type='month', period_key=None, n=10, by='quantity'):
+    """
+    Get the best selling products of a period from the rollups
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period, e.g. '2025-03' (default: the latest period)
+        n: Number of products to return
+        by: Sort by 'quantity' or 'total'
+
+    Returns:
+        pandas.DataFrame: Top products with quantity and total
+    """
+    bucket = _get_bucket(history, period_type, period_key)
+    if bucket is None:
+        return pd.DataFrame(columns=['product_name', 'quantity', 'total'])
+
+    top_products = heapq.nlargest(n, bucket['products'].items(), key=lambda item: item[1][by])
+
+    return pd.DataFrame([
+        {'product_name': name, 'quantity': data['quantity'], 'total': data['total']}
+        for name, data in top_products
+    ], columns=['product_name', 'quantity', 'total'])
+
+def get_group_revenue(history, period_type='year', period_key=None):
+    """
+    Get the revenue per Warengruppe of a period from the rollups
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period, e.g. '2025' (default: the latest period)
+
+    Returns:
+        pandas.DataFrame: Quantity and total per product group, highest revenue first
+    """
+    bucket = _get_bucket(history, period_type, period_key)
+    if bucket is None:
+        return pd.DataFrame(columns=['group_name', 'quantity', 'total'])
+
+    group_df = pd.DataFrame([
+        {'group_name': name, 'quantity': data['quantity'], 'total': data['total']}
+        for name, data in bucket['product_groups'].items()
+    ], columns=['group_name', 'quantity', 'total'])
+
+    return group_df.sort_values('total', ascending=False).reset_index(drop=True)
+
+def get_period_summary(history, period_type='month', period_key=None):
+    """
+    Get summary statistics of a period from the rollups
+
+    Args:
+        history: Sales history dictionary
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+
+    Returns:
+        dict: Summary statistics in the format of calculate_sales_summary
+    """
+    bucket = _get_bucket(history, period_type, period_key)
+    if bucket is None or not bucket['products']:
+        return {
+            'total_value': 0,
+            'total_quantity': 0,
+            'most_sold_drink': 'None',
+            'most_sold_quantity': 0
+        }
+
+    most_sold_name, most_sold = max(bucket['products'].items(), key=lambda item: item[1]['quantity'])
+
+    return {
+        'total_value': bucket['total_sales'],
+        'total_quantity': sum(data['quantity'] for data in bucket['products'].values()),
+        'most_sold_drink': most_sold_name,
+        'most_sold_quantity': most_sold['quantity']
+    }
+
+def get_section_totals(history, section, period_type='month', period_key=None):
+    """
+    Get the totals of a financial section (payments, voids, tables or taxes) of a period from the rollups
+
+    Args:
+        history: Sales history dictionary
+        section: One of 'payments', 'voids', 'tables', 'taxes'
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+
+    Returns:
+        pandas.DataFrame: One row per payment method, void reason, table or tax rate
+    """
+    name_field, fields = FINANCIAL_SECTIONS[section]
+    bucket = _get_bucket(history, period_type, period_key)
+    entries = {} if bucket is None else bucket.get(section, {})
+
+    return pd.DataFrame([
+        {name_field: name, **data} for name, data in entries.items()
+    ], columns=[name_field] + fields)
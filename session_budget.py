@@ -0,0 +1,303 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+# pandas wird erst beim Auslagern importiert, die App lädt dieses Modul schon beim Start jeder Sitzung
+from metrics import get_logger, increment, log_error, log_event
+
+logger = get_logger('session_budget')
+
+# Ausgelagert werden die übrigen Tabellen (DataFrames) einer Sitzung; Zwischenergebnisse
+# werden dabei verworfen und bei Bedarf neu berechnet. Zu jedem Zwischenergebnis der Schlüssel
+# des eigenen Ergebnisses (der Rest verweist auf gemeinsame Frames und zählt nicht)
+CACHE_VALUES = {'par_model': 'daily_usage', 'allocation': 'allocation', 'chart_series': 'series'}
+
+def create_session_budget(spill_dir, budget_mb=512, idle_seconds=300, expire_seconds=86400):
+    """
+    Create the memory budget shared by all sessions of a server process
+
+    Every session keeps its own caches (and any tables of its own) in a session
+    store. When the stores of all sessions together need more
+    than the budget, the stores of the sessions that have been idle the
+    longest are spilled to compressed files in spill_dir and loaded again
+    when the session next uses them. Inventory, recipes, the sales history,
+    the stock ledger and their derived data are shared by all sessions and are not counted.
+
+    Args:
+        spill_dir: Directory for the spilled session files
+        budget_mb: Memory budget of all session stores in MB
+        idle_seconds: Seconds without use after which a session may be spilled
+        expire_seconds: Seconds without use after which a session is spilled even within the budget,
+            and forgotten with its file once it is closed
+
+    Returns:
+        dict: Session budget
+    """
+    return {
+        'spill_dir': spill_dir,
+        'budget_bytes': int(budget_mb * 1024 * 1024),
+        'idle_seconds': idle_seconds,
+        'expire_seconds': expire_seconds,
+        'sessions': {},
+        'lock': threading.RLock()
+    }
+
+def register_session(budget, session_id):
+    """
+    Get the store of a session, creating it on first use
+
+    Args:
+        budget: Session budget from create_session_budget
+        session_id: Id of the session
+
+    Returns:
+        dict: Session store (use get_session_value and set_session_value)
+    """
+    with budget['lock']:
+        store = budget['sessions'].get(session_id)
+        if store is None:
+            store = {
+                'session_id': session_id,
+                'values': {},
+                'sizes': {},
+                'spilled': None,
+                'last_seen': time.monotonic()
+            }
+            budget['sessions'][session_id] = store
+        return store
+
+def _touch_session(budget, store):
+    """Mark a session as used, registering its store again if it was forgotten, and load it if it was spilled"""
+    store['last_seen'] = time.monotonic()
+    budget['sessions'].setdefault(store['session_id'], store)
+    if store['spilled'] is not None:
+        _reload_session(budget, store)
+
+def get_session_value(budget, store, name):
+    """
+    Get a value of a session store, loading the store again if it was spilled
+
+    Args:
+        budget: Session budget
+        store: Session store from register_session
+        name: Name of the value, e.g. 'par_model'
+
+    Returns:
+        The value, or None if it was not set
+    """
+    with budget['lock']:
+        _touch_session(budget, store)
+        return store['values'].get(name)
+
+def set_session_value(budget, store, name, value):
+    """
+    Set a value of a session store
+
+    Args:
+        budget: Session budget
+        store: Session store from register_session
+        name: Name of the value
+        value: New value (None removes it)
+    """
+    with budget['lock']:
+        _touch_session(budget, store)
+        if value is None:
+            store['values'].pop(name, None)
+        else:
+            store['values'][name] = value
+
+def estimate_size(value, seen=None):
+    """
+    Estimate the memory of a value in bytes
+
+    DataFrames are measured with their deep memory usage, dictionaries,
+    lists and tuples with all their contents. Objects referenced more than
+    once are counted once.
+
+    Args:
+        value: Value to measure
+        seen: Set of ids of the objects already counted
+
+    Returns:
+        int: Estimated size in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    # DataFrame oder Series
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key, seen) + estimate_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item, seen) for item in value)
+    return size
+
+def _get_value_size(store, name, value):
+    """Get the size of one value, measured again only when it was replaced or its revision changed"""
+    if name in CACHE_VALUES and isinstance(value, dict):
+        value = value.get(CACHE_VALUES[name])
+    revision = value.get('revision') if isinstance(value, dict) else None
+    cached = store['sizes'].get(name)
+    if cached is not None and cached[0] is value and cached[1] == revision \
+            and (revision is not None or hasattr(value, 'memory_usage')):
+        return cached[2]
+
+    size = estimate_size(value)
+    store['sizes'][name] = (value, revision, size)
+    return size
+
+def measure_session(store):
+    """
+    Get the memory of a session store in bytes
+
+    Args:
+        store: Session store
+
+    Returns:
+        int: Estimated size (0 while the store is spilled)
+    """
+    if store['spilled'] is not None:
+        return 0
+    return sum(_get_value_size(store, name, value) for name, value in list(store['values'].items()))
+
+def get_memory_usage(budget):
+    """
+    Sum up the memory of all session stores
+
+    Args:
+        budget: Session budget
+
+    Returns:
+        dict: sessions, spilled_sessions, used_bytes and budget_bytes
+    """
+    with budget['lock']:
+        stores = list(budget['sessions'].values())
+        return {
+            'sessions': len(stores),
+            'spilled_sessions': sum(1 for store in stores if store['spilled'] is not None),
+            'used_bytes': sum(measure_session(store) for store in stores),
+            'budget_bytes': budget['budget_bytes']
+        }
+
+def _get_spill_path(budget, session_id):
+    """Path of the spill file of a session"""
+    return os.path.join(budget['spill_dir'], f"{session_id}.npz")
+
+def _spill_session(budget, store):
+    """Write the tables of a session to its file and drop them and the caches from memory"""
+    from helpers import save_frames_snapshot
+
+    try:
+        frames = {name: value.reset_index(drop=True) for name, value in store['values'].items()
+                  if name not in CACHE_VALUES and hasattr(value, 'columns')}
+
+        if frames:
+            os.makedirs(budget['spill_dir'], exist_ok=True)
+            save_frames_snapshot(_get_spill_path(budget, store['session_id']), frames)
+
+        size = measure_session(store)
+        store['values'] = {}
+        store['sizes'] = {}
+        # Die Datentypen bleiben im Speicher, die Datei kennt nur Zahlen und Texte
+        store['spilled'] = {
+            'dtypes': {name: frame.dtypes.to_dict() for name, frame in frames.items()}
+        }
+        increment('rumbar_session_spills_total')
+        log_event(logger, logging.INFO, "Session spilled to disk", session=store['session_id'], bytes=size)
+        return True
+
+    except Exception as e:
+        log_error(logger, "Error spilling session", e, session=store['session_id'])
+        return False
+
+def _reload_session(budget, store):
+    """Load the tables of a session from its file (the caches are rebuilt on use)"""
+    from helpers import load_frames_snapshot
+
+    spilled = store['spilled']
+    if not spilled['dtypes']:
+        store['spilled'] = None
+        return
+
+    path = _get_spill_path(budget, store['session_id'])
+    try:
+        frames, _ = load_frames_snapshot(path)
+        values = {name: frames[name].astype(dtypes) for name, dtypes in spilled['dtypes'].items()}
+
+        # Werte, die seit einem fehlgeschlagenen Laden neu gesetzt wurden, gehen vor
+        store['values'] = {**values, **store['values']}
+        store['spilled'] = None
+        os.remove(path)
+        increment('rumbar_session_reloads_total')
+
+    except Exception as e:
+        # Datei und Auslagerung bleiben erhalten, der nächste Zugriff versucht es erneut
+        log_error(logger, "Error reloading spilled session", e, session=store['session_id'])
+
+def forget_session(budget, session_id):
+    """
+    Remove the store and the spill file of a closed session
+
+    Only call this for sessions that are known to be closed (or reset);
+    the data of the session is lost.
+
+    Args:
+        budget: Session budget
+        session_id: Id of the session
+    """
+    with budget['lock']:
+        budget['sessions'].pop(session_id, None)
+        path = _get_spill_path(budget, session_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+def enforce_session_budget(budget, active_session_id=None, is_session_open=None):
+    """
+    Spill idle sessions until all session stores fit into the budget
+
+    Sessions are spilled starting with the one idle the longest; sessions
+    used within the last idle_seconds and the active session are kept.
+    Sessions not used for expire_seconds are spilled even within the budget,
+    because a tablet left open may still come back to them. They are only
+    forgotten with their file when is_session_open reports them as closed.
+
+    Args:
+        budget: Session budget
+        active_session_id: Id of the session that is currently running
+        is_session_open: Optional function (session id -> bool); without it, no session is forgotten
+
+    Returns:
+        list: Ids of the spilled sessions
+    """
+    now = time.monotonic()
+    with budget['lock']:
+        spilled = []
+        for session_id, store in list(budget['sessions'].items()):
+            if session_id == active_session_id or now - store['last_seen'] <= budget['expire_seconds']:
+                continue
+            if is_session_open is not None and not is_session_open(session_id):
+                forget_session(budget, session_id)
+            elif store['spilled'] is None and _spill_session(budget, store):
+                spilled.append(session_id)
+
+        resident = sorted((store for store in budget['sessions'].values() if store['spilled'] is None),
+                          key=lambda store: store['last_seen'])
+        sizes = {store['session_id']: measure_session(store) for store in resident}
+        used = sum(sizes.values())
+
+        for store in resident:
+            if used <= budget['budget_bytes']:
+                break
+            if store['session_id'] == active_session_id or now - store['last_seen'] < budget['idle_seconds']:
+                continue
+            if _spill_session(budget, store):
+                used -= sizes[store['session_id']]
+                spilled.append(store['session_id'])
+        return spilled
@@ -0,0 +1,366 @@
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+
+from metrics import get_logger, increment, log_error, timer
+
+logger = get_logger('shared_workspace')
+
+# Namen der gemeinsam genutzten Tabellen
+WORKSPACE_FRAMES = ['inventory', 'recipes', 'low_stock_thresholds', 'drink_sales', 'price_history',
+                    'substitution_groups', 'allocation_groups', 'stock_ledger']
+
+def create_shared_workspace(max_changes=100, pool=None):
+    """
+    Create a workspace that is shared by all sessions of the process
+
+    The workspace holds one inventory, one recipe table, the low stock
+    thresholds, the drinks sold per day (for the sales velocity), the price history, the
+    substitution groups, the allocation groups of generic POS products, the
+    stock ledger of deliveries and counts and the results derived from them. The frames are never modified in place: every change
+    replaces them with new frames and increases the version. Readers can
+    therefore keep using the frames of the version they have read.
+
+    With a storage pool, the database is the single source of truth for the
+    stored frames (STORED_FRAMES of storage.py: the frames that the API and
+    the report watcher use as well, the stock ledger and the price history):
+    every commit stores them, so a posted delivery survives a restart, and
+    changes made by these processes are taken over with sync_from_storage. The sales history of
+    all day reports stored in the database is then shared as well.
+
+    Args:
+        max_changes: Number of change records kept for notifications
+        pool: Optional storage.ConnectionPool of the shared database
+
+    Returns:
+        dict: Shared workspace
+    """
+    return {
+        'lock': threading.RLock(),
+        'version': 0,
+        'frames': {name: None for name in WORKSPACE_FRAMES},
+        'pool': pool,
+        'storage_version': None,
+        'sales_history': None,
+        'derived': None,
+        'derived_version': -1,
+        'low_stock_tracker': None,
+        'low_stock_tracker_recipes': None,
+        'substitute_index': None,
+        'substitute_index_groups': None,
+        'changes': deque(maxlen=max_changes),
+        'listeners': []
+    }
+
+def read_workspace(workspace):
+    """
+    Read a consistent state of the shared workspace
+
+    Args:
+        workspace: Shared workspace
+
+    Returns:
+        dict: version and the frames of that version ({frame name: DataFrame or None})
+    """
+    with workspace['lock']:
+        return {'version': workspace['version'], 'frames': dict(workspace['frames'])}
+
+def get_workspace_version(workspace):
+    """Get the current version of the shared workspace"""
+    return workspace['version']
+
+def get_frame_version(df, columns):
+    """
+    Compute a version fingerprint of selected DataFrame columns
+
+    The fingerprint only changes when the content of these columns changes,
+    e.g. a stock update does not change the price version of the inventory.
+
+    Args:
+        df: DataFrame
+        columns: Columns that make up the version
+
+    Returns:
+        str: Hex digest identifying the content
+    """
+    import pandas as pd
+
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+def _frames_equal(old_df, new_df):
+    """Check whether a new frame has the same content as the stored one"""
+    if old_df is None or new_df is None:
+        return old_df is new_df
+    return old_df is new_df or old_df.equals(new_df)
+
+def _apply_change(workspace, frames, label, session_id, changed=()):
+    """Replace the changed frames, increase the version and record the change (call with the lock held)"""
+    frames = {name: df for name, df in frames.items() if not _frames_equal(workspace['frames'][name], df)}
+    if not frames and not changed:
+        return None
+
+    workspace['frames'].update(frames)
+    workspace['version'] += 1
+    change = {
+        'version': workspace['version'],
+        'label': label,
+        'session_id': session_id,
+        'frames': sorted(frames) + list(changed),
+        'timestamp': datetime.now()
+    }
+    workspace['changes'].append(change)
+    return change
+
+def _notify_listeners(workspace, change):
+    """Call the listeners with a change record (call without the lock, so listeners may read)"""
+    if change is None:
+        return
+    with workspace['lock']:
+        listeners = list(workspace['listeners'])
+    for listener in listeners:
+        try:
+            listener(change)
+        except Exception as e:
+            log_error(logger, "Error notifying workspace listener", e)
+
+def _add_stored_reports(workspace, frames, reports):
+    """Add newly stored day reports to the shared sales history and to the drinks sold per day"""
+    from sales_history import create_sales_history, add_sales_reports
+    from low_stock_tracker import get_daily_drink_sales, merge_daily_drink_sales
+
+    sales_history = workspace['sales_history'] or create_sales_history()
+    workspace['sales_history'] = add_sales_reports(sales_history, reports)
+
+    # Verkaufte Drinks pro Tag für die Dringlichkeit der Bestandswarnungen, nur die Tage der neuen Berichte
+    if frames['recipes'] is not None:
+        report_days = sorted({sales_data['date'] for _, sales_data in reports})
+        frames['drink_sales'] = merge_daily_drink_sales(
+            workspace['frames']['drink_sales'],
+            get_daily_drink_sales(workspace['sales_history'], frames['recipes'], report_days),
+            report_days)
+
+def _load_from_storage(workspace, label, session_id=None):
+    """Take over the stored frames and the new day reports of the database (call with the lock held)"""
+    from storage import load_frames, load_sales_reports
+
+    since_version = workspace['storage_version']
+    workspace['storage_version'], frames = load_frames(workspace['pool'])
+    reports = load_sales_reports(workspace['pool'], since_version)
+    if reports:
+        _add_stored_reports(workspace, frames, reports)
+    return _apply_change(workspace, frames, label, session_id, ['sales_history'] if reports else [])
+
+def sync_from_storage(workspace, label="In der Datenbank geändert (API/Report-Watcher)", session_id=None):
+    """
+    Take over the changes stored in the database by the API, the report watcher or the app itself
+
+    Only a version number is read as long as nothing has changed, so this can
+    be called before every read. New day reports are added to the shared
+    sales history.
+
+    Args:
+        workspace: Shared workspace
+        label: Description of the change, if there is one
+        session_id: Id of the session that stored the change (None: another process)
+
+    Returns:
+        int: Version of the workspace after the sync
+    """
+    from storage import get_storage_version
+
+    if workspace['pool'] is None:
+        return workspace['version']
+
+    change = None
+    with workspace['lock']:
+        if get_storage_version(workspace['pool']) != workspace['storage_version']:
+            change = _load_from_storage(workspace, label, session_id)
+        version = workspace['version']
+
+    _notify_listeners(workspace, change)
+    return version
+
+def commit_workspace(workspace, expected_version, frames, label="", session_id=None):
+    """
+    Replace frames of the shared workspace (optimistic locking)
+
+    The change is only applied if the workspace still has the version the
+    caller has read. Otherwise another session changed it in the meantime and
+    the caller has to read the new state and apply its change again. Frames
+    with the same content as the stored ones do not create a new version.
+    With a storage pool, the stored frames are written to the database in
+    the same step. If the API or the report watcher changed the database in
+    the meantime, their state is taken over instead and the commit fails
+    like a conflict with another session.
+
+    Args:
+        workspace: Shared workspace
+        expected_version: Version the change is based on
+        frames: Dictionary {frame name: DataFrame}; None removes a frame
+        label: Description of the change, e.g. "Lagerbestand bearbeitet"
+        session_id: Id of the session making the change
+
+    Returns:
+        int: Version after the commit (None if the workspace was changed by someone else)
+    """
+    unknown_frames = set(frames) - set(WORKSPACE_FRAMES)
+    if unknown_frames:
+        raise ValueError(f"Unknown workspace frames: {', '.join(sorted(unknown_frames))}")
+
+    with workspace['lock']:
+        if workspace['version'] != expected_version:
+            return None
+
+        frames = {name: df for name, df in frames.items()
+                  if not _frames_equal(workspace['frames'][name], df)}
+        if not frames:
+            return workspace['version']
+
+        conflict = False
+        if workspace['pool'] is not None:
+            from storage import STORED_FRAMES, save_frames
+            stored_frames = {name: df for name, df in frames.items() if name in STORED_FRAMES}
+            if stored_frames:
+                storage_version = save_frames(workspace['pool'], stored_frames, workspace['storage_version'])
+                conflict = storage_version is None
+                if not conflict:
+                    workspace['storage_version'] = storage_version
+
+        # Bei einem Konflikt den Stand der Datenbank übernehmen, der Aufrufer muss seine Änderung wiederholen
+        change = (_load_from_storage(workspace, "In der Datenbank geändert (API/Report-Watcher)") if conflict
+                  else _apply_change(workspace, frames, label, session_id))
+
+    # Listener außerhalb der Sperre aufrufen, damit sie selbst lesen dürfen
+    _notify_listeners(workspace, change)
+    return None if conflict else change['version']
+
+def get_changes_since(workspace, version, exclude_session_id=None):
+    """
+    Get the changes made after a version
+
+    Args:
+        workspace: Shared workspace
+        version: Last version the caller has seen
+        exclude_session_id: Leave out the changes of this session
+
+    Returns:
+        list: Change records (version, label, session_id, frames, timestamp), oldest first
+    """
+    with workspace['lock']:
+        return [change for change in workspace['changes']
+                if change['version'] > version and change['session_id'] != exclude_session_id]
+
+def add_change_listener(workspace, listener):
+    """
+    Register a function that is called with the change record after every commit
+
+    Args:
+        workspace: Shared workspace
+        listener: Function taking one change record
+    """
+    with workspace['lock']:
+        workspace['listeners'].append(listener)
+
+def remove_change_listener(workspace, listener):
+    """Unregister a function registered with add_change_listener"""
+    with workspace['lock']:
+        if listener in workspace['listeners']:
+            workspace['listeners'].remove(listener)
+
+def _get_sales_velocity(workspace):
+    """Get the drinks sold per day from the shared daily drink sales (None without sales)"""
+    from low_stock_tracker import calculate_velocity_from_daily_sales
+
+    drink_sales = workspace['frames']['drink_sales']
+    if drink_sales is None:
+        return None
+    velocity = calculate_velocity_from_daily_sales(drink_sales)
+    return dict(zip(velocity['drink_name'], velocity['drinks_per_day']))
+
+def _get_low_stock_warnings(workspace):
+    """Update the low stock tracker to the current frames and get its warnings, most urgent first"""
+    from low_stock_tracker import (
+        create_low_stock_tracker, update_tracker_stock, set_tracker_thresholds, set_tracker_velocity,
+        get_urgent_warnings, split_thresholds
+    )
+
+    frames = workspace['frames']
+    ingredient_thresholds, drink_thresholds = split_thresholds(frames['low_stock_thresholds'])
+    sales_velocity = _get_sales_velocity(workspace) or {}
+
+    tracker = workspace['low_stock_tracker']
+    if tracker is None or workspace['low_stock_tracker_recipes'] is not frames['recipes']:
+        # Neue Rezepte: Tracker einmal neu aufbauen
+        tracker = create_low_stock_tracker(frames['recipes'], frames['inventory'],
+                                           ingredient_thresholds=ingredient_thresholds,
+                                           drink_thresholds=drink_thresholds, sales_velocity=sales_velocity)
+        workspace['low_stock_tracker'] = tracker
+        workspace['low_stock_tracker_recipes'] = frames['recipes']
+    else:
+        # Sonst nur die geänderten Zutaten neu bewerten
+        set_tracker_thresholds(tracker, ingredient_thresholds=ingredient_thresholds, drink_thresholds=drink_thresholds)
+        set_tracker_velocity(tracker, sales_velocity)
+        update_tracker_stock(tracker, frames['inventory'])
+
+    return get_urgent_warnings(tracker)
+
+def _get_substitute_index(workspace):
+    """Get the substitute index, rebuilt only when the substitution groups change"""
+    from substitutions import build_substitute_index
+
+    groups = workspace['frames']['substitution_groups']
+    if workspace['substitute_index'] is None or workspace['substitute_index_groups'] is not groups:
+        workspace['substitute_index'] = build_substitute_index(groups)
+        workspace['substitute_index_groups'] = groups
+    return workspace['substitute_index']
+
+def get_derived_data(workspace):
+    """
+    Get the current frames with their drink costs, available drinks, availability with substitutes
+    and low stock warnings
+
+    The results are computed once per version. Sessions asking at the same
+    time wait for that computation instead of repeating it. Frames and
+    results always belong to the same version. The low stock warnings are
+    kept up to date incrementally by a low stock tracker, the substitute
+    index is only rebuilt when the substitution groups change.
+
+    Args:
+        workspace: Shared workspace
+
+    Returns:
+        dict: version, frames, sales_history (None without stored reports), drink_costs, available_drinks,
+            substitute_availability and low_stock_warnings (the results are None while inventory or recipes
+            are missing)
+    """
+    with workspace['lock']:
+        if workspace['derived_version'] != workspace['version']:
+            inventory_data = workspace['frames']['inventory']
+            recipe_data = workspace['frames']['recipes']
+            derived = {'version': workspace['version'], 'frames': dict(workspace['frames']),
+                       'sales_history': workspace['sales_history'], 'drink_costs': None, 'available_drinks': None, 'substitute_availability': None,
+                       'low_stock_warnings': None}
+
+            if inventory_data is not None and recipe_data is not None:
+                # Erst hier importieren, damit ein leerer Workspace kein pandas lädt
+                from data_processor import calculate_drink_costs, calculate_available_drinks
+                from substitutions import calculate_available_drinks_with_substitutes
+                sales_velocity = _get_sales_velocity(workspace)
+                increment('rumbar_recomputes_total', what='derived_data')
+                with timer(function='get_derived_data'):
+                    derived.update({
+                        'drink_costs': calculate_drink_costs(recipe_data, inventory_data),
+                        'available_drinks': calculate_available_drinks(recipe_data, inventory_data),
+                        'substitute_availability': calculate_available_drinks_with_substitutes(
+                            recipe_data, inventory_data, _get_substitute_index(workspace), sales_velocity),
+                        'low_stock_warnings': _get_low_stock_warnings(workspace)
+                    })
+            else:
+                workspace['low_stock_tracker'] = None
+                workspace['low_stock_tracker_recipes'] = None
+
+            workspace['derived'] = derived
+            workspace['derived_version'] = workspace['version']
+        return workspace['derived']
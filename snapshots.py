@@ -0,0 +1,346 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+def create_version_store(max_versions=200):
+    """
+    Create an empty store for versioned snapshots of the workspace frames
+
+    Every version holds one or more named DataFrames (e.g. 'inventory' and
+    'recipes'). Columns are stored as read-only blocks that are shared
+    between versions as long as they do not change (copy-on-write).
+
+    Args:
+        max_versions: Number of versions to keep before the oldest are dropped
+
+    Returns:
+        dict: Version store
+    """
+    return {
+        'blocks': {},
+        'block_refs': {},
+        'next_block_id': 0,
+        'next_version_id': 1,
+        'versions': [],
+        'position': -1,
+        'max_versions': max_versions
+    }
+
+def _blocks_equal(block, values):
+    """Check whether a stored block and new column values have the same content"""
+    if block.dtype != values.dtype or block.shape != values.shape:
+        return False
+    if block.dtype.kind in 'fc':
+        return np.array_equal(block, values, equal_nan=True)
+    if block.dtype.kind in 'iub':
+        return np.array_equal(block, values)
+    # Object-Spalten (z.B. Namen) mit pandas vergleichen, damit NaN == NaN gilt
+    return pd.Series(block).equals(pd.Series(values))
+
+def _store_block(store, values):
+    """Store column values as a new read-only block and return its id"""
+    block = np.array(values, copy=True)
+    block.flags.writeable = False
+
+    block_id = store['next_block_id']
+    store['next_block_id'] += 1
+    store['blocks'][block_id] = block
+    store['block_refs'][block_id] = 0
+    return block_id
+
+def _release_version(store, version):
+    """Drop the block references of a version and delete blocks that are no longer used"""
+    for frame_layout in version['frames'].values():
+        for block_id in frame_layout['block_ids'] + [frame_layout['index_block_id']]:
+            store['block_refs'][block_id] -= 1
+            if store['block_refs'][block_id] == 0:
+                del store['block_refs'][block_id]
+                del store['blocks'][block_id]
+
+def _get_frame_layout(store, df, previous_layout):
+    """
+    Get the columns of a DataFrame as block ids, reusing unchanged blocks
+
+    Args:
+        store: Version store
+        df: DataFrame to store
+        previous_layout: Layout of the same frame in the current version (or None)
+
+    Returns:
+        dict: Column names, index block and column block ids
+    """
+    previous_blocks = {}
+    if previous_layout is not None:
+        previous_blocks = dict(zip(previous_layout['columns'], previous_layout['block_ids']))
+        previous_blocks['__index__'] = previous_layout['index_block_id']
+
+    def get_block_id(name, values):
+        block_id = previous_blocks.get(name)
+        if block_id is not None and _blocks_equal(store['blocks'][block_id], values):
+            return block_id
+        return _store_block(store, values)
+
+    return {
+        'columns': list(df.columns),
+        'index_block_id': get_block_id('__index__', df.index.to_numpy()),
+        'block_ids': [get_block_id(column, df[column].to_numpy()) for column in df.columns]
+    }
+
+def commit_version(store, frames, label=""):
+    """
+    Store a new version of the workspace frames
+
+    Frames that are not passed are taken over from the current version. If
+    nothing changed compared to the current version, no new version is
+    created. Committing after an undo discards the versions that could have
+    been restored with redo.
+
+    Args:
+        store: Version store
+        frames: Dictionary {frame name: DataFrame}
+        label: Description of the change, e.g. "Verkäufe 2025-03-28 abgezogen"
+
+    Returns:
+        int: Id of the current version after the commit
+    """
+    try:
+        current = get_current_version(store)
+        current_frames = current['frames'] if current is not None else {}
+
+        new_frames = dict(current_frames)
+        for name, df in frames.items():
+            if df is None:
+                continue
+            new_frames[name] = _get_frame_layout(store, df, current_frames.get(name))
+
+        # Keine Änderung: keine neue Version anlegen
+        if current is not None and new_frames == current_frames:
+            return current['version_id']
+
+        # Versionen nach der aktuellen Position (Redo-Zweig) verwerfen
+        for version in store['versions'][store['position'] + 1:]:
+            _release_version(store, version)
+        del store['versions'][store['position'] + 1:]
+
+        version = {
+            'version_id': store['next_version_id'],
+            'label': label,
+            'timestamp': datetime.now(),
+            'frames': new_frames
+        }
+        store['next_version_id'] += 1
+
+        for frame_layout in new_frames.values():
+            for block_id in frame_layout['block_ids'] + [frame_layout['index_block_id']]:
+                store['block_refs'][block_id] += 1
+        store['versions'].append(version)
+
+        # Älteste Versionen verwerfen, wenn das Limit erreicht ist
+        while len(store['versions']) > store['max_versions']:
+            _release_version(store, store['versions'].pop(0))
+
+        store['position'] = len(store['versions']) - 1
+        return version['version_id']
+
+    except Exception as e:
+        raise Exception(f"Error storing version: {str(e)}")
+
+def get_current_version(store):
+    """
+    Get the metadata of the current version
+
+    Args:
+        store: Version store
+
+    Returns:
+        dict: Current version (None if nothing has been stored yet)
+    """
+    if store['position'] < 0:
+        return None
+    return store['versions'][store['position']]
+
+def _find_version(store, version_id):
+    """Find a version by its id"""
+    for version in store['versions']:
+        if version['version_id'] == version_id:
+            return version
+    raise KeyError(f"Version {version_id} not found")
+
+def get_version_frames(store, version_id=None):
+    """
+    Rebuild the DataFrames of a version from the shared blocks
+
+    The columns of the returned frames are backed by read-only blocks, so
+    they must be copied before being modified in place.
+
+    Args:
+        store: Version store
+        version_id: Id of the version (default: the current version)
+
+    Returns:
+        dict: Dictionary {frame name: DataFrame}
+    """
+    version = get_current_version(store) if version_id is None else _find_version(store, version_id)
+    if version is None:
+        return {}
+
+    frames = {}
+    for name, frame_layout in version['frames'].items():
+        frames[name] = pd.DataFrame(
+            {column: store['blocks'][block_id]
+             for column, block_id in zip(frame_layout['columns'], frame_layout['block_ids'])},
+            index=store['blocks'][frame_layout['index_block_id']],
+            columns=frame_layout['columns'],
+            copy=False
+        )
+    return frames
+
+def can_undo(store):
+    """Check whether there is a version to go back to"""
+    return store['position'] > 0
+
+def can_redo(store):
+    """Check whether there is an undone version to restore"""
+    return store['position'] < len(store['versions']) - 1
+
+def undo(store):
+    """
+    Go back to the previous version
+
+    Args:
+        store: Version store
+
+    Returns:
+        dict: Frames of the previous version (None if there is nothing to undo)
+    """
+    if not can_undo(store):
+        return None
+    store['position'] -= 1
+    return get_version_frames(store)
+
+def redo(store):
+    """
+    Restore the version that was undone last
+
+    Args:
+        store: Version store
+
+    Returns:
+        dict: Frames of the restored version (None if there is nothing to redo)
+    """
+    if not can_redo(store):
+        return None
+    store['position'] += 1
+    return get_version_frames(store)
+
+def list_versions(store):
+    """
+    List all stored versions
+
+    Args:
+        store: Version store
+
+    Returns:
+        pandas.DataFrame: Version id, label, timestamp and whether it is the current version
+    """
+    return pd.DataFrame([
+        {
+            'version_id': version['version_id'],
+            'label': version['label'],
+            'timestamp': version['timestamp'],
+            'current': position == store['position']
+        }
+        for position, version in enumerate(store['versions'])
+    ], columns=['version_id', 'label', 'timestamp', 'current'])
+
+def diff_versions(store, old_version_id, new_version_id, frame_name, key_column):
+    """
+    Compare a frame between two versions
+
+    Columns that share the same block in both versions are skipped without
+    looking at their values.
+
+    Args:
+        store: Version store
+        old_version_id: Id of the older version
+        new_version_id: Id of the newer version
+        frame_name: Name of the frame, e.g. 'inventory'
+        key_column: Column identifying a row, e.g. 'ingredient_name'
+
+    Returns:
+        pandas.DataFrame: One row per change with key, column, old and new value
+            (column is '(added)' or '(removed)' for added or removed rows)
+    """
+    diff_columns = [key_column, 'column', 'old_value', 'new_value']
+    old_layout = _find_version(store, old_version_id)['frames'].get(frame_name)
+    new_layout = _find_version(store, new_version_id)['frames'].get(frame_name)
+
+    if old_layout is None or new_layout is None or old_layout == new_layout:
+        return pd.DataFrame(columns=diff_columns)
+
+    old_df = get_version_frames(store, old_version_id)[frame_name]
+    new_df = get_version_frames(store, new_version_id)[frame_name]
+    old_blocks = dict(zip(old_layout['columns'], old_layout['block_ids']))
+    new_blocks = dict(zip(new_layout['columns'], new_layout['block_ids']))
+
+    changes = []
+
+    # Hinzugefügte und entfernte Zeilen
+    old_keys = set(old_df[key_column])
+    new_keys = set(new_df[key_column])
+    changes += [{key_column: key, 'column': '(added)', 'old_value': None, 'new_value': None}
+                for key in new_keys - old_keys]
+    changes += [{key_column: key, 'column': '(removed)', 'old_value': None, 'new_value': None}
+                for key in old_keys - new_keys]
+
+    # Geänderte Werte nur in Spalten mit unterschiedlichen Blöcken suchen
+    changed_columns = [column for column in new_layout['columns']
+                       if column != key_column and column in old_blocks
+                       and old_blocks[column] != new_blocks[column]]
+
+    if changed_columns:
+        merged = old_df[[key_column] + changed_columns].drop_duplicates(key_column).merge(
+            new_df[[key_column] + changed_columns].drop_duplicates(key_column),
+            on=key_column, suffixes=('_old', '_new')
+        )
+        for column in changed_columns:
+            old_values = merged[f"{column}_old"]
+            new_values = merged[f"{column}_new"]
+            changed = (old_values != new_values) & ~(old_values.isna() & new_values.isna())
+            changes += [
+                {key_column: key, 'column': column, 'old_value': old_value, 'new_value': new_value}
+                for key, old_value, new_value in zip(merged.loc[changed, key_column],
+                                                     old_values[changed], new_values[changed])
+            ]
+
+    return pd.DataFrame(changes, columns=diff_columns)
+
+def get_store_memory_usage(store):
+    """
+    Compare the memory used by the shared blocks with storing full copies
+
+    Args:
+        store: Version store
+
+    Returns:
+        dict: Bytes used by the blocks, bytes full copies would need and their ratio
+    """
+    def block_bytes(block):
+        if block.dtype == object:
+            return int(pd.Series(block).memory_usage(index=False, deep=True))
+        return int(block.nbytes)
+
+    sizes = {block_id: block_bytes(block) for block_id, block in store['blocks'].items()}
+    shared_bytes = sum(sizes.values())
+    full_copy_bytes = sum(
+        sizes[block_id]
+        for version in store['versions']
+        for frame_layout in version['frames'].values()
+        for block_id in frame_layout['block_ids'] + [frame_layout['index_block_id']]
+    )
+
+    return {
+        'shared_bytes': shared_bytes,
+        'full_copy_bytes': full_copy_bytes,
+        'ratio': shared_bytes / full_copy_bytes if full_copy_bytes else 1.0
+    }
@@ -0,0 +1,300 @@
+import argparse
+import csv
+import io
+import math
+import os
+import tempfile
+
+# Kopfzeile von "Warenwirtschaft Rumbar 2024 - Lagerbestand.csv" (die leeren Spalten gehören dazu)
+INVENTORY_SPREADSHEET_HEADER = [
+    'Zutat', 'Lagerbestand (ml)', '', 'Lagerbestand in Flaschen (à 700ml)', 'Einkaufspreis pro Liter (EUR)',
+    'Soll-Lagerbestand in Flaschen für 50 Drinks', '', ''
+]
+
+# Spalten der Tabelle, die aus dem Lagerbestand geschrieben werden
+INVENTORY_SPREADSHEET_COLUMNS = {
+    'Lagerbestand (ml)': 'current_stock_ml',
+    'Einkaufspreis pro Liter (EUR)': 'price_per_liter',
+    'Soll-Lagerbestand in Flaschen für 50 Drinks': 'target_stock_ml'
+}
+
+def read_spreadsheet_layout(layout_file):
+    """
+    Read the raw rows of the inventory spreadsheet as a template for the export
+
+    Every cell is kept as text, together with the line ending, a byte order
+    mark and whether the file ends with a line break, so that an export with
+    unchanged data reproduces the file byte for byte.
+
+    Args:
+        layout_file: Path or uploaded file of the spreadsheet CSV
+
+    Returns:
+        dict: header, rows, newline, bom and final_newline
+    """
+    try:
+        if isinstance(layout_file, (str, os.PathLike)):
+            with open(layout_file, 'rb') as file:
+                content = file.read()
+        else:
+            content = layout_file.read()
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+
+        bom = content.startswith('\ufeff')
+        content = content.lstrip('\ufeff')
+        rows = list(csv.reader(io.StringIO(content, newline='')))
+
+        return {
+            'header': rows[0] if rows else list(INVENTORY_SPREADSHEET_HEADER),
+            'rows': rows[1:],
+            'newline': '\r\n' if '\r\n' in content else '\n',
+            'bom': bom,
+            'final_newline': content.endswith('\n')
+        }
+
+    except Exception as e:
+        raise Exception(f"Error reading spreadsheet layout: {str(e)}")
+
+def _parse_spreadsheet_number(text):
+    """Parse a spreadsheet cell like "3,81" or "1.448,00" (empty cells are 0, like process_inventory_data)"""
+    text = text.strip()
+    if not text:
+        return 0.0
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+def _is_missing(value):
+    """Check a cell value for None/NaN (faster than pd.isna for single values)"""
+    return value is None or value != value
+
+def _format_spreadsheet_number(value):
+    """Format a number like the spreadsheet does: German decimal comma, at most two decimals"""
+    if _is_missing(value):
+        return ''
+    value = round(float(value), 2)
+    if value == int(value):
+        return str(int(value))
+    return f"{value:.2f}".rstrip('0').replace('.', ',')
+
+def _update_cell(row, position, value):
+    """Write a value into a cell unless the cell already holds it; return whether it changed"""
+    if position is None:
+        return False
+    while len(row) <= position:
+        row.append('')
+    if _is_missing(value):
+        unchanged = row[position].strip() == ''
+    else:
+        # Die Tabelle hat höchstens zwei Nachkommastellen
+        unchanged = abs(_parse_spreadsheet_number(row[position]) - value) < 0.005
+    if unchanged:
+        return False
+    row[position] = _format_spreadsheet_number(value)
+    return True
+
+def iter_inventory_rows(inventory_data, layout=None, bottle_size_ml=700, recalculate_bottles=False):
+    """
+    Yield the rows of the inventory spreadsheet with the current inventory written into them
+
+    Rows are matched by ingredient name (the n-th row of a name in the
+    spreadsheet with the n-th row of that name in the inventory). Only cells
+    whose value changed are rewritten. Rows that are not in the inventory
+    are kept unchanged, new ingredients are appended.
+
+    The bottle columns next to the stock and the target are maintained by
+    the team and are not always ml / bottle size (e.g. Havana Club: 3300ml,
+    "3,81" bottles), so they are kept as they are. Only appended rows get
+    ml / bottle_size_ml, and with recalculate_bottles also the rows whose
+    stock or target changed.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        layout: Result of read_spreadsheet_layout (default: an empty spreadsheet)
+        bottle_size_ml: Bottle size of the bottle columns (default: 700ml)
+        recalculate_bottles: Recalculate the bottle cells of changed rows as ml / bottle_size_ml
+
+    Yields:
+        list: Cells of the header, then of every row
+    """
+    header = layout['header'] if layout else list(INVENTORY_SPREADSHEET_HEADER)
+    positions = {column: header.index(label) for label, column in INVENTORY_SPREADSHEET_COLUMNS.items()
+                 if label in header}
+    stock_bottles = None
+    if 'Lagerbestand in Flaschen (à 700ml)' in header:
+        stock_bottles = header.index('Lagerbestand in Flaschen (à 700ml)')
+    # Die unbenannte Spalte rechts vom Soll-Bestand enthält den Soll-Bestand in Flaschen
+    target_position = positions.get('target_stock_ml')
+    target_bottles = None
+    if target_position is not None and target_position + 1 < len(header) and header[target_position + 1] == '':
+        target_bottles = target_position + 1
+    name_position = header.index('Zutat')
+
+    inventory = inventory_data.dropna(subset=['ingredient_name'])
+    inventory = inventory.assign(occurrence=inventory.groupby('ingredient_name').cumcount())
+    values = {
+        (name, occurrence): (stock, price, target)
+        for name, occurrence, stock, price, target in zip(
+            inventory['ingredient_name'], inventory['occurrence'], inventory['current_stock_ml'],
+            inventory['price_per_liter'], inventory['target_stock_ml'])
+    }
+
+    yield list(header)
+    occurrences = {}
+    for row in (layout['rows'] if layout else []):
+        name = row[name_position] if len(row) > name_position else ''
+        occurrence = occurrences.get(name, 0)
+        occurrences[name] = occurrence + 1
+
+        current = values.pop((name, occurrence), None)
+        if current is None:
+            yield row
+            continue
+
+        row = list(row)
+        stock, price, target = current
+        if _update_cell(row, positions.get('current_stock_ml'), stock) and recalculate_bottles:
+            _update_cell(row, stock_bottles, stock / bottle_size_ml)
+        _update_cell(row, positions.get('price_per_liter'), price)
+        if _update_cell(row, target_position, target) and recalculate_bottles:
+            _update_cell(row, target_bottles, target / bottle_size_ml)
+        yield row
+
+    # Zutaten, die es in der Tabelle noch nicht gibt
+    for (name, _), (stock, price, target) in values.items():
+        row = [''] * len(header)
+        row[name_position] = name
+        for column, value in (('current_stock_ml', stock), ('price_per_liter', price), ('target_stock_ml', target)):
+            if column in positions:
+                row[positions[column]] = _format_spreadsheet_number(value)
+        if stock_bottles is not None:
+            row[stock_bottles] = _format_spreadsheet_number(stock / bottle_size_ml)
+        if target_bottles is not None:
+            row[target_bottles] = _format_spreadsheet_number(target / bottle_size_ml)
+        yield row
+
+def export_inventory_to_spreadsheet(inventory_data, output, layout=None, file_format='csv', bottle_size_ml=700,
+                                    recalculate_bottles=False):
+    """
+    Write the inventory in the layout of the team's inventory spreadsheet
+
+    Rows are streamed to the output one by one. CSV output keeps the line
+    endings and the German number format of the layout. XLSX output needs
+    the optional package openpyxl and writes numbers as numeric cells.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        output: Binary file object to write to
+        layout: Result of read_spreadsheet_layout (default: an empty spreadsheet)
+        file_format: 'csv' or 'xlsx'
+        bottle_size_ml: Bottle size of the bottle columns (default: 700ml)
+        recalculate_bottles: Recalculate the bottle cells of changed rows (see iter_inventory_rows)
+
+    Returns:
+        int: Number of rows written (without the header)
+    """
+    try:
+        rows = iter_inventory_rows(inventory_data, layout, bottle_size_ml, recalculate_bottles)
+        count = -1
+
+        if file_format == 'xlsx':
+            try:
+                from openpyxl import Workbook
+            except ImportError:
+                raise Exception("XLSX export needs the package openpyxl (pip install openpyxl)")
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Lagerbestand")
+            for count, row in enumerate(rows):
+                if count == 0:
+                    sheet.append(row)
+                    continue
+                number_cells = [_parse_spreadsheet_number(cell) if cell.strip() else None for cell in row[1:]]
+                sheet.append(row[:1] + [cell if _is_missing(number) else number
+                                        for cell, number in zip(row[1:], number_cells)])
+            workbook.save(output)
+            return max(count, 0)
+
+        newline = layout['newline'] if layout else '\r\n'
+        text = io.TextIOWrapper(output, encoding='utf-8-sig' if layout and layout['bom'] else 'utf-8', newline='')
+        # Zeilenumbruch vor jeder Zeile schreiben, damit das Dateiende wie in der Vorlage bleibt
+        writer = csv.writer(text, lineterminator='')
+        for count, row in enumerate(rows):
+            if count > 0:
+                text.write(newline)
+            writer.writerow(row)
+        if layout is None or layout['final_newline']:
+            text.write(newline)
+        text.flush()
+        text.detach()
+        return max(count, 0)
+
+    except Exception as e:
+        raise Exception(f"Error exporting inventory spreadsheet: {str(e)}")
+
+def write_inventory_spreadsheet(inventory_data, output_path, layout_path=None, bottle_size_ml=700,
+                                recalculate_bottles=False):
+    """
+    Write the inventory spreadsheet to a file in one atomic replace
+
+    The format follows the file extension (.xlsx or .csv). Readers of the
+    file never see a half-written spreadsheet.
+
+    Args:
+        inventory_data: Inventory DataFrame
+        output_path: Path of the spreadsheet to write
+        layout_path: Spreadsheet CSV whose layout is kept (default: output_path if it is a CSV that exists)
+        bottle_size_ml: Bottle size of the bottle columns (default: 700ml)
+        recalculate_bottles: Recalculate the bottle cells of changed rows (see iter_inventory_rows)
+
+    Returns:
+        int: Number of rows written
+    """
+    file_format = 'xlsx' if output_path.lower().endswith('.xlsx') else 'csv'
+    if layout_path is None and file_format == 'csv' and os.path.exists(output_path):
+        layout_path = output_path
+    layout = read_spreadsheet_layout(layout_path) if layout_path else None
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=f".{file_format}.tmp")
+    try:
+        with os.fdopen(file_descriptor, 'wb') as output:
+            count = export_inventory_to_spreadsheet(inventory_data, output, layout, file_format, bottle_size_ml,
+                                                    recalculate_bottles)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return count
+
+def main():
+    """Write the inventory of the database into the office spreadsheet (e.g. as nightly job)"""
+    from storage import ConnectionPool, load_inventory
+
+    parser = argparse.ArgumentParser(description="Export the inventory in the layout of the inventory spreadsheet")
+    parser.add_argument("output", help="Spreadsheet to write (.csv or .xlsx)")
+    parser.add_argument("--layout", help="Spreadsheet CSV whose layout is kept (default: the output CSV)")
+    parser.add_argument("--db", default=os.environ.get("RUMBAR_DB_PATH", "rumbar.db"), help="SQLite database")
+    parser.add_argument("--recalculate-bottles", action="store_true",
+                        help="Overwrite the bottle columns of changed rows with ml / 700")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db, size=1)
+    try:
+        inventory_data = load_inventory(pool)
+    finally:
+        pool.close()
+    if inventory_data is None or inventory_data.empty:
+        print("No inventory in the database")
+        return
+
+    count = write_inventory_spreadsheet(inventory_data, args.output, args.layout,
+                                        recalculate_bottles=args.recalculate_bottles)
+    print(f"{count} rows written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import pandas as pd
+
+from data_processor import calculate_ingredient_usage
+from sales_history import list_periods, get_sales_frame
+from metrics import get_logger, log_error
+
+logger = get_logger('stock_ledger')
+
+# Bewegungsarten im Lagerbuch: 'stocktake' = gezählter Bestand, 'delivery' = Wareneingang
+LEDGER_COLUMNS = ['date', 'ingredient_name', 'movement_type', 'amount_ml', 'reference']
+
+VARIANCE_COLUMNS = [
+    'ingredient_name', 'period_start', 'period_end', 'opening_ml', 'deliveries_ml',
+    'closing_ml', 'actual_usage_ml', 'theoretical_usage_ml', 'variance_ml',
+    'variance_pct', 'variance_eur'
+]
+
+def create_stock_ledger():
+    """
+    Create an empty stock ledger
+
+    The ledger records physical counts (stocktakes) and deliveries per
+    ingredient. Sales are not stored in the ledger, they are taken from the
+    sales history when the variance is calculated.
+
+    Returns:
+        pandas.DataFrame: Empty ledger
+    """
+    return pd.DataFrame({
+        'date': pd.Series(dtype='datetime64[ns]'),
+        'ingredient_name': pd.Series(dtype=object),
+        'movement_type': pd.Series(dtype=object),
+        'amount_ml': pd.Series(dtype=float),
+        'reference': pd.Series(dtype=object)
+    })
+
+def add_ledger_movements(ledger, movements, movement_type, reference="", replace_key=None):
+    """
+    Add movements of one type to the ledger
+
+    Movements of the same type, date and ingredient (or the same replace_key)
+    that are already in the ledger are replaced, so posting the same file
+    twice has no effect.
+
+    Args:
+        ledger: Stock ledger DataFrame
+        movements: DataFrame with date, ingredient_name and amount_ml
+        movement_type: 'stocktake' or 'delivery'
+        reference: Description of the source, e.g. the file name
+        replace_key: Columns identifying the movements to replace (default: date and ingredient_name)
+
+    Returns:
+        pandas.DataFrame: The updated ledger
+    """
+    try:
+        new_rows = pd.DataFrame({
+            'date': pd.to_datetime(movements['date']).astype('datetime64[ns]'),
+            'ingredient_name': movements['ingredient_name'],
+            'movement_type': movement_type,
+            'amount_ml': movements['amount_ml'].astype(float),
+            'reference': reference
+        })
+
+        # Bereits gebuchte Bewegungen mit gleichem Schlüssel ersetzen
+        replace_key = replace_key or ['date', 'ingredient_name']
+        keys = pd.MultiIndex.from_frame(new_rows[replace_key])
+        existing = (ledger['movement_type'] == movement_type) & pd.MultiIndex.from_frame(
+            ledger[replace_key]).isin(keys)
+
+        updated_ledger = pd.concat([ledger[~existing], new_rows], ignore_index=True)
+        return updated_ledger.sort_values(['date', 'ingredient_name'], kind='stable').reset_index(drop=True)
+
+    except Exception as e:
+        raise Exception(f"Error adding movements to stock ledger: {str(e)}")
+
+def add_stocktake(ledger, stocktake_data, reference=""):
+    """
+    Add a stocktake from process_stocktake_data to the ledger
+
+    Args:
+        ledger: Stock ledger DataFrame
+        stocktake_data: DataFrame with count_date, ingredient_name and counted_ml
+        reference: Description of the source, e.g. the file name
+
+    Returns:
+        pandas.DataFrame: The updated ledger
+    """
+    movements = stocktake_data.rename(columns={'count_date': 'date', 'counted_ml': 'amount_ml'})
+    return add_ledger_movements(ledger, movements, 'stocktake', reference)
+
+def add_delivery(ledger, delivery_data, reference=""):
+    """
+    Add a goods receipt from process_delivery_data to the ledger
+
+    Posting the same file again replaces its movements. Deliveries of the
+    same day from other files are kept, so they add up.
+
+    Args:
+        ledger: Stock ledger DataFrame
+        delivery_data: DataFrame with delivery_date, ingredient_name and delivered_ml
+        reference: Description of the source, e.g. the file name
+
+    Returns:
+        pandas.DataFrame: The updated ledger
+    """
+    movements = delivery_data.rename(columns={'delivery_date': 'date', 'delivered_ml': 'amount_ml'})
+    return add_ledger_movements(ledger, movements, 'delivery', reference, replace_key=['reference'])
+
+def list_stocktakes(ledger):
+    """
+    List the stocktakes in the ledger
+
+    Args:
+        ledger: Stock ledger DataFrame
+
+    Returns:
+        pandas.DataFrame: Date, number of counted ingredients and counted ml per stocktake
+    """
+    counts = ledger[ledger['movement_type'] == 'stocktake']
+    return counts.groupby('date', as_index=False).agg(
+        ingredients=('ingredient_name', 'nunique'),
+        counted_ml=('amount_ml', 'sum')
+    )
+
+def _assign_to_intervals(movements, intervals):
+    """
+    Assign dated movements to the count interval (period_start, period_end] they fall into
+
+    Args:
+        movements: DataFrame with date, ingredient_name and a value column
+        intervals: DataFrame with ingredient_name, period_start and period_end
+
+    Returns:
+        pandas.DataFrame: The movements with period_end of their interval
+    """
+    if movements.empty:
+        return movements.assign(period_end=pd.Series(dtype='datetime64[ns]'))
+
+    # merge_asof verlangt für den Schlüssel exakt denselben Datentyp auf beiden Seiten
+    movements = movements.astype({'ingredient_name': object})
+    intervals = intervals[['ingredient_name', 'period_start', 'period_end']].astype({'ingredient_name': object})
+
+    assigned = pd.merge_asof(
+        movements.sort_values('date'),
+        intervals.sort_values('period_end'),
+        left_on='date', right_on='period_end', by='ingredient_name', direction='forward'
+    )
+    return assigned[assigned['date'] > assigned['period_start']]
+
+def calculate_variance(ledger, sales_history, recipe_data, inventory_data, product_mapping=None, allocation=None):
+    """
+    Calculate the theoretical vs. actual usage per ingredient between stocktakes
+
+    For every pair of consecutive counts of an ingredient, the actual usage
+    is opening count + deliveries - closing count. The theoretical usage is
+    the recipe usage of all drinks sold in that interval. A count is assumed
+    to be taken after closing, so the sales of the count date belong to the
+    interval that ends with it. The variance is theoretical minus actual
+    usage: negative values mean more was used than was sold (shrinkage).
+
+    Args:
+        ledger: Stock ledger DataFrame
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame (for price_per_liter)
+        product_mapping: Optional dictionary {product name: drink name}
+        allocation: Optional allocation vectors for generic "Divers." products (see product_allocation.py)
+
+    Returns:
+        pandas.DataFrame: Variance per ingredient and count interval
+    """
+    try:
+        counts = ledger[ledger['movement_type'] == 'stocktake'].sort_values(['ingredient_name', 'date'])
+        counts = counts.assign(
+            period_start=counts.groupby('ingredient_name')['date'].shift(),
+            opening_ml=counts.groupby('ingredient_name')['amount_ml'].shift()
+        )
+        intervals = counts.dropna(subset=['period_start']).rename(
+            columns={'date': 'period_end', 'amount_ml': 'closing_ml'}
+        )
+
+        if intervals.empty:
+            return pd.DataFrame(columns=VARIANCE_COLUMNS)
+
+        # Theoretischer Verbrauch aus allen Verkaufstagen im Zeitraum der Zählungen
+        first_day = intervals['period_start'].min().strftime("%Y-%m-%d")
+        last_day = intervals['period_end'].max().strftime("%Y-%m-%d")
+        day_keys = [day for day in list_periods(sales_history, 'day') if first_day < day <= last_day]
+
+        usage = calculate_ingredient_usage(get_sales_frame(sales_history, 'day', day_keys),
+                                           recipe_data, product_mapping, ['period'], allocation)
+        usage['date'] = pd.to_datetime(usage['period']).astype('datetime64[ns]')
+        theoretical = _assign_to_intervals(usage[['date', 'ingredient_name', 'usage_ml']], intervals)
+        theoretical = theoretical.groupby(['ingredient_name', 'period_end'], as_index=False)['usage_ml'].sum()
+
+        deliveries = ledger.loc[ledger['movement_type'] == 'delivery', ['date', 'ingredient_name', 'amount_ml']]
+        deliveries = _assign_to_intervals(deliveries, intervals)
+        deliveries = deliveries.groupby(['ingredient_name', 'period_end'], as_index=False)['amount_ml'].sum()
+
+        variance = intervals[['ingredient_name', 'period_start', 'period_end', 'opening_ml', 'closing_ml']]
+        variance = variance.merge(deliveries.rename(columns={'amount_ml': 'deliveries_ml'}),
+                                  on=['ingredient_name', 'period_end'], how='left')
+        variance = variance.merge(theoretical.rename(columns={'usage_ml': 'theoretical_usage_ml'}),
+                                  on=['ingredient_name', 'period_end'], how='left')
+        variance = variance.merge(inventory_data.drop_duplicates('ingredient_name')[['ingredient_name', 'price_per_liter']],
+                                  on='ingredient_name', how='left')
+
+        variance[['deliveries_ml', 'theoretical_usage_ml']] = variance[['deliveries_ml', 'theoretical_usage_ml']].fillna(0)
+        variance['actual_usage_ml'] = variance['opening_ml'] + variance['deliveries_ml'] - variance['closing_ml']
+        variance['variance_ml'] = variance['theoretical_usage_ml'] - variance['actual_usage_ml']
+        variance['variance_pct'] = (variance['variance_ml'] /
+                                    variance['actual_usage_ml'].where(variance['actual_usage_ml'] > 0) * 100)
+        variance['variance_eur'] = variance['variance_ml'] * variance['price_per_liter'].fillna(0) / 1000
+
+        return variance[VARIANCE_COLUMNS].sort_values(['period_end', 'variance_eur']).reset_index(drop=True)
+
+    except Exception as e:
+        log_error(logger, "Error calculating stock variance", e)
+        return None
+
+def summarize_variance(variance_df, period_type='month', by_ingredient=True):
+    """
+    Aggregate the variance per period of the closing count
+
+    Args:
+        variance_df: Result of calculate_variance
+        period_type: 'week', 'month' or 'year'
+        by_ingredient: Keep one row per ingredient (otherwise one row per period)
+
+    Returns:
+        pandas.DataFrame: Summed usage and variance per period (and ingredient)
+    """
+    period_formats = {'week': "%G-W%V", 'month': "%Y-%m", 'year': "%Y"}
+    summary = variance_df.assign(period=variance_df['period_end'].dt.strftime(period_formats[period_type]))
+
+    group_columns = ['period', 'ingredient_name'] if by_ingredient else ['period']
+    summary = summary.groupby(group_columns, as_index=False)[
+        ['actual_usage_ml', 'theoretical_usage_ml', 'variance_ml', 'variance_eur']
+    ].sum()
+
+    return summary.sort_values(['period', 'variance_eur']).reset_index(drop=True)
+
+def apply_stocktake_to_inventory(inventory_data, stocktake_data):
+    """
+    Set the current stock of the counted ingredients to the counted amounts
+
+    Args:
+        inventory_data: Inventory DataFrame
+        stocktake_data: DataFrame with ingredient_name and counted_ml
+
+    Returns:
+        pandas.DataFrame: Updated inventory data
+    """
+    counted = stocktake_data.drop_duplicates('ingredient_name', keep='last').set_index('ingredient_name')['counted_ml']
+    updated_inventory = inventory_data.copy()
+    updated_inventory['current_stock_ml'] = (
+        updated_inventory['ingredient_name'].map(counted).fillna(updated_inventory['current_stock_ml'])
+    )
+    return updated_inventory
+
+def apply_delivery_to_inventory(inventory_data, delivery_data):
+    """
+    Add a goods receipt to the current stock and take over its purchase prices
+
+    The delivery is joined with the inventory in one merge. Delivered amounts
+    are added to the stock of the ingredient (to its first row if it appears
+    more than once), delivered prices replace price_per_liter. Ingredients
+    that are not in the inventory are left out (see get_unknown_delivery_items).
+
+    Args:
+        inventory_data: Inventory DataFrame
+        delivery_data: DataFrame with ingredient_name, delivered_ml and price_per_liter
+
+    Returns:
+        pandas.DataFrame: Updated inventory data
+    """
+    delivered = delivery_data.groupby('ingredient_name', sort=False, as_index=False).agg(
+        delivered_ml=('delivered_ml', 'sum'),
+        delivered_price=('price_per_liter', 'last')
+    ).astype({'ingredient_name': object})
+
+    updated_inventory = inventory_data.astype({'ingredient_name': object}).merge(
+        delivered, on='ingredient_name', how='left')
+    updated_inventory.index = inventory_data.index
+    first_row = ~updated_inventory['ingredient_name'].duplicated()
+
+    updated_inventory['current_stock_ml'] = (updated_inventory['current_stock_ml'] +
+                                             updated_inventory['delivered_ml'].where(first_row).fillna(0))
+    updated_inventory['price_per_liter'] = updated_inventory['delivered_price'].fillna(
+        updated_inventory['price_per_liter'])
+    return updated_inventory.drop(columns=['delivered_ml', 'delivered_price'])
+
+def get_unknown_delivery_items(inventory_data, delivery_data):
+    """
+    List the delivered ingredients that are not in the inventory
+
+    Args:
+        inventory_data: Inventory DataFrame
+        delivery_data: DataFrame with ingredient_name
+
+    Returns:
+        pandas.DataFrame: The delivery rows of unknown ingredients
+    """
+    return delivery_data[~delivery_data['ingredient_name'].isin(inventory_data['ingredient_name'])].reset_index(drop=True)
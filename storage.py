@@ -0,0 +1,483 @@
+import json
+import queue
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    ingredient_name TEXT PRIMARY KEY,
+    current_stock_ml REAL NOT NULL DEFAULT 0,
+    price_per_liter REAL NOT NULL DEFAULT 0,
+    target_stock_ml REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS recipes (
+    drink_name TEXT NOT NULL,
+    ingredient_name TEXT NOT NULL,
+    amount_ml REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS allocation_groups (
+    group_name TEXT NOT NULL,
+    member_name TEXT NOT NULL,
+    amount_ml REAL,
+    weight REAL
+);
+CREATE TABLE IF NOT EXISTS substitution_groups (
+    group_name TEXT NOT NULL,
+    ingredient_name TEXT NOT NULL,
+    priority REAL
+);
+CREATE TABLE IF NOT EXISTS stock_ledger (
+    date TEXT NOT NULL,
+    ingredient_name TEXT NOT NULL,
+    movement_type TEXT NOT NULL,
+    amount_ml REAL NOT NULL DEFAULT 0,
+    reference TEXT
+);
+CREATE TABLE IF NOT EXISTS price_history (
+    ingredient_name TEXT NOT NULL,
+    effective_date TEXT NOT NULL,
+    price_per_liter REAL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS sales_reports (
+    report_id TEXT PRIMARY KEY,
+    report_date TEXT NOT NULL,
+    sales_data TEXT NOT NULL,
+    depletion_applied INTEGER NOT NULL DEFAULT 0,
+    stored_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS processed_files (
+    file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    file_mtime_ns INTEGER NOT NULL,
+    report_id TEXT,
+    z_number TEXT,
+    status TEXT NOT NULL,
+    processed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_files_by_name ON processed_files (file_name, file_size, file_mtime_ns);
+CREATE INDEX IF NOT EXISTS processed_files_by_hash ON processed_files (content_hash);
+CREATE TABLE IF NOT EXISTS store_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_version (id, version) VALUES (1, 0);
+"""
+
+# Spalten, die nach dem ersten Schema hinzugekommen sind, für bestehende Datenbanken: (Tabelle, Spalte, Definition)
+ADDED_COLUMNS = [
+    ('sales_reports', 'stored_version', 'INTEGER NOT NULL DEFAULT 0')
+]
+
+INVENTORY_COLUMNS = ['ingredient_name', 'current_stock_ml', 'price_per_liter', 'target_stock_ml']
+RECIPE_COLUMNS = ['drink_name', 'ingredient_name', 'amount_ml']
+ALLOCATION_GROUP_COLUMNS = ['group_name', 'member_name', 'amount_ml', 'weight']
+SUBSTITUTION_GROUP_COLUMNS = ['group_name', 'ingredient_name', 'priority']
+STOCK_LEDGER_COLUMNS = ['date', 'ingredient_name', 'movement_type', 'amount_ml', 'reference']
+PRICE_HISTORY_COLUMNS = ['ingredient_name', 'effective_date', 'price_per_liter', 'source']
+
+# Tabellen, die App, API und Report-Watcher gemeinsam pflegen ({Name der Tabelle: Spalten})
+STORED_FRAMES = {
+    'inventory': INVENTORY_COLUMNS,
+    'recipes': RECIPE_COLUMNS,
+    'allocation_groups': ALLOCATION_GROUP_COLUMNS,
+    'substitution_groups': SUBSTITUTION_GROUP_COLUMNS,
+    'stock_ledger': STOCK_LEDGER_COLUMNS,
+    'price_history': PRICE_HISTORY_COLUMNS
+}
+
+# Datumsspalten werden als ISO-Text gespeichert ({Name der Tabelle: Spalte})
+DATE_COLUMNS = {'stock_ledger': 'date', 'price_history': 'effective_date'}
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared between threads
+
+    Connections are opened once and handed out with connection(), so
+    requests do not pay for opening the database file each time.
+    """
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self._connections = queue.Queue(maxsize=size)
+
+        for _ in range(size):
+            conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            # WAL erlaubt gleichzeitiges Lesen, während geschrieben wird
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._connections.put(conn)
+
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            for table, column, definition in ADDED_COLUMNS:
+                if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; the transaction is committed (or rolled back on error) on return"""
+        conn = self._connections.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        """Close all connections of the pool"""
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+def _frame_rows(name, df):
+    """Get the rows of a frame to store (one row per ingredient in the inventory, dates as ISO text, missing as NULL)"""
+    frame = df[STORED_FRAMES[name]]
+    if name == 'inventory':
+        frame = frame.drop_duplicates('ingredient_name')
+    if name in DATE_COLUMNS:
+        column = DATE_COLUMNS[name]
+        frame = frame.assign(**{column: pd.to_datetime(frame[column]).map(
+            lambda value: value.isoformat() if pd.notna(value) else None)})
+    frame = frame.astype(object)
+    return list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
+
+def _replace_frame(conn, name, df):
+    """Replace the rows of a stored frame (None deletes them)"""
+    columns = STORED_FRAMES[name]
+    conn.execute(f"DELETE FROM {name}")
+    if df is not None:
+        conn.executemany(f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                         _frame_rows(name, df))
+
+def _read_frame(conn, name):
+    """Read a stored frame in the order it was stored (None if it has no rows)"""
+    df = pd.read_sql_query(f"SELECT {', '.join(STORED_FRAMES[name])} FROM {name} ORDER BY rowid", conn)
+    if df.empty:
+        return None
+    if name == 'allocation_groups':
+        df = df.astype({'amount_ml': float, 'weight': float})
+    elif name == 'substitution_groups':
+        df = df.astype({'priority': float})
+    elif name == 'stock_ledger':
+        df = df.astype({'amount_ml': float})
+    elif name == 'price_history':
+        df = df.astype({'price_per_liter': float})
+    if name in DATE_COLUMNS:
+        column = DATE_COLUMNS[name]
+        df[column] = pd.to_datetime(df[column], format='ISO8601').astype('datetime64[ns]')
+    return df
+
+def _get_version(conn):
+    """Get the version of the stored frames"""
+    return conn.execute("SELECT version FROM store_version").fetchone()[0]
+
+def _increase_version(conn):
+    """Increase the version of the stored frames after a change and return it"""
+    conn.execute("UPDATE store_version SET version = version + 1")
+    return _get_version(conn)
+
+def get_storage_version(pool):
+    """
+    Get the version of the stored frames (inventory, recipes, allocation and substitution groups,
+    stock ledger and price history) and day reports
+
+    Every change of one of them (by the app, the API or the report watcher)
+    increases the version, so a process can cheaply check whether it has to
+    load them again.
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        int: Version of the stored frames
+    """
+    with pool.connection() as conn:
+        return _get_version(conn)
+
+def load_frames(pool):
+    """
+    Load the stored frames (STORED_FRAMES) together with their version
+
+    All of them are read in one transaction, so they belong to the same version.
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        tuple: (version, {frame name: DataFrame or None})
+    """
+    with pool.connection() as conn:
+        conn.execute("BEGIN")
+        return _get_version(conn), {name: _read_frame(conn, name) for name in STORED_FRAMES}
+
+def save_frames(pool, frames, expected_version):
+    """
+    Replace stored frames if nobody has changed them since they were read (optimistic locking)
+
+    Args:
+        pool: ConnectionPool
+        frames: Dictionary {frame name: DataFrame} with names of STORED_FRAMES; None deletes a frame
+        expected_version: Version the change is based on
+
+    Returns:
+        int: Version after the change (None if the stored frames were changed in the meantime)
+    """
+    unknown_frames = set(frames) - set(STORED_FRAMES)
+    if unknown_frames:
+        raise ValueError(f"Unknown stored frames: {', '.join(sorted(unknown_frames))}")
+
+    with pool.connection() as conn:
+        # Schreibsperre vor dem Lesen der Version, damit niemand dazwischen schreiben kann
+        conn.execute("BEGIN IMMEDIATE")
+        if _get_version(conn) != expected_version:
+            return None
+        for name, df in frames.items():
+            _replace_frame(conn, name, df)
+        return _increase_version(conn)
+
+def save_inventory(pool, inventory_data):
+    """
+    Replace the stored inventory
+
+    Args:
+        pool: ConnectionPool
+        inventory_data: Inventory DataFrame
+    """
+    with pool.connection() as conn:
+        _replace_frame(conn, 'inventory', inventory_data)
+        _increase_version(conn)
+
+def load_inventory(pool):
+    """
+    Load the stored inventory
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        pandas.DataFrame: Inventory data (None if nothing is stored)
+    """
+    with pool.connection() as conn:
+        return _read_frame(conn, 'inventory')
+
+def save_recipes(pool, recipe_data):
+    """
+    Replace the stored recipes
+
+    Args:
+        pool: ConnectionPool
+        recipe_data: Recipe DataFrame
+    """
+    with pool.connection() as conn:
+        _replace_frame(conn, 'recipes', recipe_data)
+        _increase_version(conn)
+
+def load_recipes(pool):
+    """
+    Load the stored recipes
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        pandas.DataFrame: Recipe data (None if nothing is stored)
+    """
+    with pool.connection() as conn:
+        return _read_frame(conn, 'recipes')
+
+def save_allocation_groups(pool, allocation_groups):
+    """
+    Replace the stored allocation groups of generic POS products
+
+    Args:
+        pool: ConnectionPool
+        allocation_groups: Allocation groups DataFrame (see product_allocation.py)
+    """
+    with pool.connection() as conn:
+        _replace_frame(conn, 'allocation_groups', allocation_groups)
+        _increase_version(conn)
+
+def load_allocation_groups(pool):
+    """
+    Load the stored allocation groups
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        pandas.DataFrame: Allocation groups (None if nothing is stored)
+    """
+    with pool.connection() as conn:
+        return _read_frame(conn, 'allocation_groups')
+
+def load_substitution_groups(pool):
+    """
+    Load the stored substitution groups
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        pandas.DataFrame: Substitution groups (None if nothing is stored)
+    """
+    with pool.connection() as conn:
+        return _read_frame(conn, 'substitution_groups')
+
+def save_sales_report(pool, report_id, sales_data):
+    """
+    Store a processed day report (replacing a report with the same id)
+
+    Replacing a report keeps its depletion flag, so a re-imported report is
+    not deducted from the inventory a second time. The report is stored with
+    the new store version, so other processes load only the reports stored
+    since they last looked (see load_sales_reports).
+
+    Args:
+        pool: ConnectionPool
+        report_id: Unique id of the report
+        sales_data: Sales data dictionary from process_sales_data
+    """
+    with pool.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        version = _increase_version(conn)
+        conn.execute(
+            "INSERT INTO sales_reports (report_id, report_date, sales_data, stored_version) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(report_id) DO UPDATE SET report_date = excluded.report_date, "
+            "sales_data = excluded.sales_data, stored_version = excluded.stored_version",
+            (report_id, sales_data['date'], json.dumps(sales_data), version)
+        )
+
+def load_sales_reports(pool, since_version=None):
+    """
+    Load the stored day reports, oldest first
+
+    Args:
+        pool: ConnectionPool
+        since_version: Only load the reports stored after this store version (default: all reports)
+
+    Returns:
+        list: Tuples (report_id, sales_data)
+    """
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT report_id, sales_data FROM sales_reports WHERE stored_version > ? "
+                            "ORDER BY report_date, report_id",
+                            (-1 if since_version is None else since_version,)).fetchall()
+    return [(report_id, json.loads(sales_data)) for report_id, sales_data in rows]
+
+def is_depletion_applied(pool, report_id):
+    """
+    Check whether the depletion of a stored report has been applied
+
+    Args:
+        pool: ConnectionPool
+        report_id: Id of the stored report
+
+    Returns:
+        bool: True if the report was already deducted from the inventory
+    """
+    with pool.connection() as conn:
+        row = conn.execute("SELECT depletion_applied FROM sales_reports WHERE report_id = ?", (report_id,)).fetchone()
+    return bool(row and row[0])
+
+def deplete_stored_inventory(pool, report_id, deplete):
+    """
+    Deduct a stored report from the stored inventory exactly once
+
+    Reading the inventory, deducting the report, storing the result and
+    marking the report as applied happen in one write transaction, so a
+    change made by the app or another process in between is never
+    overwritten. If the report was already applied, nothing is changed.
+
+    Args:
+        pool: ConnectionPool
+        report_id: Id of the stored report
+        deplete: Function taking the stored inventory DataFrame and returning it after the depletion
+
+    Returns:
+        pandas.DataFrame: The stored inventory after the depletion (None if the report
+            was already applied or does not exist)
+
+    Raises:
+        Exception: If no inventory is stored or the depletion fails
+    """
+    with pool.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT depletion_applied FROM sales_reports WHERE report_id = ?", (report_id,)).fetchone()
+        if row is None or row[0]:
+            return None
+
+        inventory_data = _read_frame(conn, 'inventory')
+        if inventory_data is None:
+            raise Exception("No inventory stored")
+        updated_inventory = deplete(inventory_data)
+        if updated_inventory is None:
+            raise Exception("Failed to update inventory")
+
+        conn.execute("UPDATE sales_reports SET depletion_applied = 1 WHERE report_id = ?", (report_id,))
+        _replace_frame(conn, 'inventory', updated_inventory)
+        _increase_version(conn)
+        return updated_inventory
+
+def is_file_processed(pool, file_name, file_size, file_mtime_ns, content_hash=None):
+    """
+    Check the processed-file journal for a report file
+
+    A file is known if the same name, size and modification time was
+    journaled before, or (if given) a file with the same content hash.
+
+    Args:
+        pool: ConnectionPool
+        file_name: Name of the file
+        file_size: Size in bytes
+        file_mtime_ns: Modification time in nanoseconds
+        content_hash: SHA-256 of the file content (optional)
+
+    Returns:
+        bool: True if the file was already processed
+    """
+    with pool.connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM processed_files WHERE (file_name = ? AND file_size = ? AND file_mtime_ns = ?) "
+            "OR content_hash = ? LIMIT 1",
+            (file_name, file_size, file_mtime_ns, content_hash)
+        ).fetchone()
+    return row is not None
+
+def record_processed_file(pool, content_hash, file_name, file_size, file_mtime_ns, report_id, z_number, status):
+    """
+    Add a report file to the processed-file journal
+
+    Args:
+        pool: ConnectionPool
+        content_hash: SHA-256 of the file content
+        file_name: Name of the file
+        file_size: Size in bytes
+        file_mtime_ns: Modification time in nanoseconds
+        report_id: Id under which the report was stored (None if it failed)
+        z_number: Z number of the report
+        status: Outcome, e.g. 'applied', 'duplicate' or 'error: ...'
+    """
+    with pool.connection() as conn:
+        conn.execute(
+            "INSERT INTO processed_files (content_hash, file_name, file_size, file_mtime_ns, report_id, "
+            "z_number, status, processed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_hash, file_name, file_size, file_mtime_ns, report_id, z_number, status,
+             datetime.now().isoformat(timespec='seconds'))
+        )
+
+def load_processed_files(pool):
+    """
+    Load the processed-file journal, newest first
+
+    Args:
+        pool: ConnectionPool
+
+    Returns:
+        pandas.DataFrame: Journal entries
+    """
+    with pool.connection() as conn:
+        return pd.read_sql_query("SELECT * FROM processed_files ORDER BY file_id DESC", conn)
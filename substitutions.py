@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+
+from metrics import get_logger, log_error
+
+logger = get_logger('substitutions')
+
+SUBSTITUTION_COLUMNS = ['group_name', 'ingredient_name', 'priority']
+
+def create_substitution_groups():
+    """
+    Create an empty table of substitution groups
+
+    All ingredients of a group may replace each other 1:1 in every recipe,
+    e.g. one London Dry gin for another. Within a group, ingredients with a
+    lower priority are preferred as substitutes.
+
+    Returns:
+        pandas.DataFrame: Empty substitution groups
+    """
+    return pd.DataFrame({
+        'group_name': pd.Series(dtype=object),
+        'ingredient_name': pd.Series(dtype=object),
+        'priority': pd.Series(dtype=float)
+    })
+
+def build_substitute_index(substitution_groups):
+    """
+    Precompute the allowed substitutes of every ingredient
+
+    An ingredient in several groups may be replaced by the members of all
+    of them. Substitutes are ordered by priority, then by name.
+
+    Args:
+        substitution_groups: Substitution groups DataFrame
+
+    Returns:
+        pandas.DataFrame: ingredient_name, substitute_name and rank (0 = the ingredient itself)
+    """
+    try:
+        if substitution_groups is None or substitution_groups.empty:
+            return pd.DataFrame({'ingredient_name': pd.Series(dtype=object),
+                                 'substitute_name': pd.Series(dtype=object),
+                                 'rank': pd.Series(dtype=int)})
+
+        groups = substitution_groups.dropna(subset=['group_name', 'ingredient_name']).astype(
+            {'group_name': object, 'ingredient_name': object})
+        groups = groups.assign(priority=pd.to_numeric(groups['priority'], errors='coerce').fillna(0))
+
+        # Alle Paare innerhalb einer Gruppe; bei mehreren Gruppen zählt die beste Priorität
+        pairs = groups.merge(groups, on='group_name', suffixes=('', '_substitute'))
+        pairs = pairs[pairs['ingredient_name'] != pairs['ingredient_name_substitute']]
+        pairs = pairs.rename(columns={'ingredient_name_substitute': 'substitute_name'})
+        pairs = pairs.groupby(['ingredient_name', 'substitute_name'], as_index=False)['priority_substitute'].min()
+        pairs = pairs.sort_values(['ingredient_name', 'priority_substitute', 'substitute_name'])
+        pairs['rank'] = pairs.groupby('ingredient_name').cumcount() + 1
+
+        own = pd.DataFrame({'ingredient_name': groups['ingredient_name'].unique()})
+        own = own.assign(substitute_name=own['ingredient_name'], rank=0)
+
+        index = pd.concat([own, pairs[['ingredient_name', 'substitute_name', 'rank']]], ignore_index=True)
+        return index.sort_values(['ingredient_name', 'rank']).reset_index(drop=True)
+
+    except Exception as e:
+        raise Exception(f"Error building substitute index: {str(e)}")
+
+def get_substitutes(substitute_index, ingredient_name):
+    """
+    Get the allowed substitutes of an ingredient, preferred ones first
+
+    Args:
+        substitute_index: Result of build_substitute_index
+        ingredient_name: Name of the ingredient
+
+    Returns:
+        list: Names of the substitutes
+    """
+    substitutes = substitute_index[(substitute_index['ingredient_name'] == ingredient_name)
+                                   & (substitute_index['rank'] > 0)]
+    return substitutes['substitute_name'].tolist()
+
+def calculate_available_drinks_with_substitutes(recipe_data, inventory_data, substitute_index, sales_velocity=None):
+    """
+    Calculate how many of each drink can be made when substitutes may be used
+
+    All recipe lines are expanded with their substitutes and joined with the
+    stock in one batched pass. A recipe line can draw on the pooled stock of
+    its ingredient and all of its substitutes; lines of one drink that draw on
+    the same pool share its stock. If the ingredient itself is not enough for
+    one drink, the preferred substitute in stock is reported.
+
+    With a sales velocity, the days until a drink can no longer be made are
+    the pooled stock of each recipe line divided by the daily usage of that
+    pool by all drinks.
+
+    Args:
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        substitute_index: Result of build_substitute_index
+        sales_velocity: Optional dictionary {drink name: drinks sold per day}
+
+    Returns:
+        pandas.DataFrame: drink_name, max_drinks_possible (without substitutes),
+            max_drinks_with_substitutes, limiting_ingredient, substitutions and days_remaining
+    """
+    try:
+        lines = recipe_data[recipe_data['amount_ml'] > 0][['drink_name', 'ingredient_name', 'amount_ml']].astype(
+            {'drink_name': object, 'ingredient_name': object}).reset_index(drop=True)
+        lines['line'] = np.arange(len(lines))
+        stock = inventory_data.drop_duplicates('ingredient_name').astype({'ingredient_name': object}).set_index(
+            'ingredient_name')['current_stock_ml']
+
+        # Jede Rezeptzeile mit sich selbst (Rang 0) und ihren Ersatzzutaten verbinden
+        index = substitute_index[['ingredient_name', 'substitute_name', 'rank']].astype(
+            {'ingredient_name': object, 'substitute_name': object})
+        candidates = lines.merge(index, on='ingredient_name', how='left')
+        own = candidates['substitute_name'].isna()
+        candidates.loc[own, 'substitute_name'] = candidates.loc[own, 'ingredient_name']
+        candidates.loc[own, 'rank'] = 0
+        candidates['stock_ml'] = candidates['substitute_name'].map(stock)
+        candidates['in_inventory'] = candidates['stock_ml'].notna()
+        candidates['stock_ml'] = candidates['stock_ml'].fillna(0)
+
+        own_candidates = candidates[candidates['rank'] == 0].set_index('line')
+        lines['own_stock_ml'] = own_candidates['stock_ml'].reindex(lines['line']).to_numpy()
+        lines['own_in_inventory'] = own_candidates['in_inventory'].reindex(lines['line']).to_numpy()
+        lines['pooled_stock_ml'] = candidates.groupby('line')['stock_ml'].sum().reindex(lines['line']).to_numpy()
+        lines['own_drinks'] = np.where(lines['own_in_inventory'], lines['own_stock_ml'] / lines['amount_ml'], 0)
+
+        # Rezeptzeilen eines Drinks, die aus demselben Pool schöpfen (z.B. zwei Rums einer Gruppe),
+        # teilen sich dessen Bestand: Bedarf pro Drink und Pool zusammenfassen
+        lines['pool'] = candidates.sort_values('substitute_name').groupby('line')['substitute_name'].agg(
+            tuple).reindex(lines['line']).to_numpy()
+        pool_amount = lines.groupby(['drink_name', 'pool'], sort=False)['amount_ml'].transform('sum')
+        lines['pooled_drinks'] = lines['pooled_stock_ml'] / pool_amount
+
+        # Bevorzugte Ersatzzutat, wenn die eigene Zutat nicht für einen Drink reicht
+        usable = candidates[(candidates['rank'] > 0) & (candidates['stock_ml'] >= candidates['amount_ml'])]
+        preferred = usable.sort_values(['line', 'rank']).drop_duplicates('line').set_index('line')['substitute_name']
+        lines['substitute'] = lines['line'].map(preferred)
+        lines.loc[lines['own_drinks'] >= 1, 'substitute'] = np.nan
+
+        if sales_velocity:
+            # Tagesverbrauch pro Zutat, dann pro Pool (Zutat + Ersatzzutaten) der Rezeptzeile
+            velocity = lines['drink_name'].map(sales_velocity).fillna(0)
+            daily_usage = (lines['amount_ml'] * velocity).groupby(lines['ingredient_name']).sum()
+            candidates['usage_ml'] = candidates['substitute_name'].map(daily_usage).fillna(0)
+            pooled_usage = candidates.groupby('line')['usage_ml'].sum().reindex(lines['line']).to_numpy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                lines['days_remaining'] = np.where(pooled_usage > 0, lines['pooled_stock_ml'] / pooled_usage, np.inf)
+        else:
+            lines['days_remaining'] = np.inf
+
+        by_drink = lines.groupby('drink_name', sort=False)
+        limiting = lines.loc[by_drink['pooled_drinks'].idxmin()].set_index('drink_name')
+        missing = ~limiting['own_in_inventory'] & (limiting['pooled_stock_ml'] == 0)
+        limiting.loc[missing, 'ingredient_name'] = limiting.loc[missing, 'ingredient_name'] + " (not in inventory)"
+
+        used = lines.dropna(subset=['substitute'])
+        substitutions = (used['ingredient_name'].astype(str) + " → " + used['substitute'].astype(str)).groupby(
+            used['drink_name']).agg(", ".join)
+
+        drink_order = pd.Index(recipe_data['drink_name'].astype(object).unique())
+        result = pd.DataFrame({
+            'max_drinks_possible': by_drink['own_drinks'].min(),
+            'max_drinks_with_substitutes': by_drink['pooled_drinks'].min(),
+            'limiting_ingredient': limiting['ingredient_name'],
+            'substitutions': substitutions,
+            'days_remaining': by_drink['days_remaining'].min()
+        }).reindex(drink_order)
+
+        # Drinks ohne Zutatenmengen erscheinen mit 0 Drinks
+        result['max_drinks_possible'] = result['max_drinks_possible'].fillna(0).astype(int)
+        result['max_drinks_with_substitutes'] = result['max_drinks_with_substitutes'].fillna(0).astype(int)
+        result['substitutions'] = result['substitutions'].fillna("")
+        result['days_remaining'] = result['days_remaining'].replace(np.inf, np.nan)
+
+        return result.rename_axis('drink_name').reset_index()
+
+    except Exception as e:
+        log_error(logger, "Error calculating available drinks with substitutes", e)
+        return None
+
+def deplete_with_substitutes(inventory_data, usage, substitute_index):
+    """
+    Deduct ingredient usage from the inventory, drawing shortfalls from substitutes
+
+    Every ingredient is first taken from its own stock. What its own stock
+    cannot cover is taken from its substitutes in order of preference, after
+    their own usage has been deducted. Usage that no stock covers is dropped
+    (the stock stays at 0), as without substitutes.
+
+    Args:
+        inventory_data: Inventory DataFrame (the first row of each ingredient is deducted)
+        usage: pandas.Series {ingredient name: ml used}
+        substitute_index: Result of build_substitute_index
+
+    Returns:
+        tuple: (updated inventory DataFrame, ingredients without stock or substitute in the inventory)
+    """
+    first_rows = inventory_data.dropna(subset=['ingredient_name']).drop_duplicates('ingredient_name')
+    stock = dict(zip(first_rows['ingredient_name'], first_rows['current_stock_ml'].astype(float)))
+    usage = usage.groupby(level=0).sum()
+
+    # Erst der eigene Bestand jeder Zutat
+    remaining = dict(stock)
+    shortfall = {}
+    for ingredient_name, amount in usage.items():
+        own_stock = stock.get(ingredient_name)
+        if own_stock is None:
+            shortfall[ingredient_name] = amount
+        else:
+            remaining[ingredient_name] = max(0.0, own_stock - amount)
+            if amount > max(own_stock, 0):
+                shortfall[ingredient_name] = amount - max(own_stock, 0)
+
+    # Dann die Ersatzzutaten nach Priorität, mit dem, was nach ihrem eigenen Verbrauch übrig ist
+    substitutes = substitute_index[(substitute_index['rank'] > 0)
+                                   & substitute_index['ingredient_name'].isin(list(shortfall))]
+    missing = [name for name in shortfall
+               if name not in stock and not substitutes.loc[substitutes['ingredient_name'] == name,
+                                                            'substitute_name'].isin(list(stock)).any()]
+    for ingredient_name, substitute_name in zip(substitutes['ingredient_name'], substitutes['substitute_name']):
+        taken = min(shortfall[ingredient_name], remaining.get(substitute_name, 0.0))
+        if taken > 0:
+            remaining[substitute_name] -= taken
+            shortfall[ingredient_name] -= taken
+
+    updated_inventory = inventory_data.copy()
+    new_stock = first_rows['ingredient_name'].map(remaining).to_numpy()
+    updated_inventory.loc[first_rows.index, 'current_stock_ml'] = new_stock
+    return updated_inventory, missing
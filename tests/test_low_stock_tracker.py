@@ -0,0 +1,132 @@
+import random
+
+import pandas as pd
+import pytest
+
+from low_stock_tracker import (
+    create_low_stock_tracker, update_tracker_stock, apply_stock_movements, set_tracker_thresholds,
+    set_tracker_velocity, get_urgent_warnings, get_warning_count
+)
+
+@pytest.fixture
+def recipes():
+    return pd.DataFrame({
+        'drink_name': ['Daiquiri', 'Daiquiri', 'Mojito', 'Mojito', 'Mojito', 'Cuba Libre', 'Cuba Libre'],
+        'ingredient_name': ['Rum', 'Limettensaft', 'Rum', 'Limettensaft', 'Minze', 'Rum', 'Cola'],
+        'amount_ml': [60.0, 30.0, 50.0, 20.0, 10.0, 40.0, 120.0]
+    })
+
+@pytest.fixture
+def inventory():
+    return pd.DataFrame({
+        'ingredient_name': ['Rum', 'Limettensaft', 'Minze', 'Cola'],
+        'current_stock_ml': [600.0, 300.0, 100.0, 6000.0],
+        'target_stock_ml': [3000.0, 1000.0, 500.0, 6000.0]
+    })
+
+def assert_heap_order(tracker):
+    """Check the min-heap property and that every position points at its entry"""
+    heap = tracker['heap']
+    for i, (priority, ingredient_name) in enumerate(heap):
+        assert tracker['positions'][ingredient_name] == i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < len(heap):
+                assert priority <= heap[child][0]
+    assert len(tracker['positions']) == len(heap) == len(tracker['warnings'])
+
+def rebuilt_warnings(tracker, recipes, inventory):
+    """Warnings of a tracker built from scratch with the same thresholds and velocity"""
+    fresh = create_low_stock_tracker(recipes, inventory, tracker['default_threshold'],
+                                     tracker['ingredient_thresholds'], tracker['drink_thresholds'],
+                                     tracker['velocity'])
+    return get_urgent_warnings(fresh)
+
+def test_warnings_are_ordered_by_days_remaining(recipes, inventory):
+    velocity = {'Daiquiri': 2, 'Mojito': 4, 'Cuba Libre': 1}
+    tracker = create_low_stock_tracker(recipes, inventory, default_threshold=15, sales_velocity=velocity)
+
+    warnings = get_urgent_warnings(tracker)
+    # Rum: 600 / (2*60 + 4*50 + 1*40) = 1.67 Tage, Limette: 300 / (2*30 + 4*20) = 2.14, Minze: 100 / 40 = 2.5
+    assert [w['ingredient_name'] for w in warnings] == ['Rum', 'Limettensaft', 'Minze']
+    assert warnings[0]['days_remaining'] == pytest.approx(600 / 360)
+    assert get_warning_count(tracker) == 3
+    assert_heap_order(tracker)
+
+def test_ties_and_ingredients_without_sales(recipes, inventory):
+    tracker = create_low_stock_tracker(recipes, inventory, sales_velocity={'Daiquiri': 2})
+
+    warnings = get_urgent_warnings(tracker)
+    # Rum und Limette reichen beide 5 Tage und 10 Drinks, dann entscheidet der Name; Minze ohne Verkäufe zuletzt
+    assert [w['ingredient_name'] for w in warnings] == ['Limettensaft', 'Rum', 'Minze']
+    assert [w['days_remaining'] for w in warnings] == [pytest.approx(5), pytest.approx(5), None]
+
+def test_get_urgent_warnings_returns_the_top_n(recipes, inventory):
+    tracker = create_low_stock_tracker(recipes, inventory, sales_velocity={'Daiquiri': 2, 'Mojito': 4})
+
+    all_warnings = get_urgent_warnings(tracker)
+    for n in range(len(all_warnings) + 2):
+        assert get_urgent_warnings(tracker, n) == all_warnings[:n]
+
+def test_stock_update_moves_and_removes_ingredients(recipes, inventory):
+    tracker = create_low_stock_tracker(recipes, inventory, sales_velocity={'Daiquiri': 2, 'Mojito': 4})
+
+    # Lieferung Rum: keine Warnung mehr, Minze wird knapper
+    delivered = inventory.copy()
+    delivered.loc[delivered['ingredient_name'] == 'Rum', 'current_stock_ml'] = 5000.0
+    delivered.loc[delivered['ingredient_name'] == 'Minze', 'current_stock_ml'] = 20.0
+    assert update_tracker_stock(tracker, delivered) == 2
+    assert_heap_order(tracker)
+    assert [w['ingredient_name'] for w in get_urgent_warnings(tracker)] == ['Minze', 'Limettensaft']
+    assert get_urgent_warnings(tracker) == rebuilt_warnings(tracker, recipes, delivered)
+
+    # Abbuchung: Rum wird wieder knapp und kommt vor Minze zurück in die Warteschlange
+    apply_stock_movements(tracker, {'Rum': -4900.0})
+    delivered.loc[delivered['ingredient_name'] == 'Rum', 'current_stock_ml'] = 100.0
+    assert_heap_order(tracker)
+    assert get_urgent_warnings(tracker)[0]['ingredient_name'] == 'Rum'
+    assert get_urgent_warnings(tracker) == rebuilt_warnings(tracker, recipes, delivered)
+
+def test_thresholds_and_velocity_update_the_order(recipes, inventory):
+    tracker = create_low_stock_tracker(recipes, inventory, sales_velocity={'Daiquiri': 2, 'Mojito': 4})
+
+    # Cola (50 Cuba Libre) wird erst mit höherer Drink-Schwelle gewarnt, ohne Verkäufe zuletzt
+    set_tracker_thresholds(tracker, drink_thresholds={'Cuba Libre': 60})
+    warnings = get_urgent_warnings(tracker)
+    assert [w['ingredient_name'] for w in warnings] == ['Rum', 'Limettensaft', 'Minze', 'Cola']
+    assert warnings[-1]['threshold_drinks'] == 60
+    assert_heap_order(tracker)
+
+    # Nur noch Cuba Libre verkauft: Cola (5 Tage) rückt vor die Zutaten ohne Verkäufe
+    set_tracker_velocity(tracker, {'Cuba Libre': 10})
+    assert_heap_order(tracker)
+    assert [w['ingredient_name'] for w in get_urgent_warnings(tracker)] == ['Rum', 'Cola', 'Limettensaft', 'Minze']
+    assert get_urgent_warnings(tracker) == rebuilt_warnings(tracker, recipes, inventory)
+
+    set_tracker_thresholds(tracker, drink_thresholds={})
+    assert 'Cola' not in [w['ingredient_name'] for w in get_urgent_warnings(tracker)]
+    assert_heap_order(tracker)
+
+def test_random_updates_keep_heap_order_and_match_a_rebuild():
+    rng = random.Random(42)
+    ingredients = [f"Zutat {i}" for i in range(40)]
+    drinks = [f"Drink {i}" for i in range(25)]
+    recipes = pd.DataFrame([
+        {'drink_name': drink, 'ingredient_name': ingredient, 'amount_ml': float(rng.choice([10, 20, 40, 60]))}
+        for drink in drinks for ingredient in rng.sample(ingredients, 3)
+    ])
+    inventory = pd.DataFrame({
+        'ingredient_name': ingredients,
+        'current_stock_ml': [float(rng.randint(0, 2000)) for _ in ingredients],
+        'target_stock_ml': 1000.0
+    })
+    velocity = {drink: rng.randint(0, 10) for drink in drinks}
+    tracker = create_low_stock_tracker(recipes, inventory, sales_velocity=velocity)
+
+    for _ in range(200):
+        ingredient = rng.choice(ingredients)
+        stock = float(rng.randint(0, 2000))
+        inventory.loc[inventory['ingredient_name'] == ingredient, 'current_stock_ml'] = stock
+        update_tracker_stock(tracker, inventory)
+        assert_heap_order(tracker)
+
+    assert get_urgent_warnings(tracker) == rebuilt_warnings(tracker, recipes, inventory)
@@ -0,0 +1,127 @@
+import pandas as pd
+import pytest
+
+from snapshots import (
+    create_version_store, commit_version, get_current_version, get_version_frames, can_undo, can_redo,
+    undo, redo, list_versions, diff_versions
+)
+
+@pytest.fixture
+def inventory():
+    return pd.DataFrame({
+        'ingredient_name': ['Rum', 'Limettensaft', 'Zuckersirup'],
+        'current_stock_ml': [3000.0, 1000.0, 500.0],
+        'price_per_liter': [20.0, 8.0, 5.0]
+    })
+
+@pytest.fixture
+def recipes():
+    return pd.DataFrame({
+        'drink_name': ['Daiquiri', 'Daiquiri', 'Daiquiri'],
+        'ingredient_name': ['Rum', 'Limettensaft', 'Zuckersirup'],
+        'amount_ml': [60.0, 30.0, 15.0]
+    })
+
+def with_stock(inventory, ingredient_name, stock):
+    """Copy of the inventory with one changed stock"""
+    changed = inventory.copy()
+    changed.loc[changed['ingredient_name'] == ingredient_name, 'current_stock_ml'] = stock
+    return changed
+
+def test_undo_and_redo_restore_the_frames(inventory, recipes):
+    store = create_version_store()
+    commit_version(store, {'inventory': inventory, 'recipes': recipes}, "Demo-Daten geladen")
+    changed = with_stock(inventory, 'Rum', 2000.0)
+    commit_version(store, {'inventory': changed}, "Lagerbestand bearbeitet")
+
+    assert can_undo(store) and not can_redo(store)
+    frames = undo(store)
+    pd.testing.assert_frame_equal(frames['inventory'], inventory)
+    pd.testing.assert_frame_equal(frames['recipes'], recipes)
+    assert not can_undo(store) and can_redo(store)
+    assert undo(store) is None
+
+    frames = redo(store)
+    pd.testing.assert_frame_equal(frames['inventory'], changed)
+    pd.testing.assert_frame_equal(frames['recipes'], recipes)
+    assert redo(store) is None
+
+def test_unchanged_commit_creates_no_version(inventory, recipes):
+    store = create_version_store()
+    version_id = commit_version(store, {'inventory': inventory, 'recipes': recipes})
+
+    assert commit_version(store, {'inventory': inventory.copy()}) == version_id
+    assert len(list_versions(store)) == 1
+
+def test_commit_after_undo_discards_redo_branch(inventory, recipes):
+    store = create_version_store()
+    commit_version(store, {'inventory': inventory, 'recipes': recipes})
+    commit_version(store, {'inventory': with_stock(inventory, 'Rum', 2000.0)})
+    undo(store)
+    commit_version(store, {'inventory': with_stock(inventory, 'Rum', 1000.0)})
+
+    assert not can_redo(store)
+    assert len(store['versions']) == 2
+    assert get_version_frames(store)['inventory'].loc[0, 'current_stock_ml'] == 1000.0
+
+def test_unchanged_columns_share_blocks(inventory, recipes):
+    store = create_version_store()
+    first = commit_version(store, {'inventory': inventory, 'recipes': recipes})
+    second = commit_version(store, {'inventory': with_stock(inventory, 'Rum', 2000.0)})
+
+    first_layout = store['versions'][0]['frames']
+    second_layout = store['versions'][1]['frames']
+    assert second_layout['recipes'] == first_layout['recipes']
+    # Nur die Bestandsspalte bekommt einen neuen Block
+    changed_blocks = [old != new for old, new in zip(first_layout['inventory']['block_ids'],
+                                                      second_layout['inventory']['block_ids'])]
+    assert changed_blocks == [False, True, False]
+
+    changes = diff_versions(store, first, second, 'inventory', 'ingredient_name')
+    assert changes[['ingredient_name', 'column', 'old_value', 'new_value']].values.tolist() == [
+        ['Rum', 'current_stock_ml', 3000.0, 2000.0]
+    ]
+
+def test_restored_frames_are_read_only(inventory, recipes):
+    store = create_version_store()
+    commit_version(store, {'inventory': inventory, 'recipes': recipes})
+
+    frames = get_version_frames(store)
+    with pytest.raises(ValueError):
+        frames['inventory']['current_stock_ml'].to_numpy()[0] = 0.0
+
+def test_discarded_versions_release_their_blocks(inventory, recipes):
+    store = create_version_store()
+    commit_version(store, {'inventory': inventory, 'recipes': recipes})
+    commit_version(store, {'inventory': with_stock(inventory, 'Rum', 2000.0)})
+    undo(store)
+    blocks_before = set(store['blocks'])
+
+    # Der Redo-Zweig wird verworfen, sein Bestandsblock hat keine Referenz mehr
+    commit_version(store, {'inventory': with_stock(inventory, 'Rum', 1000.0)})
+    discarded = blocks_before - set(store['blocks'])
+    assert len(discarded) == 1
+    assert set(store['block_refs']) == set(store['blocks'])
+
+    # Die Referenzen zählen die Versionen, die einen Block verwenden
+    for block_id, refs in store['block_refs'].items():
+        used_by = sum(block_id in layout['block_ids'] + [layout['index_block_id']]
+                      for version in store['versions'] for layout in version['frames'].values())
+        assert refs == used_by
+
+def test_oldest_versions_are_dropped_at_the_limit(inventory, recipes):
+    store = create_version_store(max_versions=3)
+    commit_version(store, {'inventory': inventory, 'recipes': recipes}, "Basis")
+    for stock in (2000.0, 1500.0, 1000.0):
+        commit_version(store, {'inventory': with_stock(inventory, 'Rum', stock)}, f"Rum {stock}")
+
+    versions = list_versions(store)
+    assert versions['label'].tolist() == ["Rum 2000.0", "Rum 1500.0", "Rum 1000.0"]
+    assert versions['current'].tolist() == [False, False, True]
+    assert get_current_version(store)['label'] == "Rum 1000.0"
+
+    # Der Block des ersten Bestands (3000 ml) wird von keiner Version mehr verwendet
+    used_blocks = {block_id for version in store['versions'] for layout in version['frames'].values()
+                   for block_id in layout['block_ids'] + [layout['index_block_id']]}
+    assert set(store['blocks']) == used_blocks
+    assert sum(undo(store) is not None for _ in range(3)) == 2
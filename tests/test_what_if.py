@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from what_if import evaluate_scenarios, scenarios_from_table, summarize_scenarios, SCENARIO_COLUMNS
+
+@pytest.fixture
+def recipes():
+    return pd.DataFrame({
+        'drink_name': ['Daiquiri', 'Daiquiri', 'Daiquiri', 'Mojito', 'Mojito', 'Mojito'],
+        'ingredient_name': ['Rum', 'Limettensaft', 'Zuckersirup', 'Rum', 'Limettensaft', 'Minze'],
+        'amount_ml': [60.0, 30.0, 15.0, 50.0, 20.0, 10.0]
+    })
+
+@pytest.fixture
+def inventory():
+    return pd.DataFrame({
+        'ingredient_name': ['Rum', 'Limettensaft', 'Zuckersirup', 'Minze'],
+        'current_stock_ml': [3000.0, 1000.0, 500.0, 200.0],
+        'price_per_liter': [20.0, 8.0, 5.0, 30.0]
+    })
+
+@pytest.fixture
+def drink_sales():
+    # Bruttopreise mit 19 % MwSt: 8,00 und 9,00 EUR netto
+    return pd.DataFrame({
+        'drink_name': ['Daiquiri', 'Mojito'],
+        'quantity': [100.0, 50.0],
+        'sale_price': [9.52, 10.71]
+    })
+
+def get_row(results, scenario, name, key='drink_name'):
+    """Get the result row of one drink or ingredient in a scenario"""
+    rows = results[(results['scenario'] == scenario) & (results[key] == name)]
+    assert len(rows) == 1
+    return rows.iloc[0]
+
+def test_base_row_matches_the_menu_and_has_no_deltas(recipes, inventory, drink_sales):
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [{'name': 'Rum teurer',
+                                                                   'ingredient_prices': {'Rum': 30.0}}], drink_sales)
+
+    daiquiri = get_row(drinks, 'Basis', 'Daiquiri')
+    assert daiquiri['unit_cost'] == pytest.approx(60 * 0.02 + 30 * 0.008 + 15 * 0.005)
+    assert daiquiri['unit_margin'] == pytest.approx(8.0 - 1.515)
+    assert daiquiri['contribution_margin'] == pytest.approx((8.0 - 1.515) * 100)
+    assert daiquiri['ingredient_demand_ml'] == pytest.approx(105 * 100)
+    assert get_row(ingredients, 'Basis', 'Rum', 'ingredient_name')['demand_ml'] == pytest.approx(60 * 100 + 50 * 50)
+
+    base_drinks = drinks[drinks['scenario'] == 'Basis']
+    base_ingredients = ingredients[ingredients['scenario'] == 'Basis']
+    for column in ['unit_cost_delta', 'unit_margin_delta', 'contribution_margin_delta', 'ingredient_demand_delta_ml']:
+        assert (base_drinks[column] == 0).all()
+    for column in ['demand_delta_ml', 'cost_delta']:
+        assert (base_ingredients[column] == 0).all()
+
+def test_ingredient_price_changes_cost_but_not_demand(recipes, inventory, drink_sales):
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [{'name': 'Rum teurer',
+                                                                   'ingredient_prices': {'Rum': 30.0}}], drink_sales)
+
+    daiquiri = get_row(drinks, 'Rum teurer', 'Daiquiri')
+    assert daiquiri['unit_cost_delta'] == pytest.approx(60 * 0.01)
+    assert daiquiri['contribution_margin_delta'] == pytest.approx(-60 * 0.01 * 100)
+    assert daiquiri['ingredient_demand_delta_ml'] == 0
+    rum = get_row(ingredients, 'Rum teurer', 'Rum', 'ingredient_name')
+    assert rum['demand_delta_ml'] == 0
+    assert rum['cost_delta'] == pytest.approx((60 * 100 + 50 * 50) * 0.01)
+
+def test_recipe_change_only_affects_the_changed_drink(recipes, inventory, drink_sales):
+    scenario = {'name': 'Weniger Rum', 'recipe_changes': {'Daiquiri': {'Rum': 45.0, 'Minze': 5.0}}}
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [scenario], drink_sales)
+
+    daiquiri = get_row(drinks, 'Weniger Rum', 'Daiquiri')
+    assert daiquiri['unit_cost_delta'] == pytest.approx(-15 * 0.02 + 5 * 0.03)
+    assert daiquiri['ingredient_demand_delta_ml'] == pytest.approx(-10 * 100)
+    assert daiquiri['contribution_margin_delta'] == pytest.approx((15 * 0.02 - 5 * 0.03) * 100)
+
+    mojito = get_row(drinks, 'Weniger Rum', 'Mojito')
+    assert mojito['unit_cost_delta'] == 0 and mojito['contribution_margin_delta'] == 0
+
+    assert get_row(ingredients, 'Weniger Rum', 'Rum', 'ingredient_name')['demand_delta_ml'] == pytest.approx(-1500)
+    assert get_row(ingredients, 'Weniger Rum', 'Minze', 'ingredient_name')['demand_delta_ml'] == pytest.approx(500)
+
+def test_removing_an_ingredient_with_amount_zero(recipes, inventory, drink_sales):
+    scenario = {'name': 'Ohne Sirup', 'recipe_changes': {'Daiquiri': {'Zuckersirup': 0.0}}}
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [scenario], drink_sales)
+
+    assert get_row(drinks, 'Ohne Sirup', 'Daiquiri')['unit_cost_delta'] == pytest.approx(-15 * 0.005)
+    sirup = get_row(ingredients, 'Ohne Sirup', 'Zuckersirup', 'ingredient_name')
+    assert sirup['demand_ml'] == 0
+    assert sirup['demand_delta_ml'] == pytest.approx(-15 * 100)
+
+def test_added_drink_is_only_on_the_scenario_menu(recipes, inventory, drink_sales):
+    scenario = {
+        'name': 'Cuba Libre',
+        'added_drinks': {'Cuba Libre': {'Rum': 40.0, 'Cola': 120.0}},
+        'ingredient_prices': {'Cola': 2.0},
+        'sale_prices': {'Cuba Libre': 8.33},
+        'quantities': {'Cuba Libre': 30}
+    }
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [scenario], drink_sales)
+
+    base = get_row(drinks, 'Basis', 'Cuba Libre')
+    assert not base['active'] and base['quantity'] == 0 and np.isnan(base['unit_cost'])
+    assert base['contribution_margin'] == 0
+
+    added = get_row(drinks, 'Cuba Libre', 'Cuba Libre')
+    unit_cost = 40 * 0.02 + 120 * 0.002
+    assert added['active'] and added['quantity'] == 30
+    assert added['unit_cost'] == pytest.approx(unit_cost)
+    assert added['contribution_margin'] == pytest.approx((8.33 / 1.19 - unit_cost) * 30)
+    assert added['contribution_margin_delta'] == pytest.approx(added['contribution_margin'])
+
+    cola = get_row(ingredients, 'Cuba Libre', 'Cola', 'ingredient_name')
+    assert cola['demand_delta_ml'] == pytest.approx(120 * 30)
+    assert get_row(ingredients, 'Basis', 'Cola', 'ingredient_name')['demand_ml'] == 0
+
+def test_removed_drink_loses_its_margin_and_demand(recipes, inventory, drink_sales):
+    drinks, ingredients = evaluate_scenarios(recipes, inventory, [{'name': 'Ohne Mojito',
+                                                                   'removed_drinks': ['Mojito']}], drink_sales)
+
+    base = get_row(drinks, 'Basis', 'Mojito')
+    removed = get_row(drinks, 'Ohne Mojito', 'Mojito')
+    assert not removed['active'] and removed['quantity'] == 0
+    assert removed['contribution_margin'] == 0
+    assert removed['contribution_margin_delta'] == pytest.approx(-base['contribution_margin'])
+    assert removed['ingredient_demand_delta_ml'] == pytest.approx(-80 * 50)
+
+    minze = get_row(ingredients, 'Ohne Mojito', 'Minze', 'ingredient_name')
+    assert minze['demand_delta_ml'] == pytest.approx(-10 * 50)
+    assert minze['cost_delta'] == pytest.approx(-10 * 50 * 0.03)
+    assert get_row(drinks, 'Ohne Mojito', 'Daiquiri')['contribution_margin_delta'] == 0
+
+def test_batch_gives_the_same_results_as_single_scenarios(recipes, inventory, drink_sales):
+    scenarios = [
+        {'name': 'Rum teurer', 'ingredient_prices': {'Rum': 30.0}},
+        {'name': 'Weniger Rum', 'recipe_changes': {'Daiquiri': {'Rum': 45.0}}},
+        {'name': 'Ohne Mojito', 'removed_drinks': ['Mojito']},
+        {'name': 'Mojito günstiger', 'sale_prices': {'Mojito': 9.0}, 'quantities': {'Mojito': 80}}
+    ]
+    drinks, _ = evaluate_scenarios(recipes, inventory, scenarios, drink_sales)
+
+    for scenario in scenarios:
+        single, _ = evaluate_scenarios(recipes, inventory, [scenario], drink_sales)
+        pd.testing.assert_frame_equal(
+            drinks[drinks['scenario'] == scenario['name']].reset_index(drop=True),
+            single[single['scenario'] == scenario['name']].reset_index(drop=True)
+        )
+
+    summary = summarize_scenarios(drinks).set_index('scenario')
+    assert summary.loc['Basis', 'contribution_margin_delta'] == 0
+    assert summary.loc['Ohne Mojito', 'drinks'] == 1
+    assert summary.loc['Mojito günstiger', 'contribution_margin_delta'] == pytest.approx(
+        (9.0 / 1.19 - 1.46) * 80 - (9.0 - 1.46) * 50)
+
+def test_scenario_table_gives_the_same_scenarios():
+    table = pd.DataFrame([
+        ['Cuba Libre', 'add_drink', 'Cuba Libre', 'Rum', 40],
+        ['Cuba Libre', 'add_drink', 'Cuba Libre', 'Cola', 120],
+        ['Cuba Libre', 'quantity', 'Cuba Libre', None, 30],
+        ['Ohne Mojito', 'remove_drink', 'Mojito', None, None],
+        ['Weniger Rum', 'recipe_amount', 'Daiquiri', 'Rum', 45]
+    ], columns=SCENARIO_COLUMNS)
+
+    assert scenarios_from_table(table) == [
+        {'name': 'Cuba Libre', 'added_drinks': {'Cuba Libre': {'Rum': 40.0, 'Cola': 120.0}},
+         'quantities': {'Cuba Libre': 30.0}},
+        {'name': 'Ohne Mojito', 'removed_drinks': ['Mojito']},
+        {'name': 'Weniger Rum', 'recipe_changes': {'Daiquiri': {'Rum': 45.0}}}
+    ]
+
+def test_unknown_drink_in_sale_prices_is_rejected(recipes, inventory):
+    with pytest.raises(ValueError):
+        evaluate_scenarios(recipes, inventory, [{'name': 'Tippfehler', 'sale_prices': {'Mojto': 9.0}}])
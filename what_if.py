@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+
+from data_processor import map_products_to_drinks
+from sales_history import get_product_sales
+from metrics import get_logger, log_error
+
+logger = get_logger('what_if')
+
+# Art der Änderung in einer Szenario-Tabelle (siehe scenarios_from_table)
+SCENARIO_CHANGE_TYPES = ['ingredient_price', 'recipe_amount', 'add_drink', 'remove_drink', 'sale_price', 'quantity']
+SCENARIO_COLUMNS = ['scenario', 'change', 'drink_name', 'ingredient_name', 'value']
+
+WHAT_IF_DRINK_COLUMNS = [
+    'scenario', 'drink_name', 'active', 'quantity', 'unit_cost', 'unit_cost_delta', 'sale_price',
+    'unit_margin', 'unit_margin_delta', 'contribution_margin', 'contribution_margin_delta',
+    'ingredient_demand_ml', 'ingredient_demand_delta_ml'
+]
+WHAT_IF_INGREDIENT_COLUMNS = ['scenario', 'ingredient_name', 'demand_ml', 'demand_delta_ml', 'cost', 'cost_delta']
+
+def get_drink_sales(sales_history, recipe_data, period_type='month', period_key=None, product_mapping=None):
+    """
+    Get the quantity sold and the average gross sale price per drink of a period
+
+    Args:
+        sales_history: Sales history dictionary
+        recipe_data: Recipe DataFrame
+        period_type: One of 'day', 'week', 'month', 'year'
+        period_key: Period (default: the latest period)
+        product_mapping: Optional dictionary {product name: drink name}
+
+    Returns:
+        pandas.DataFrame: drink_name, quantity and sale_price
+    """
+    product_sales = get_product_sales(sales_history, period_type, period_key)
+    mapping = map_products_to_drinks(product_sales['product_name'], recipe_data, product_mapping)
+    sales = product_sales.assign(drink_name=product_sales['product_name'].map(mapping)).dropna(subset=['drink_name'])
+
+    drink_sales = sales.groupby('drink_name', as_index=False)[['quantity', 'total']].sum()
+    drink_sales['sale_price'] = drink_sales['total'] / drink_sales['quantity'].where(drink_sales['quantity'] > 0)
+    return drink_sales[['drink_name', 'quantity', 'sale_price']]
+
+def scenarios_from_table(scenario_table):
+    """
+    Convert a table of changes (one row per change) into scenario dictionaries
+
+    Columns: scenario, change, drink_name, ingredient_name and value. change is
+    one of SCENARIO_CHANGE_TYPES; add_drink rows give one ingredient of the
+    new drink with its amount, remove_drink rows only need the drink.
+
+    Args:
+        scenario_table: DataFrame with the columns of SCENARIO_COLUMNS
+
+    Returns:
+        list: Scenario dictionaries for evaluate_scenarios, in the order of the table
+    """
+    scenarios = {}
+    for row in scenario_table.dropna(subset=['scenario', 'change']).itertuples(index=False):
+        scenario = scenarios.setdefault(row.scenario, {'name': row.scenario})
+        if row.change == 'ingredient_price':
+            scenario.setdefault('ingredient_prices', {})[row.ingredient_name] = float(row.value)
+        elif row.change == 'recipe_amount':
+            scenario.setdefault('recipe_changes', {}).setdefault(row.drink_name, {})[row.ingredient_name] = float(row.value)
+        elif row.change == 'add_drink':
+            scenario.setdefault('added_drinks', {}).setdefault(row.drink_name, {})[row.ingredient_name] = float(row.value)
+        elif row.change == 'remove_drink':
+            scenario.setdefault('removed_drinks', []).append(row.drink_name)
+        elif row.change == 'sale_price':
+            scenario.setdefault('sale_prices', {})[row.drink_name] = float(row.value)
+        elif row.change == 'quantity':
+            scenario.setdefault('quantities', {})[row.drink_name] = float(row.value)
+        else:
+            raise ValueError(f"Unknown change type: {row.change}")
+    return list(scenarios.values())
+
+def _get_scenario_axes(recipe_data, inventory_data, scenarios):
+    """Get the drinks and ingredients of the base menu and all scenarios, base drinks first"""
+    drinks = list(pd.unique(recipe_data['drink_name']))
+    ingredients = list(pd.unique(pd.concat([recipe_data['ingredient_name'],
+                                            inventory_data['ingredient_name'].dropna()])))
+    for scenario in scenarios:
+        for changes in (scenario.get('recipe_changes', {}), scenario.get('added_drinks', {})):
+            for drink_name, amounts in changes.items():
+                if drink_name not in drinks:
+                    drinks.append(drink_name)
+                ingredients.extend(name for name in amounts if name not in ingredients)
+        ingredients.extend(name for name in scenario.get('ingredient_prices', {}) if name not in ingredients)
+
+    # Preise und Mengen nur für Drinks, die es in der Karte oder einem Szenario gibt
+    for scenario in scenarios:
+        for field in ('sale_prices', 'quantities'):
+            unknown = [name for name in scenario.get(field, {}) if name not in drinks]
+            if unknown:
+                raise ValueError(f"Unknown drinks in {field} of scenario "
+                                 f"{scenario.get('name', '')}: {', '.join(map(str, unknown))}")
+    return drinks, ingredients
+
+def evaluate_scenarios(recipe_data, inventory_data, scenarios, drink_sales=None, vat_rate=0.19):
+    """
+    Evaluate many hypothetical changes of prices, recipes and menu at once
+
+    Every scenario is a dictionary with a name and any of:
+        ingredient_prices: {ingredient: price per liter}
+        recipe_changes: {drink: {ingredient: amount_ml}} (0 removes the ingredient)
+        added_drinks: {drink: {ingredient: amount_ml}}
+        removed_drinks: [drink, ...]
+        sale_prices: {drink: gross sale price}
+        quantities: {drink: quantity per period}
+
+    The base recipes form one drink x ingredient matrix. The costs and the
+    ingredient demand of all scenarios come from one matrix product of that
+    matrix with the price (and quantity) matrix of all scenarios; recipe
+    changes are applied as sparse corrections on top. The unchanged menu is
+    evaluated the same way and is the reference for all deltas.
+
+    Args:
+        recipe_data: Recipe DataFrame
+        inventory_data: Inventory DataFrame
+        scenarios: List of scenario dictionaries (see scenarios_from_table)
+        drink_sales: Optional DataFrame with drink_name, quantity and sale_price
+            (see get_drink_sales); without it, quantities are 0 and margins unknown
+        vat_rate: VAT rate included in the sale prices
+
+    Returns:
+        tuple: (drinks, ingredients) DataFrames with the results per scenario and drink or ingredient
+
+    Raises:
+        ValueError: If a scenario sets a sale price or quantity of a drink that is neither
+            on the menu nor added by a scenario
+    """
+    # Rezeptzeilen ohne Drink oder Zutat gehören zu keinem Drink der Karte
+    recipe_data = recipe_data.dropna(subset=['drink_name', 'ingredient_name'])
+    # Achsen: alle Drinks und Zutaten der Basis und aller Szenarien
+    drinks, ingredients = _get_scenario_axes(recipe_data, inventory_data, scenarios)
+
+    try:
+        drink_index = {name: i for i, name in enumerate(drinks)}
+        ingredient_index = {name: i for i, name in enumerate(ingredients)}
+        n_scenarios = len(scenarios) + 1  # Zeile 0 ist das unveränderte Menü
+
+        base_recipes = np.zeros((len(drinks), len(ingredients)))
+        np.add.at(base_recipes, (recipe_data['drink_name'].map(drink_index).to_numpy(),
+                                 recipe_data['ingredient_name'].map(ingredient_index).to_numpy()),
+                  recipe_data['amount_ml'].to_numpy(dtype=float))
+        base_prices = np.zeros(len(ingredients))
+        prices = inventory_data.dropna(subset=['ingredient_name']).drop_duplicates('ingredient_name')
+        base_prices[prices['ingredient_name'].map(ingredient_index).to_numpy()] = (
+            prices['price_per_liter'].fillna(0).to_numpy(dtype=float) / 1000)
+
+        base_quantity = np.zeros(len(drinks))
+        base_sale_price = np.full(len(drinks), np.nan)
+        if drink_sales is not None:
+            known = drink_sales[drink_sales['drink_name'].isin(drink_index)]
+            positions = known['drink_name'].map(drink_index).to_numpy()
+            base_quantity[positions] = known['quantity'].to_numpy(dtype=float)
+            base_sale_price[positions] = known['sale_price'].to_numpy(dtype=float)
+
+        price_matrix = np.tile(base_prices, (n_scenarios, 1))
+        quantity = np.tile(base_quantity, (n_scenarios, 1))
+        sale_price = np.tile(base_sale_price, (n_scenarios, 1))
+        active = np.tile(pd.Series(drinks).isin(recipe_data['drink_name']).to_numpy(), (n_scenarios, 1))
+
+        # Änderungen als Koordinatenlisten sammeln und in einem Schritt eintragen
+        recipe_amounts = {}
+        for s, scenario in enumerate(scenarios, 1):
+            for name, price in scenario.get('ingredient_prices', {}).items():
+                price_matrix[s, ingredient_index[name]] = price / 1000
+            for changes in (scenario.get('recipe_changes', {}), scenario.get('added_drinks', {})):
+                for drink_name, amounts in changes.items():
+                    active[s, drink_index[drink_name]] = True
+                    for name, amount in amounts.items():
+                        recipe_amounts[(s, drink_index[drink_name], ingredient_index[name])] = amount
+            for drink_name in scenario.get('removed_drinks', []):
+                if drink_name in drink_index:
+                    active[s, drink_index[drink_name]] = False
+            for drink_name, price in scenario.get('sale_prices', {}).items():
+                sale_price[s, drink_index[drink_name]] = price
+            for drink_name, drink_quantity in scenario.get('quantities', {}).items():
+                quantity[s, drink_index[drink_name]] = drink_quantity
+        quantity[~active] = 0
+
+        # Ein Matrixprodukt für alle Szenarien, Rezeptänderungen als dünn besetzte Korrektur
+        unit_cost = price_matrix @ base_recipes.T
+        drink_amount = np.tile(base_recipes.sum(axis=1), (n_scenarios, 1))
+        demand = quantity @ base_recipes
+        if recipe_amounts:
+            coordinates = np.array(list(recipe_amounts.keys()))
+            s_index, d_index, i_index = coordinates[:, 0], coordinates[:, 1], coordinates[:, 2]
+            amount_delta = np.array(list(recipe_amounts.values()), dtype=float) - base_recipes[d_index, i_index]
+            np.add.at(unit_cost, (s_index, d_index), amount_delta * price_matrix[s_index, i_index])
+            np.add.at(drink_amount, (s_index, d_index), amount_delta)
+            np.add.at(demand, (s_index, i_index), amount_delta * quantity[s_index, d_index])
+
+        unit_cost = np.where(active, unit_cost, np.nan)
+        unit_margin = sale_price / (1 + vat_rate) - unit_cost
+        contribution = np.where(active, np.nan_to_num(unit_margin) * quantity, 0)
+        drink_demand = quantity * drink_amount
+        ingredient_cost = demand * price_matrix
+
+        names = ['Basis'] + [scenario.get('name', f"Szenario {s}") for s, scenario in enumerate(scenarios, 1)]
+        drink_results = pd.DataFrame({
+            'scenario': np.repeat(names, len(drinks)),
+            'drink_name': np.tile(np.array(drinks, dtype=object), n_scenarios),
+            'active': active.ravel(),
+            'quantity': quantity.ravel(),
+            'unit_cost': unit_cost.ravel(),
+            'unit_cost_delta': (unit_cost - unit_cost[0]).ravel(),
+            'sale_price': sale_price.ravel(),
+            'unit_margin': unit_margin.ravel(),
+            'unit_margin_delta': (unit_margin - unit_margin[0]).ravel(),
+            'contribution_margin': contribution.ravel(),
+            'contribution_margin_delta': (contribution - contribution[0]).ravel(),
+            'ingredient_demand_ml': drink_demand.ravel(),
+            'ingredient_demand_delta_ml': (drink_demand - drink_demand[0]).ravel()
+        })
+        ingredient_results = pd.DataFrame({
+            'scenario': np.repeat(names, len(ingredients)),
+            'ingredient_name': np.tile(np.array(ingredients, dtype=object), n_scenarios),
+            'demand_ml': demand.ravel(),
+            'demand_delta_ml': (demand - demand[0]).ravel(),
+            'cost': ingredient_cost.ravel(),
+            'cost_delta': (ingredient_cost - ingredient_cost[0]).ravel()
+        })
+        return drink_results[WHAT_IF_DRINK_COLUMNS], ingredient_results[WHAT_IF_INGREDIENT_COLUMNS]
+
+    except Exception as e:
+        log_error(logger, "Error evaluating what-if scenarios", e)
+        return None, None
+
+def summarize_scenarios(drink_results):
+    """
+    Sum up the results of evaluate_scenarios per scenario
+
+    Args:
+        drink_results: First result of evaluate_scenarios
+
+    Returns:
+        pandas.DataFrame: Contribution margin, its delta and the number of drinks on the menu per scenario
+    """
+    summary = drink_results.groupby('scenario', sort=False).agg(
+        drinks=('active', 'sum'),
+        contribution_margin=('contribution_margin', 'sum'),
+        contribution_margin_delta=('contribution_margin_delta', 'sum'),
+        ingredient_demand_ml=('ingredient_demand_ml', 'sum')
+    )
+    return summary.reset_index()